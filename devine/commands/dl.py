@@ -45,6 +45,7 @@ from devine.core.constants import DOWNLOAD_LICENCE_ONLY, AnyTrack, context_setti
 from devine.core.credential import Credential
 from devine.core.drm import DRM_T, Widevine
 from devine.core.events import events
+from devine.core.manifests import DASH
 from devine.core.proxies import Basic, Hola, NordVPN
 from devine.core.service import Service
 from devine.core.services import Services
@@ -506,6 +507,11 @@ class dl:
                         kept_tracks.extend(title.tracks.chapters)
                     title.tracks = Tracks(kept_tracks)
 
+            # the selected tracks only need their part of the manifest to be downloaded,
+            # so let the rest of it, and the tracks that were not selected, be freed
+            for track in title.tracks:
+                DASH.release_manifest(track)
+
             selected_tracks, tracks_progress_callables = title.tracks.tree(add_progress=True)
 
             download_table = Table.grid()
@@ -42,6 +42,7 @@ class Config:
         self.cdm: dict = kwargs.get("cdm") or {}
         self.chapter_fallback_name: str = kwargs.get("chapter_fallback_name") or ""
         self.curl_impersonate: dict = kwargs.get("curl_impersonate") or {}
+        self.decryption: dict = kwargs.get("decryption") or {}
         self.remote_cdm: list[dict] = kwargs.get("remote_cdm") or []
         self.credentials: dict = kwargs.get("credentials") or {}
 
@@ -63,6 +64,8 @@ class Config:
         self.muxing: dict = kwargs.get("muxing") or {}
         self.nordvpn: dict = kwargs.get("nordvpn") or {}
         self.proxy_providers: dict = kwargs.get("proxy_providers") or {}
+        self.requests: dict = kwargs.get("requests") or {}
+        self.scheduler: dict = kwargs.get("scheduler") or {}
         self.serve: dict = kwargs.get("serve") or {}
         self.services: dict = kwargs.get("services") or {}
         self.set_terminal_bg: bool = kwargs.get("set_terminal_bg", True)
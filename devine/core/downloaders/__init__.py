@@ -1,5 +1,6 @@
 from .aria2c import aria2c
+from .curl_async import curl_async
 from .curl_impersonate import curl_impersonate
 from .requests import requests
 
-__all__ = ("aria2c", "curl_impersonate", "requests")
+__all__ = ("aria2c", "curl_async", "curl_impersonate", "requests")
@@ -0,0 +1,437 @@
+import asyncio
+import math
+import queue
+import threading
+import time
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Any, AsyncGenerator, Generator, MutableMapping, Optional, Sequence, Union
+
+from curl_cffi import CurlOpt
+from curl_cffi.requests import AsyncSession
+from rich import filesize
+
+from devine.core.config import config
+from devine.core.constants import DOWNLOAD_CANCELLED
+from devine.core.scheduler import scheduler
+from devine.core.utilities import get_extension
+from devine.core.utils.control_file import (ControlFile, can_resume, get_missing_size, get_resume_headers,
+                                            get_resume_state, is_resumed)
+
+MAX_ATTEMPTS = 5
+RETRY_WAIT = 2
+WRITE_BUFFER_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.2
+PROGRESS_WINDOW = 5
+STATE_SAVE_INTERVAL = 1  # how often to save the state of a resumable download, in seconds
+MAX_WORKERS = 64
+BROWSER = config.curl_impersonate.get("browser", "chrome124")
+
+
+async def download(
+    url: str,
+    save_path: Path,
+    session: AsyncSession,
+    segmented: bool = False,
+    **kwargs: Any
+) -> AsyncGenerator[dict[str, Any], None]:
+    """
+    Download a file using Curl Impersonate with asyncio.
+    https://github.com/lwthiker/curl-impersonate
+
+    This is the asyncio equivalent of the Curl Impersonate downloader's download()
+    function, and it yields the same download status updates. Interrupted downloads
+    are resumed the same way.
+
+    Parameters:
+        url: Web URL of a file to download.
+        save_path: The path to save the file to. If the save path's directory does not
+            exist then it will be made automatically.
+        session: The Curl-Impersonate AsyncSession to make HTTP requests with. Useful to
+            set Header, Cookie, and Proxy data. Connections are saved and re-used with
+            the session, and HTTP/2 connections are shared by concurrent requests.
+        segmented: If downloads are segments or parts of one bigger file.
+        kwargs: Any extra keyword arguments to pass to the session.stream() call. Use
+            this for one-time request changes like a header, cookie, or proxy. For
+            example, to request Byte-ranges use e.g., `headers={"Range": "bytes=0-128"}`.
+    """
+    save_dir = save_path.parent
+    control_file = ControlFile(save_path)
+
+    save_dir.mkdir(parents=True, exist_ok=True)
+
+    state = None
+    if control_file.exists():
+        state = control_file.load()
+        if not can_resume(state, url) or not save_path.exists():
+            # consider the file corrupt if it cannot be resumed
+            state = None
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
+    elif save_path.exists():
+        # if it exists, and no control file, then it should be safe
+        yield dict(
+            file_downloaded=save_path,
+            written=save_path.stat().st_size
+        )
+        return
+
+    if not state:
+        control_file.create()
+
+    headers = kwargs.pop("headers", None) or {}
+    # segments are small enough to just download again, and byte ranges of a file
+    # cannot be resumed with further byte ranges
+    resumable = not segmented and not any(k.lower() == "range" for k in headers)
+
+    written = 0
+    attempts = 1
+    try:
+        while True:
+            progress_size = 0
+            last_progress_refresh = time.time()
+            download_sizes = []
+            last_speed_refresh = time.time()
+            last_state_save = time.time()
+
+            try:
+                if state:
+                    missing = state["missing"][0]
+                    request_headers = {**headers, **get_resume_headers(state, *missing)}
+                else:
+                    request_headers = headers
+
+                async with session.stream("GET", url, headers=request_headers, **kwargs) as stream:
+                    stream.raise_for_status()
+
+                    if state:
+                        if not is_resumed(stream, state, missing[0]):
+                            # the file has changed, or Range requests are no longer supported
+                            state = None
+                            continue
+                        yield dict(total=state["size"], completed=state["size"] - get_missing_size(state))
+                    else:
+                        if resumable:
+                            state = get_resume_state(url, stream)
+                        if state:
+                            missing = state["missing"][0]
+                            control_file.save(state)
+
+                        try:
+                            content_length = int(stream.headers.get("Content-Length", "0"))
+                        except ValueError:
+                            content_length = 0
+
+                        if content_length > 0:
+                            yield dict(total=content_length, completed=0)
+                        else:
+                            # we have no data to calculate total size
+                            yield dict(total=None, completed=0)  # indeterminate mode
+
+                    with open(
+                        save_path,
+                        "r+b" if stream.status_code == 206 and state else "wb",
+                        buffering=WRITE_BUFFER_SIZE
+                    ) as f:
+                        if state:
+                            f.seek(missing[0])
+                        async for chunk in stream.aiter_content():
+                            download_size = len(chunk)
+                            f.write(chunk)
+                            written += download_size
+
+                            if state:
+                                missing[0] += download_size
+
+                            progress_size += download_size
+                            download_sizes.append(download_size)
+
+                            now = time.time()
+                            if now - last_progress_refresh > PROGRESS_INTERVAL:
+                                yield dict(advance=progress_size)
+                                progress_size = 0
+                                last_progress_refresh = now
+
+                            time_since = now - last_speed_refresh
+                            if time_since > PROGRESS_WINDOW:
+                                data_size = sum(download_sizes)
+                                download_speed = math.ceil(data_size / (time_since or 1))
+                                yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+                                last_speed_refresh = now
+                                download_sizes.clear()
+
+                            if state and now - last_state_save > STATE_SAVE_INTERVAL:
+                                # the saved state must never run ahead of what was written
+                                f.flush()
+                                control_file.save(state)
+                                last_state_save = now
+
+                if progress_size:
+                    yield dict(advance=progress_size)
+                if download_sizes:
+                    time_since = time.time() - last_speed_refresh
+                    download_speed = math.ceil(sum(download_sizes) / (time_since or 1))
+                    yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+
+                if state:
+                    if missing[0] <= missing[1]:
+                        raise IOError(f"Download ended early, {missing[1] - missing[0] + 1} bytes are missing")
+                    state["missing"].pop(0)
+                    if state["missing"]:
+                        # the download was split, continue with the next missing byte range
+                        control_file.save(state)
+                        continue
+
+                break
+            except Exception as e:
+                if state:
+                    # keep what was downloaded, only the rest is downloaded again
+                    control_file.save(state)
+                else:
+                    save_path.unlink(missing_ok=True)
+                if DOWNLOAD_CANCELLED.is_set() or attempts == MAX_ATTEMPTS:
+                    raise e
+                await asyncio.sleep(RETRY_WAIT)
+                attempts += 1
+    except BaseException:
+        if state:
+            # keep the control file so that a future download can be resumed
+            control_file.save(state)
+        else:
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
+        raise
+
+    control_file.delete()
+
+    yield dict(
+        file_downloaded=save_path,
+        written=written
+    )
+
+
+def curl_async(
+    urls: Union[str, dict[str, Any], Sequence[Union[str, dict[str, Any]]]],
+    output_dir: Path,
+    filename: str,
+    headers: Optional[MutableMapping[str, Union[str, bytes]]] = None,
+    cookies: Optional[Union[MutableMapping[str, str], CookieJar]] = None,
+    proxy: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    priority: int = 0
+) -> Generator[dict[str, Any], None, None]:
+    """
+    Download files using Curl Impersonate with asyncio.
+    https://github.com/lwthiker/curl-impersonate
+
+    All files are downloaded concurrently by one asyncio event loop running in its own
+    thread, instead of one thread for each concurrent download. Concurrent downloads
+    from a host that supports HTTP/2 are multiplexed over a single connection.
+
+    Yields the following download status updates while chunks are downloading:
+
+    - {total: 123} (there are 123 files, or 123 bytes of a single file, to download)
+    - {total: None} (there are an unknown number of bytes to download)
+    - {advance: 1} (one file, or byte of a single file, was downloaded)
+    - {downloaded: "10.1 MB/s"} (currently downloading at a rate of 10.1 MB/s)
+    - {file_downloaded: Path(...), written: 1024} (download finished, has the save path and size)
+
+    The data is in the same format accepted by rich's progress.update() function.
+    However, The `downloaded`, `file_downloaded` and `written` keys are custom and not
+    natively accepted by rich progress bars.
+
+    Parameters:
+        urls: Web URL(s) to file(s) to download. You can use a dictionary with the key
+            "url" for the URI, and other keys for extra arguments to use per-URL. Any
+            sequence of them may be used, e.g., one that makes each URL when accessed.
+        output_dir: The folder to save the file into. If the save path's directory does
+            not exist then it will be made automatically.
+        filename: The filename or filename template to use for each file. The variables
+            you can use are `i` for the URL index and `ext` for the URL extension.
+        headers: A mapping of HTTP Header Key/Values to use for all downloads.
+        cookies: A mapping of Cookie Key/Values or a Cookie Jar to use for all downloads.
+        proxy: An optional proxy URI to route connections through for all downloads.
+        max_workers: The maximum amount of concurrent downloads. Defaults to 64.
+        priority: The priority of these downloads in the download scheduler, which
+            limits the amount of connections made across all tracks. Downloads with a
+            higher priority get a connection first.
+    """
+    if not urls:
+        raise ValueError("urls must be provided and not empty")
+    elif not isinstance(urls, (str, dict, Sequence)):
+        raise TypeError(f"Expected urls to be {str} or {dict} or a sequence of one of them, not {type(urls)}")
+
+    if not output_dir:
+        raise ValueError("output_dir must be provided")
+    elif not isinstance(output_dir, Path):
+        raise TypeError(f"Expected output_dir to be {Path}, not {type(output_dir)}")
+
+    if not filename:
+        raise ValueError("filename must be provided")
+    elif not isinstance(filename, str):
+        raise TypeError(f"Expected filename to be {str}, not {type(filename)}")
+
+    if not isinstance(headers, (MutableMapping, type(None))):
+        raise TypeError(f"Expected headers to be {MutableMapping}, not {type(headers)}")
+
+    if not isinstance(cookies, (MutableMapping, CookieJar, type(None))):
+        raise TypeError(f"Expected cookies to be {MutableMapping} or {CookieJar}, not {type(cookies)}")
+
+    if not isinstance(proxy, (str, type(None))):
+        raise TypeError(f"Expected proxy to be {str}, not {type(proxy)}")
+
+    if not isinstance(max_workers, (int, type(None))):
+        raise TypeError(f"Expected max_workers to be {int}, not {type(max_workers)}")
+
+    if not isinstance(priority, int):
+        raise TypeError(f"Expected priority to be {int}, not {type(priority)}")
+
+    if isinstance(urls, (str, dict)):
+        urls = [urls]
+
+    if not max_workers:
+        max_workers = MAX_WORKERS
+
+    def get_url_args(i: int) -> dict[str, Any]:
+        # made as each URL is needed, as there may be many thousands of them
+        url = urls[i]
+        if not isinstance(url, dict):
+            url = dict(url=url)
+        return dict(
+            save_path=output_dir / filename.format(i=i, ext=get_extension(url["url"])),
+            **url
+        )
+
+    if headers:
+        headers = {
+            k: v
+            for k, v in headers.items()
+            if k.lower() != "accept-encoding"
+        }
+
+    # the event loop thread hands over status updates, lists of a finished file's
+    # status updates, exceptions, and finally None once everything has downloaded
+    status_updates: queue.Queue = queue.Queue()
+
+    async def download_segment(session: AsyncSession, url: dict[str, Any]) -> list[dict[str, Any]]:
+        async with scheduler.aslot(url["url"], owner=session, priority=priority):
+            return [status_update async for status_update in download(session=session, segmented=True, **url)]
+
+    async def download_all() -> None:
+        async with AsyncSession(
+            impersonate=BROWSER,
+            max_clients=max_workers,
+            # wait for the first connection to a host to say if it can multiplex, instead
+            # of opening a new connection for every request made in the meantime
+            curl_options={CurlOpt.PIPEWAIT: 1},
+            headers=headers,
+            cookies=cookies,
+            proxies={"all": proxy} if proxy else None
+        ) as session:
+            if len(urls) == 1:
+                # a single file, stream its download progress instead
+                url = get_url_args(0)
+                async with scheduler.aslot(url["url"], owner=session, priority=priority):
+                    async for status_update in download(session=session, **url):
+                        status_updates.put(status_update)
+                return
+
+            # a task is only made for a URL once one of the max_workers is free, rather
+            # than one for every URL up front, as there may be many thousands of them
+            tasks: set[asyncio.Task] = set()
+            next_url = 0
+            try:
+                while next_url < len(urls) or tasks:
+                    while next_url < len(urls) and len(tasks) < max_workers:
+                        tasks.add(asyncio.create_task(download_segment(session, get_url_args(next_url))))
+                        next_url += 1
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        status_updates.put(task.result())
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    main_task = loop.create_task(download_all())
+
+    def run_loop() -> None:
+        try:
+            loop.run_until_complete(main_task)
+        except BaseException as e:
+            status_updates.put(e)
+        else:
+            status_updates.put(None)
+        finally:
+            loop.close()
+
+    yield dict(total=len(urls))
+
+    download_sizes = []
+    last_speed_refresh = time.time()
+
+    loop_thread = threading.Thread(target=run_loop, name="curl_async", daemon=True)
+    loop_thread.start()
+
+    try:
+        while True:
+            status_update = status_updates.get()
+            if status_update is None:
+                break
+            if isinstance(status_update, asyncio.CancelledError):
+                raise KeyboardInterrupt()
+            if isinstance(status_update, BaseException):
+                raise status_update
+            if isinstance(status_update, dict):
+                yield status_update
+                continue
+
+            download_size = 0
+            for segment_status_update in status_update:
+                if segment_status_update.get("file_downloaded"):
+                    # per-chunk updates are only useful if it's one big file
+                    download_size += segment_status_update.get("written") or 0
+                    yield segment_status_update
+
+            yield dict(advance=1)
+
+            now = time.time()
+            time_since = now - last_speed_refresh
+            if download_size:  # no size == skipped dl
+                download_sizes.append(download_size)
+            if download_sizes and time_since > PROGRESS_WINDOW:
+                data_size = sum(download_sizes)
+                download_speed = math.ceil(data_size / (time_since or 1))
+                yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+                last_speed_refresh = now
+                download_sizes.clear()
+    except KeyboardInterrupt:
+        DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+        yield dict(downloaded="[yellow]CANCELLING")
+        stop_loop(loop, main_task, loop_thread)
+        yield dict(downloaded="[yellow]CANCELLED")
+        # tell dl that it was cancelled
+        raise
+    except Exception:
+        DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+        yield dict(downloaded="[red]FAILING")
+        stop_loop(loop, main_task, loop_thread)
+        yield dict(downloaded="[red]FAILED")
+        # tell dl that it failed
+        raise
+    finally:
+        stop_loop(loop, main_task, loop_thread)
+
+
+def stop_loop(loop: asyncio.AbstractEventLoop, main_task: asyncio.Task, loop_thread: threading.Thread) -> None:
+    """Cancel all downloads of an event loop thread and wait for it to finish."""
+    if loop_thread.is_alive():
+        try:
+            loop.call_soon_threadsafe(main_task.cancel)
+        except RuntimeError:
+            pass  # the loop has just closed
+        loop_thread.join()
+
+
+__all__ = ("curl_async",)
@@ -1,22 +1,28 @@
 import math
+import os
 import time
-from concurrent import futures
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from concurrent.futures.thread import ThreadPoolExecutor
 from http.cookiejar import CookieJar
 from pathlib import Path
-from typing import Any, Generator, MutableMapping, Optional, Union
+from typing import Any, Generator, MutableMapping, Optional, Sequence, Union
 
 from curl_cffi.requests import Session
 from rich import filesize
 
 from devine.core.config import config
 from devine.core.constants import DOWNLOAD_CANCELLED
+from devine.core.scheduler import scheduler
 from devine.core.utilities import get_extension
+from devine.core.utils.control_file import (ControlFile, can_resume, get_missing_size, get_resume_headers,
+                                            get_resume_state, is_resumed)
 
 MAX_ATTEMPTS = 5
 RETRY_WAIT = 2
-CHUNK_SIZE = 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.2
 PROGRESS_WINDOW = 5
+STATE_SAVE_INTERVAL = 1  # how often to save the state of a resumable download, in seconds
 BROWSER = config.curl_impersonate.get("browser", "chrome124")
 
 
@@ -24,6 +30,7 @@ def download(
     url: str,
     save_path: Path,
     session: Session,
+    segmented: bool = False,
     **kwargs: Any
 ) -> Generator[dict[str, Any], None, None]:
     """
@@ -32,12 +39,15 @@ def download(
 
     Yields the following download status updates while chunks are downloading:
 
-    - {total: 123} (there are 123 chunks to download)
-    - {total: None} (there are an unknown number of chunks to download)
-    - {advance: 1} (one chunk was downloaded)
+    - {total: 123} (there are 123 bytes to download)
+    - {total: None} (there are an unknown number of bytes to download)
+    - {advance: 1024} (1024 more bytes were downloaded)
     - {downloaded: "10.1 MB/s"} (currently downloading at a rate of 10.1 MB/s)
     - {file_downloaded: Path(...), written: 1024} (download finished, has the save path and size)
 
+    Progress updates are not yielded for every chunk, they are combined and yielded
+    at most every 0.2 seconds.
+
     The data is in the same format accepted by rich's progress.update() function. The
     `downloaded` key is custom and is not natively accepted by all rich progress bars.
 
@@ -48,93 +58,184 @@ def download(
         session: The Requests or Curl-Impersonate Session to make HTTP requests with.
             Useful to set Header, Cookie, and Proxy data. Connections are saved and
             re-used with the session so long as the server keeps the connection alive.
+        segmented: If downloads are segments or parts of one bigger file.
         kwargs: Any extra keyword arguments to pass to the session.get() call. Use this
             for one-time request changes like a header, cookie, or proxy. For example,
             to request Byte-ranges use e.g., `headers={"Range": "bytes=0-128"}`.
+
+    If the download of a whole file is interrupted, the control file next to it keeps
+    track of the byte ranges still missing along with the file's ETag or Last-Modified
+    date. The next download of the same URL to the same path only requests the missing
+    byte ranges, unless the file has changed since, in which case it starts over.
     """
     save_dir = save_path.parent
-    control_file = save_path.with_name(f"{save_path.name}.!dev")
+    control_file = ControlFile(save_path)
 
     save_dir.mkdir(parents=True, exist_ok=True)
 
+    state = None
     if control_file.exists():
-        # consider the file corrupt if the control file exists
-        save_path.unlink(missing_ok=True)
-        control_file.unlink()
+        state = control_file.load()
+        if not can_resume(state, url) or not save_path.exists():
+            # consider the file corrupt if it cannot be resumed
+            state = None
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
     elif save_path.exists():
         # if it exists, and no control file, then it should be safe
         yield dict(
             file_downloaded=save_path,
             written=save_path.stat().st_size
         )
+        return
+
+    if not state:
+        control_file.create()
 
-    # TODO: Design a control file format so we know how much of the file is missing
-    control_file.write_bytes(b"")
+    headers = kwargs.pop("headers", None) or {}
+    # segments are small enough to just download again, and byte ranges of a file
+    # cannot be resumed with further byte ranges
+    resumable = not segmented and not any(k.lower() == "range" for k in headers)
 
+    written = 0
     attempts = 1
     try:
         while True:
-            written = 0
+            progress_size = 0
+            last_progress_refresh = time.time()
             download_sizes = []
             last_speed_refresh = time.time()
+            last_state_save = time.time()
 
             try:
-                stream = session.get(url, stream=True, **kwargs)
-                stream.raise_for_status()
-
-                try:
-                    content_length = int(stream.headers.get("Content-Length", "0"))
-                except ValueError:
-                    content_length = 0
-
-                if content_length > 0:
-                    yield dict(total=math.ceil(content_length / CHUNK_SIZE))
+                if state:
+                    missing = state["missing"][0]
+                    stream = session.get(
+                        url,
+                        stream=True,
+                        headers={**headers, **get_resume_headers(state, *missing)},
+                        **kwargs
+                    )
+                    stream.raise_for_status()
+                    if not is_resumed(stream, state, missing[0]):
+                        # the file has changed, or Range requests are no longer supported
+                        stream.close()
+                        state = None
+                        continue
+                    yield dict(total=state["size"], completed=state["size"] - get_missing_size(state))
                 else:
-                    # we have no data to calculate total chunks
-                    yield dict(total=None)  # indeterminate mode
-
-                with open(save_path, "wb") as f:
-                    for chunk in stream.iter_content(chunk_size=CHUNK_SIZE):
+                    stream = session.get(url, stream=True, headers=headers, **kwargs)
+                    stream.raise_for_status()
+                    if resumable:
+                        state = get_resume_state(url, stream)
+                    if state:
+                        missing = state["missing"][0]
+                        control_file.save(state)
+
+                    try:
+                        content_length = int(stream.headers.get("Content-Length", "0"))
+                    except ValueError:
+                        content_length = 0
+
+                    if content_length > 0:
+                        yield dict(total=content_length, completed=0)
+                    else:
+                        # we have no data to calculate total size
+                        yield dict(total=None, completed=0)  # indeterminate mode
+
+                # curl hands over whatever it has received, which is often small, so
+                # buffer the writes rather than making a system call for each chunk
+                with open(
+                    save_path,
+                    "r+b" if stream.status_code == 206 and state else "wb",
+                    buffering=WRITE_BUFFER_SIZE
+                ) as f:
+                    if state:
+                        f.seek(missing[0])
+                    for chunk in stream.iter_content():
                         download_size = len(chunk)
                         f.write(chunk)
                         written += download_size
 
-                        yield dict(advance=1)
+                        if state:
+                            missing[0] += download_size
+
+                        progress_size += download_size
+                        download_sizes.append(download_size)
 
                         now = time.time()
-                        time_since = now - last_speed_refresh
+                        if now - last_progress_refresh > PROGRESS_INTERVAL:
+                            yield dict(advance=progress_size)
+                            progress_size = 0
+                            last_progress_refresh = now
 
-                        download_sizes.append(download_size)
-                        if time_since > PROGRESS_WINDOW or download_size < CHUNK_SIZE:
+                        time_since = now - last_speed_refresh
+                        if time_since > PROGRESS_WINDOW:
                             data_size = sum(download_sizes)
                             download_speed = math.ceil(data_size / (time_since or 1))
                             yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
                             last_speed_refresh = now
                             download_sizes.clear()
 
-                yield dict(
-                    file_downloaded=save_path,
-                    written=written
-                )
+                        if state and now - last_state_save > STATE_SAVE_INTERVAL:
+                            # the saved state must never run ahead of what was written
+                            f.flush()
+                            control_file.save(state)
+                            last_state_save = now
+
+                if progress_size:
+                    yield dict(advance=progress_size)
+                if download_sizes:
+                    time_since = time.time() - last_speed_refresh
+                    download_speed = math.ceil(sum(download_sizes) / (time_since or 1))
+                    yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+
+                if state:
+                    if missing[0] <= missing[1]:
+                        raise IOError(f"Download ended early, {missing[1] - missing[0] + 1} bytes are missing")
+                    state["missing"].pop(0)
+                    if state["missing"]:
+                        # the download was split, continue with the next missing byte range
+                        control_file.save(state)
+                        continue
+
                 break
             except Exception as e:
-                save_path.unlink(missing_ok=True)
+                if state:
+                    # keep what was downloaded, only the rest is downloaded again
+                    control_file.save(state)
+                else:
+                    save_path.unlink(missing_ok=True)
                 if DOWNLOAD_CANCELLED.is_set() or attempts == MAX_ATTEMPTS:
                     raise e
                 time.sleep(RETRY_WAIT)
                 attempts += 1
-    finally:
-        control_file.unlink()
+    except BaseException:
+        if state:
+            # keep the control file so that a future download can be resumed
+            control_file.save(state)
+        else:
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
+        raise
+
+    control_file.delete()
+
+    yield dict(
+        file_downloaded=save_path,
+        written=written
+    )
 
 
 def curl_impersonate(
-    urls: Union[str, list[str], dict[str, Any], list[dict[str, Any]]],
+    urls: Union[str, dict[str, Any], Sequence[Union[str, dict[str, Any]]]],
     output_dir: Path,
     filename: str,
     headers: Optional[MutableMapping[str, Union[str, bytes]]] = None,
     cookies: Optional[Union[MutableMapping[str, str], CookieJar]] = None,
     proxy: Optional[str] = None,
-    max_workers: Optional[int] = None
+    max_workers: Optional[int] = None,
+    priority: int = 0
 ) -> Generator[dict[str, Any], None, None]:
     """
     Download files using Curl Impersonate.
@@ -142,9 +243,9 @@ def curl_impersonate(
 
     Yields the following download status updates while chunks are downloading:
 
-    - {total: 123} (there are 123 chunks to download)
-    - {total: None} (there are an unknown number of chunks to download)
-    - {advance: 1} (one chunk was downloaded)
+    - {total: 123} (there are 123 files, or 123 bytes of a single file, to download)
+    - {total: None} (there are an unknown number of bytes to download)
+    - {advance: 1} (one file, or byte of a single file, was downloaded)
     - {downloaded: "10.1 MB/s"} (currently downloading at a rate of 10.1 MB/s)
     - {file_downloaded: Path(...), written: 1024} (download finished, has the save path and size)
 
@@ -154,7 +255,8 @@ def curl_impersonate(
 
     Parameters:
         urls: Web URL(s) to file(s) to download. You can use a dictionary with the key
-            "url" for the URI, and other keys for extra arguments to use per-URL.
+            "url" for the URI, and other keys for extra arguments to use per-URL. Any
+            sequence of them may be used, e.g., one that makes each URL when accessed.
         output_dir: The folder to save the file into. If the save path's directory does
             not exist then it will be made automatically.
         filename: The filename or filename template to use for each file. The variables
@@ -164,11 +266,14 @@ def curl_impersonate(
         proxy: An optional proxy URI to route connections through for all downloads.
         max_workers: The maximum amount of threads to use for downloads. Defaults to
             min(32,(cpu_count+4)).
+        priority: The priority of these downloads in the download scheduler, which
+            limits the amount of connections made across all tracks. Downloads with a
+            higher priority get a connection first.
     """
     if not urls:
         raise ValueError("urls must be provided and not empty")
-    elif not isinstance(urls, (str, dict, list)):
-        raise TypeError(f"Expected urls to be {str} or {dict} or a list of one of them, not {type(urls)}")
+    elif not isinstance(urls, (str, dict, Sequence)):
+        raise TypeError(f"Expected urls to be {str} or {dict} or a sequence of one of them, not {type(urls)}")
 
     if not output_dir:
         raise ValueError("output_dir must be provided")
@@ -192,23 +297,24 @@ def curl_impersonate(
     if not isinstance(max_workers, (int, type(None))):
         raise TypeError(f"Expected max_workers to be {int}, not {type(max_workers)}")
 
-    if not isinstance(urls, list):
+    if not isinstance(priority, int):
+        raise TypeError(f"Expected priority to be {int}, not {type(priority)}")
+
+    if isinstance(urls, (str, dict)):
         urls = [urls]
 
-    urls = [
-        dict(
-            save_path=save_path,
+    if not max_workers:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    def get_url_args(i: int) -> dict[str, Any]:
+        # made as each URL is needed, as there may be many thousands of them
+        url = urls[i]
+        if not isinstance(url, dict):
+            url = dict(url=url)
+        return dict(
+            save_path=output_dir / filename.format(i=i, ext=get_extension(url["url"])),
             **url
-        ) if isinstance(url, dict) else dict(
-            url=url,
-            save_path=save_path
         )
-        for i, url in enumerate(urls)
-        for save_path in [output_dir / filename.format(
-            i=i,
-            ext=get_extension(url["url"] if isinstance(url, dict) else url)
-        )]
-    ]
 
     session = Session(impersonate=BROWSER)
     if headers:
@@ -225,59 +331,72 @@ def curl_impersonate(
 
     yield dict(total=len(urls))
 
+    def download_segment(url: dict[str, Any]) -> list[dict[str, Any]]:
+        # run the whole download within the worker thread, status updates are
+        # handed back to the calling thread once it has finished
+        with scheduler.slot(url["url"], owner=session, priority=priority):
+            return list(download(session=session, segmented=True, **url))
+
     download_sizes = []
     last_speed_refresh = time.time()
 
+    # how many segments may be in flight
+    window = max_workers * 2
+
     with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        for i, future in enumerate(futures.as_completed((
-            pool.submit(
-                download,
-                session=session,
-                **url
-            )
-            for url in urls
-        ))):
-            file_path, download_size = None, None
-            try:
-                for status_update in future.result():
-                    if status_update.get("file_downloaded") and status_update.get("written"):
-                        file_path = status_update["file_downloaded"]
-                        download_size = status_update["written"]
-                    elif len(urls) == 1:
-                        # these are per-chunk updates, only useful if it's one big file
-                        yield status_update
-            except KeyboardInterrupt:
-                DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                yield dict(downloaded="[yellow]CANCELLING")
-                pool.shutdown(wait=True, cancel_futures=True)
-                yield dict(downloaded="[yellow]CANCELLED")
-                # tell dl that it was cancelled
-                # the pool is already shut down, so exiting loop is fine
-                raise
-            except Exception:
-                DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                yield dict(downloaded="[red]FAILING")
-                pool.shutdown(wait=True, cancel_futures=True)
-                yield dict(downloaded="[red]FAILED")
-                # tell dl that it failed
-                # the pool is already shut down, so exiting loop is fine
-                raise
-            else:
-                yield dict(file_downloaded=file_path)
-                yield dict(advance=1)
-
-                now = time.time()
-                time_since = now - last_speed_refresh
-
-                if download_size:  # no size == skipped dl
-                    download_sizes.append(download_size)
-
-                if download_sizes and (time_since > PROGRESS_WINDOW or i == len(urls)):
-                    data_size = sum(download_sizes)
-                    download_speed = math.ceil(data_size / (time_since or 1))
-                    yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
-                    last_speed_refresh = now
-                    download_sizes.clear()
+        try:
+            if len(urls) == 1:
+                # a single file, stream its download progress instead
+                url = get_url_args(0)
+                with scheduler.slot(url["url"], owner=session, priority=priority):
+                    yield from download(session=session, **url)
+                return
+
+            segment_futures: set[Future] = set()
+            next_url = 0
+            while next_url < len(urls) or segment_futures:
+                # only keep a window of segments in flight, rather than one for every URL
+                while next_url < len(urls) and len(segment_futures) < window:
+                    segment_futures.add(pool.submit(download_segment, get_url_args(next_url)))
+                    next_url += 1
+
+                done, segment_futures = wait(segment_futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    download_size = 0
+                    for status_update in future.result():
+                        if status_update.get("file_downloaded"):
+                            # per-chunk updates are only useful if it's one big file
+                            download_size += status_update.get("written") or 0
+                            yield status_update
+
+                    yield dict(advance=1)
+
+                    now = time.time()
+                    time_since = now - last_speed_refresh
+                    if download_size:  # no size == skipped dl
+                        download_sizes.append(download_size)
+                    if download_sizes and time_since > PROGRESS_WINDOW:
+                        data_size = sum(download_sizes)
+                        download_speed = math.ceil(data_size / (time_since or 1))
+                        yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+                        last_speed_refresh = now
+                        download_sizes.clear()
+        except KeyboardInterrupt:
+            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+            yield dict(downloaded="[yellow]CANCELLING")
+            pool.shutdown(wait=True, cancel_futures=True)
+            yield dict(downloaded="[yellow]CANCELLED")
+            # tell dl that it was cancelled
+            # the pool is already shut down, so exiting loop is fine
+            raise
+        except Exception:
+            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+            yield dict(downloaded="[red]FAILING")
+            pool.shutdown(wait=True, cancel_futures=True)
+            yield dict(downloaded="[red]FAILED")
+            # tell dl that it failed
+            # the pool is already shut down, so exiting loop is fine
+            raise
 
 
 __all__ = ("curl_impersonate",)
@@ -1,30 +1,77 @@
 import math
 import os
+import threading
 import time
-from concurrent.futures import as_completed
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, Future, wait
 from concurrent.futures.thread import ThreadPoolExecutor
 from http.cookiejar import CookieJar
 from pathlib import Path
-from typing import Any, Generator, MutableMapping, Optional, Union
+from typing import Any, Callable, Generator, MutableMapping, Optional, Sequence, Union
 
-from requests import Session
+from requests import RequestException, Response, Session
 from requests.adapters import HTTPAdapter
 from rich import filesize
 
 from devine.core.constants import DOWNLOAD_CANCELLED
+from devine.core.scheduler import scheduler
 from devine.core.utilities import get_extension
+from devine.core.utils.control_file import (ControlFile, can_resume, get_missing_size, get_resume_headers,
+                                            get_resume_state, is_resumed)
 
 MAX_ATTEMPTS = 5
 RETRY_WAIT = 2
-CHUNK_SIZE = 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNK_TIME = 0.1  # how long each chunk read should roughly take, in seconds
+PROGRESS_INTERVAL = 0.2
 PROGRESS_WINDOW = 5
+STATE_SAVE_INTERVAL = 1  # how often to save the state of a resumable download, in seconds
+MIN_SPLIT_SIZE = 8 * 1024 * 1024  # smallest byte range to give its own connection
+
+
+def iter_chunks(stream: Response) -> Generator[memoryview, None, None]:
+    """
+    Read the content of a streamed Response in adaptively sized chunks.
+
+    The chunk size starts relative to the Content-Length and is then doubled or halved
+    depending on how long each read takes, between 64 KiB and 4 MiB. This keeps the
+    amount of Python-level iterations low on fast connections without stalling on
+    slow connections.
+
+    Chunks are read into one re-used buffer, so each yielded memoryview is only valid
+    until the next chunk is requested.
+    """
+    try:
+        content_length = int(stream.headers.get("Content-Length", "0"))
+    except ValueError:
+        content_length = 0
+
+    chunk_size = min(max(content_length // 64, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    buffer = memoryview(bytearray(chunk_size))
+
+    # have urllib3 decode any content-encoding like iter_content() would
+    stream.raw.decode_content = True
+
+    while True:
+        start = time.perf_counter()
+        n = stream.raw.readinto(buffer[:chunk_size])
+        if not n:
+            break
+        elapsed = time.perf_counter() - start
+
+        yield buffer[:n]
+
+        if n == chunk_size and elapsed < CHUNK_TIME / 2 and chunk_size < MAX_CHUNK_SIZE:
+            chunk_size *= 2
+            if chunk_size > len(buffer):
+                buffer = memoryview(bytearray(chunk_size))
+        elif elapsed > CHUNK_TIME * 2 and chunk_size > MIN_CHUNK_SIZE:
+            chunk_size //= 2
 
-DOWNLOAD_SIZES = []
-LAST_SPEED_REFRESH = time.time()
 
 def download(
     url: str,
-    save_path: Path,
+    save_path: Optional[Path],
     session: Optional[Session] = None,
     segmented: bool = False,
     **kwargs: Any
@@ -35,11 +82,15 @@ def download(
 
     Yields the following download status updates while chunks are downloading:
 
-    - {total: 123} (there are 123 chunks to download)
-    - {total: None} (there are an unknown number of chunks to download)
-    - {advance: 1} (one chunk was downloaded)
+    - {total: 123} (there are 123 bytes to download)
+    - {total: None} (there are an unknown number of bytes to download)
+    - {advance: 1024} (1024 more bytes were downloaded)
     - {downloaded: "10.1 MB/s"} (currently downloading at a rate of 10.1 MB/s)
     - {file_downloaded: Path(...), written: 1024} (download finished, has the save path and size)
+    - {data: bytearray(...), written: 1024} (download finished in memory, has the data and size)
+
+    Progress updates are not yielded for every chunk, they are combined and yielded
+    at most every 0.2 seconds.
 
     The data is in the same format accepted by rich's progress.update() function. The
     `downloaded` key is custom and is not natively accepted by all rich progress bars.
@@ -47,7 +98,8 @@ def download(
     Parameters:
         url: Web URL of a file to download.
         save_path: The path to save the file to. If the save path's directory does not
-            exist then it will be made automatically.
+            exist then it will be made automatically. If None, the file is downloaded
+            to memory and yielded as `data` instead.
         session: The Requests Session to make HTTP requests with. Useful to set Header,
             Cookie, and Proxy data. Connections are saved and re-used with the session
             so long as the server keeps the connection alive.
@@ -55,107 +107,412 @@ def download(
         kwargs: Any extra keyword arguments to pass to the session.get() call. Use this
             for one-time request changes like a header, cookie, or proxy. For example,
             to request Byte-ranges use e.g., `headers={"Range": "bytes=0-128"}`.
-    """
-    global LAST_SPEED_REFRESH
 
+    If the download of a whole file is interrupted, the control file next to it keeps
+    track of the byte ranges still missing along with the file's ETag or Last-Modified
+    date. The next download of the same URL to the same path only requests the missing
+    byte ranges, unless the file has changed since, in which case it starts over.
+    """
     session = session or Session()
 
+    if save_path is None:
+        yield from download_to_memory(url, session, **kwargs)
+        return
+
     save_dir = save_path.parent
-    control_file = save_path.with_name(f"{save_path.name}.!dev")
+    control_file = ControlFile(save_path)
 
     save_dir.mkdir(parents=True, exist_ok=True)
 
+    state = None
     if control_file.exists():
-        # consider the file corrupt if the control file exists
-        save_path.unlink(missing_ok=True)
-        control_file.unlink()
+        state = control_file.load()
+        if not can_resume(state, url) or not save_path.exists():
+            # consider the file corrupt if it cannot be resumed
+            state = None
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
     elif save_path.exists():
         # if it exists, and no control file, then it should be safe
         yield dict(
             file_downloaded=save_path,
             written=save_path.stat().st_size
         )
-        # TODO: This should return, potential recovery bug
+        return
 
-    # TODO: Design a control file format so we know how much of the file is missing
-    control_file.write_bytes(b"")
+    if not state:
+        control_file.create()
 
+    headers = kwargs.pop("headers", None) or {}
+    # segments are small enough to just download again, and byte ranges of a file
+    # cannot be resumed with further byte ranges
+    resumable = not segmented and not any(k.lower() == "range" for k in headers)
+
+    written = 0
     attempts = 1
     try:
         while True:
-            written = 0
-
-            # these are for single-url speed calcs only
+            # these are for single-url progress and speed calcs only
+            progress_size = 0
+            last_progress_refresh = time.time()
             download_sizes = []
             last_speed_refresh = time.time()
+            last_state_save = time.time()
 
             try:
-                stream = session.get(url, stream=True, **kwargs)
-                stream.raise_for_status()
+                if state:
+                    missing = state["missing"][0]
+                    stream = session.get(
+                        url,
+                        stream=True,
+                        headers={**headers, **get_resume_headers(state, *missing)},
+                        **kwargs
+                    )
+                    stream.raise_for_status()
+                    if not is_resumed(stream, state, missing[0]):
+                        # the file has changed, or Range requests are no longer supported
+                        stream.close()
+                        state = None
+                        continue
+                else:
+                    stream = session.get(url, stream=True, headers=headers, **kwargs)
+                    stream.raise_for_status()
+                    if resumable:
+                        state = get_resume_state(url, stream)
+                    if state:
+                        missing = state["missing"][0]
+                        control_file.save(state)
 
                 if not segmented:
-                    try:
-                        content_length = int(stream.headers.get("Content-Length", "0"))
-                    except ValueError:
-                        content_length = 0
-
-                    if content_length > 0:
-                        yield dict(total=math.ceil(content_length / CHUNK_SIZE))
+                    if state:
+                        yield dict(total=state["size"], completed=state["size"] - get_missing_size(state))
                     else:
-                        # we have no data to calculate total chunks
-                        yield dict(total=None)  # indeterminate mode
-
-                with open(save_path, "wb") as f:
-                    for chunk in stream.iter_content(chunk_size=CHUNK_SIZE):
+                        try:
+                            content_length = int(stream.headers.get("Content-Length", "0"))
+                        except ValueError:
+                            content_length = 0
+
+                        if content_length > 0:
+                            yield dict(total=content_length, completed=0)
+                        else:
+                            # we have no data to calculate total size
+                            yield dict(total=None, completed=0)  # indeterminate mode
+
+                with open(save_path, "r+b" if stream.status_code == 206 and state else "wb") as f:
+                    if state:
+                        f.seek(missing[0])
+                    for chunk in iter_chunks(stream):
                         download_size = len(chunk)
                         f.write(chunk)
                         written += download_size
 
+                        if state:
+                            missing[0] += download_size
+
                         if not segmented:
-                            yield dict(advance=1)
+                            progress_size += download_size
+                            download_sizes.append(download_size)
                             now = time.time()
+                            if now - last_progress_refresh > PROGRESS_INTERVAL:
+                                yield dict(advance=progress_size)
+                                progress_size = 0
+                                last_progress_refresh = now
                             time_since = now - last_speed_refresh
-                            download_sizes.append(download_size)
-                            if time_since > PROGRESS_WINDOW or download_size < CHUNK_SIZE:
+                            if time_since > PROGRESS_WINDOW:
                                 data_size = sum(download_sizes)
                                 download_speed = math.ceil(data_size / (time_since or 1))
                                 yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
                                 last_speed_refresh = now
                                 download_sizes.clear()
+                            if state and now - last_state_save > STATE_SAVE_INTERVAL:
+                                f.flush()
+                                control_file.save(state)
+                                last_state_save = now
 
-                yield dict(file_downloaded=save_path, written=written)
-
-                if segmented:
-                    yield dict(advance=1)
-                    now = time.time()
-                    time_since = now - LAST_SPEED_REFRESH
-                    if written:  # no size == skipped dl
-                        DOWNLOAD_SIZES.append(written)
-                    if DOWNLOAD_SIZES and time_since > PROGRESS_WINDOW:
-                        data_size = sum(DOWNLOAD_SIZES)
-                        download_speed = math.ceil(data_size / (time_since or 1))
+                if not segmented:
+                    if progress_size:
+                        yield dict(advance=progress_size)
+                    if download_sizes:
+                        time_since = time.time() - last_speed_refresh
+                        download_speed = math.ceil(sum(download_sizes) / (time_since or 1))
                         yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
-                        LAST_SPEED_REFRESH = now
-                        DOWNLOAD_SIZES.clear()
+
+                if state:
+                    if missing[0] <= missing[1]:
+                        raise IOError(f"Download ended early, {missing[1] - missing[0] + 1} bytes are missing")
+                    state["missing"].pop(0)
+                    if state["missing"]:
+                        # the download was split, continue with the next missing byte range
+                        control_file.save(state)
+                        continue
+
                 break
             except Exception as e:
-                save_path.unlink(missing_ok=True)
+                if state:
+                    # keep what was downloaded, only the rest is downloaded again
+                    control_file.save(state)
+                else:
+                    save_path.unlink(missing_ok=True)
                 if DOWNLOAD_CANCELLED.is_set() or attempts == MAX_ATTEMPTS:
                     raise e
                 time.sleep(RETRY_WAIT)
                 attempts += 1
-    finally:
-        control_file.unlink()
+    except BaseException:
+        if state:
+            # keep the control file so that a future download can be resumed
+            control_file.save(state)
+        else:
+            save_path.unlink(missing_ok=True)
+            control_file.delete()
+        raise
+
+    control_file.delete()
+
+    yield dict(file_downloaded=save_path, written=written)
+
+
+def download_to_memory(
+    url: str,
+    session: Session,
+    **kwargs: Any
+) -> Generator[dict[str, Any], None, None]:
+    """
+    Download a file to memory using Python Requests.
+
+    This is intended for small files like segments where the data is going to be
+    consumed straight away, e.g., merged or decrypted, so there is no point in
+    writing it to its own file first. Nothing is written to disk.
+
+    Yields a single {data: bytearray(...), written: 1024} status update once the
+    file has finished downloading.
+    """
+    attempts = 1
+    while True:
+        try:
+            stream = session.get(url, stream=True, **kwargs)
+            stream.raise_for_status()
+
+            data = bytearray()
+            for chunk in iter_chunks(stream):
+                data += chunk
+
+            yield dict(data=data, written=len(data))
+            break
+        except Exception as e:
+            if DOWNLOAD_CANCELLED.is_set() or attempts == MAX_ATTEMPTS:
+                raise e
+            time.sleep(RETRY_WAIT)
+            attempts += 1
+
+
+def get_range_state(url: str, session: Session, **kwargs: Any) -> Optional[dict[str, Any]]:
+    """
+    Get the state needed to download a file in byte ranges, if the server supports it.
+
+    A one byte Range request is made rather than a HEAD request as some servers
+    advertise `Accept-Ranges` but then ignore the Range header or vice-versa.
+
+    Returns None if Range requests are not supported or the size is unknown.
+    """
+    headers = {**(kwargs.pop("headers", None) or {}), "Range": "bytes=0-0"}
+    try:
+        with session.get(url, stream=True, headers=headers, **kwargs) as res:
+            if res.status_code != 206:
+                return None
+            size = res.headers.get("Content-Range", "").split("/")[-1]
+            etag = res.headers.get("ETag")
+            last_modified = res.headers.get("Last-Modified")
+    except RequestException:
+        return None
+    if not size.isdigit() or not int(size):
+        return None
+
+    if etag and etag.startswith("W/"):
+        # weak validators cannot be used with If-Range
+        etag = None
+
+    return dict(
+        url=url,
+        size=int(size),
+        validator=etag or last_modified,
+        missing=[[0, int(size) - 1]]
+    )
+
+
+def download_split(
+    url: str,
+    save_path: Path,
+    session: Session,
+    pool: ThreadPoolExecutor,
+    max_workers: int,
+    priority: int = 0,
+    **kwargs: Any
+) -> Generator[dict[str, Any], None, None]:
+    """
+    Download a file over multiple connections using Python Requests.
+
+    If the server supports Range requests for the file and it is big enough, the file
+    is split into up to `max_workers` byte ranges that are downloaded in parallel on
+    the pool. Each range is written directly to its offset in the output file, which
+    is pre-allocated (sparse where supported) to the full size of the file.
+
+    The missing byte ranges are kept in the control file, so an interrupted download
+    can be resumed, in parallel, by downloading the same URL to the same path again.
+
+    Otherwise, or if a Range header was explicitly set, it is downloaded over one
+    connection with download().
+
+    Each connection holds a slot from the download scheduler with the given priority.
+
+    Yields the same status updates as download().
+    """
+    control_file = ControlFile(save_path)
+
+    def download_whole() -> Generator[dict[str, Any], None, None]:
+        with scheduler.slot(url, owner=session, priority=priority):
+            yield from download(url, save_path, session, **kwargs)
+
+    headers = kwargs.get("headers") or {}
+    if max_workers < 2 or any(k.lower() == "range" for k in headers):
+        yield from download_whole()
+        return
+
+    state = None
+    if control_file.exists() and save_path.exists():
+        state = control_file.load()
+        if not can_resume(state, url):
+            state = None
+    elif save_path.exists():
+        yield from download_whole()
+        return
+
+    range_state = get_range_state(url, session, **kwargs)
+    if state and (
+        not range_state or
+        range_state["size"] != state["size"] or
+        range_state["validator"] != state["validator"]
+    ):
+        # the file has changed, or Range requests are no longer supported
+        state = None
+        save_path.unlink(missing_ok=True)
+        control_file.delete()
+
+    if not state:
+        if not range_state or range_state["size"] < MIN_SPLIT_SIZE * 2:
+            yield from download_whole()
+            return
+        state = range_state
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(save_path, "wb") as f:
+            f.truncate(state["size"])
+
+    # split the biggest missing byte range in half until there's one for each worker
+    parts = state["missing"]
+    while len(parts) < max_workers:
+        biggest = max(parts, key=lambda part: part[1] - part[0])
+        part_size = biggest[1] - biggest[0] + 1
+        if part_size < MIN_SPLIT_SIZE * 2:
+            break
+        middle = biggest[0] + part_size // 2
+        parts.append([middle, biggest[1]])
+        biggest[1] = middle - 1
+    parts.sort()
+
+    def save_state() -> None:
+        control_file.save(dict(state, missing=[part for part in parts if part[0] <= part[1]]))
+
+    save_state()
+
+    written = 0
+    written_lock = threading.Lock()
+
+    def download_part(part: list[int]) -> None:
+        nonlocal written
+        attempts = 1
+        # unbuffered, so the saved state never runs ahead of what was written
+        with scheduler.slot(url, owner=session, priority=priority), open(save_path, "r+b", buffering=0) as f:
+            while part[0] <= part[1]:
+                try:
+                    with session.get(
+                        url,
+                        stream=True,
+                        headers={**headers, **get_resume_headers(state, *part)},
+                        **kwargs
+                    ) as stream:
+                        stream.raise_for_status()
+                        if not is_resumed(stream, state, part[0]):
+                            raise IOError(f"Expected byte range {part[0]}-{part[1]}, the file may have changed")
+                        f.seek(part[0])
+                        for chunk in iter_chunks(stream):
+                            if DOWNLOAD_CANCELLED.is_set():
+                                raise KeyboardInterrupt()
+                            chunk = chunk[:part[1] - part[0] + 1]
+                            f.write(chunk)
+                            part[0] += len(chunk)
+                            with written_lock:
+                                written += len(chunk)
+                    if part[0] <= part[1]:
+                        raise IOError(f"Byte range ended early at {part[0]}, expected to end at {part[1]}")
+                except Exception:
+                    if DOWNLOAD_CANCELLED.is_set() or attempts == MAX_ATTEMPTS:
+                        raise
+                    time.sleep(RETRY_WAIT)
+                    attempts += 1
+
+    yield dict(total=state["size"], completed=state["size"] - get_missing_size(state))
+
+    progressed = 0
+    speed_progressed = 0
+    last_speed_refresh = time.time()
+    last_state_save = time.time()
+
+    try:
+        part_futures = [pool.submit(download_part, part) for part in parts]
+        while True:
+            done, not_done = wait(part_futures, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()  # raise any exception from the part
+
+            with written_lock:
+                current = written
+            if current > progressed:
+                yield dict(advance=current - progressed)
+                progressed = current
+
+            now = time.time()
+            time_since = now - last_speed_refresh
+            if time_since > PROGRESS_WINDOW or not not_done:
+                download_speed = math.ceil((progressed - speed_progressed) / (time_since or 1))
+                yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+                speed_progressed = progressed
+                last_speed_refresh = now
+
+            if not not_done:
+                break
+
+            if now - last_state_save > STATE_SAVE_INTERVAL:
+                save_state()
+                last_state_save = now
+    except BaseException:
+        # keep the control file so that a future download can be resumed
+        save_state()
+        raise
+
+    control_file.delete()
+
+    yield dict(file_downloaded=save_path, written=written)
 
 
 def requests(
-    urls: Union[str, list[str], dict[str, Any], list[dict[str, Any]]],
+    urls: Union[str, dict[str, Any], Sequence[Union[str, dict[str, Any]]]],
     output_dir: Path,
     filename: str,
     headers: Optional[MutableMapping[str, Union[str, bytes]]] = None,
     cookies: Optional[Union[MutableMapping[str, str], CookieJar]] = None,
     proxy: Optional[str] = None,
-    max_workers: Optional[int] = None
+    max_workers: Optional[int] = None,
+    on_segment: Optional[Callable[[int, bytearray], None]] = None,
+    priority: int = 0
 ) -> Generator[dict[str, Any], None, None]:
     """
     Download a file using Python Requests.
@@ -163,9 +520,9 @@ def requests(
 
     Yields the following download status updates while chunks are downloading:
 
-    - {total: 123} (there are 123 chunks to download)
-    - {total: None} (there are an unknown number of chunks to download)
-    - {advance: 1} (one chunk was downloaded)
+    - {total: 123} (there are 123 files, or 123 bytes of a single file, to download)
+    - {total: None} (there are an unknown number of bytes to download)
+    - {advance: 1} (one file, or byte of a single file, was downloaded)
     - {downloaded: "10.1 MB/s"} (currently downloading at a rate of 10.1 MB/s)
     - {file_downloaded: Path(...), written: 1024} (download finished, has the save path and size)
 
@@ -175,7 +532,8 @@ def requests(
 
     Parameters:
         urls: Web URL(s) to file(s) to download. You can use a dictionary with the key
-            "url" for the URI, and other keys for extra arguments to use per-URL.
+            "url" for the URI, and other keys for extra arguments to use per-URL. Any
+            sequence of them may be used, e.g., one that makes each URL when accessed.
         output_dir: The folder to save the file into. If the save path's directory does
             not exist then it will be made automatically.
         filename: The filename or filename template to use for each file. The variables
@@ -184,12 +542,20 @@ def requests(
         cookies: A mapping of Cookie Key/Values or a Cookie Jar to use for all downloads.
         proxy: An optional proxy URI to route connections through for all downloads.
         max_workers: The maximum amount of threads to use for downloads. Defaults to
-            min(32,(cpu_count+4)).
+            min(32,(cpu_count+4)). A single big file is split into up to this many byte
+            ranges that are downloaded in parallel, if the server supports it.
+        on_segment: Download to memory instead of to files in `output_dir`. Each file's
+            data is passed to this callable with its URL index as soon as it and all
+            files before it have downloaded, i.e., always in URL order. No
+            `file_downloaded` status updates are yielded in this mode.
+        priority: The priority of these downloads in the download scheduler, which
+            limits the amount of connections made across all tracks. Downloads with a
+            higher priority get a connection first.
     """
     if not urls:
         raise ValueError("urls must be provided and not empty")
-    elif not isinstance(urls, (str, dict, list)):
-        raise TypeError(f"Expected urls to be {str} or {dict} or a list of one of them, not {type(urls)}")
+    elif not isinstance(urls, (str, dict, Sequence)):
+        raise TypeError(f"Expected urls to be {str} or {dict} or a sequence of one of them, not {type(urls)}")
 
     if not output_dir:
         raise ValueError("output_dir must be provided")
@@ -213,26 +579,27 @@ def requests(
     if not isinstance(max_workers, (int, type(None))):
         raise TypeError(f"Expected max_workers to be {int}, not {type(max_workers)}")
 
-    if not isinstance(urls, list):
+    if not isinstance(on_segment, (Callable, type(None))):
+        raise TypeError(f"Expected on_segment to be {Callable}, not {type(on_segment)}")
+
+    if not isinstance(priority, int):
+        raise TypeError(f"Expected priority to be {int}, not {type(priority)}")
+
+    if isinstance(urls, (str, dict)):
         urls = [urls]
 
     if not max_workers:
         max_workers = min(32, (os.cpu_count() or 1) + 4)
 
-    urls = [
-        dict(
-            save_path=save_path,
+    def get_url_args(i: int) -> dict[str, Any]:
+        # made as each URL is needed, as there may be many thousands of them
+        url = urls[i]
+        if not isinstance(url, dict):
+            url = dict(url=url)
+        return dict(
+            save_path=None if on_segment else output_dir / filename.format(i=i, ext=get_extension(url["url"])),
             **url
-        ) if isinstance(url, dict) else dict(
-            url=url,
-            save_path=save_path
         )
-        for i, url in enumerate(urls)
-        for save_path in [output_dir / filename.format(
-            i=i,
-            ext=get_extension(url["url"] if isinstance(url, dict) else url)
-        )]
-    ]
 
     session = Session()
     session.mount("https://", HTTPAdapter(
@@ -256,37 +623,92 @@ def requests(
 
     yield dict(total=len(urls))
 
-    try:
-        with ThreadPoolExecutor(max_workers=max_workers) as pool:
-            for future in as_completed(
-                pool.submit(
-                    download,
+    def download_segment(url: dict[str, Any]) -> list[dict[str, Any]]:
+        # run the whole download within the worker thread, status updates are
+        # handed back to the calling thread once it has finished
+        with scheduler.slot(url["url"], owner=session, priority=priority):
+            return list(download(session=session, segmented=True, **url))
+
+    download_sizes = []
+    last_speed_refresh = time.time()
+
+    # in-memory downloads that have finished but are waiting on a prior segment
+    pending_data: dict[int, bytearray] = {}
+    next_segment = 0
+
+    # how many segments may be in flight, or finished but waiting on a prior segment
+    window = max_workers * 2
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            if len(urls) == 1 and not on_segment:
+                # a single file, stream its download progress instead
+                yield from download_split(
                     session=session,
-                    segmented=True,
-                    **url
+                    pool=pool,
+                    max_workers=max_workers,
+                    priority=priority,
+                    **get_url_args(0)
                 )
-                for url in urls
-            ):
-                try:
-                    yield from future.result()
-                except KeyboardInterrupt:
-                    DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                    yield dict(downloaded="[yellow]CANCELLING")
-                    pool.shutdown(wait=True, cancel_futures=True)
-                    yield dict(downloaded="[yellow]CANCELLED")
-                    # tell dl that it was cancelled
-                    # the pool is already shut down, so exiting loop is fine
-                    raise
-                except Exception:
-                    DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                    yield dict(downloaded="[red]FAILING")
-                    pool.shutdown(wait=True, cancel_futures=True)
-                    yield dict(downloaded="[red]FAILED")
-                    # tell dl that it failed
-                    # the pool is already shut down, so exiting loop is fine
-                    raise
-    finally:
-        DOWNLOAD_SIZES.clear()
+                return
+
+            segment_futures: dict[Future, int] = {}
+            next_url = 0
+            while next_url < len(urls) or segment_futures:
+                # only keep a window of segments in flight, and when downloading to memory, don't
+                # get more than that ahead of the segment on_segment is waiting on, so that the
+                # data held in pending_data stays bounded
+                while (
+                    next_url < len(urls)
+                    and len(segment_futures) < window
+                    and (not on_segment or next_url < next_segment + window)
+                ):
+                    segment_futures[pool.submit(download_segment, get_url_args(next_url))] = next_url
+                    next_url += 1
+
+                done, _ = wait(segment_futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = segment_futures.pop(future)
+                    download_size = 0
+                    for status_update in future.result():
+                        download_size += status_update.get("written") or 0
+                        if on_segment and "data" in status_update:
+                            pending_data[i] = status_update["data"]
+                        else:
+                            yield status_update
+
+                    while next_segment in pending_data:
+                        on_segment(next_segment, pending_data.pop(next_segment))
+                        next_segment += 1
+
+                    yield dict(advance=1)
+
+                    now = time.time()
+                    time_since = now - last_speed_refresh
+                    if download_size:  # no size == skipped dl
+                        download_sizes.append(download_size)
+                    if download_sizes and time_since > PROGRESS_WINDOW:
+                        data_size = sum(download_sizes)
+                        download_speed = math.ceil(data_size / (time_since or 1))
+                        yield dict(downloaded=f"{filesize.decimal(download_speed)}/s")
+                        last_speed_refresh = now
+                        download_sizes.clear()
+        except KeyboardInterrupt:
+            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+            yield dict(downloaded="[yellow]CANCELLING")
+            pool.shutdown(wait=True, cancel_futures=True)
+            yield dict(downloaded="[yellow]CANCELLED")
+            # tell dl that it was cancelled
+            # the pool is already shut down, so exiting loop is fine
+            raise
+        except Exception:
+            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+            yield dict(downloaded="[red]FAILING")
+            pool.shutdown(wait=True, cancel_futures=True)
+            yield dict(downloaded="[red]FAILED")
+            # tell dl that it failed
+            # the pool is already shut down, so exiting loop is fine
+            raise
 
 
 __all__ = ("requests",)
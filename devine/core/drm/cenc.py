@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import itertools
+import os
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Union
+from uuid import UUID
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Cipher._mode_cbc import CbcMode
+from Cryptodome.Cipher._mode_ctr import CtrMode
+
+from devine.core.utils.mp4 import (BoxHeader, find_box, find_boxes, get_sample_entry_children, iter_boxes,
+                                   iter_file_boxes)
+
+PIFF_SENC_UUID = UUID("a2394f52-5a9b-4f14-a244-6c427c648df4").bytes
+
+
+class CencTrack(NamedTuple):
+    """How the samples of an encrypted track are encrypted, from its init data."""
+    scheme: bytes
+    key: bytes
+    iv_size: int
+    constant_iv: bytes
+    crypt_byte_block: int
+    skip_byte_block: int
+
+
+class SampleInfo(NamedTuple):
+    """The auxiliary encryption information of a sample."""
+    iv: bytes
+    subsamples: list[tuple[int, int]]  # clear and protected byte counts
+
+
+def decrypt(path: Path, keys: dict[UUID, str], max_workers: Optional[int] = None) -> None:
+    """
+    Decrypt a fragmented MP4 file protected with Common Encryption (CENC), in place.
+
+    The cenc, cens, cbc1 and cbcs protection schemes are supported. The samples are
+    decrypted where they are, and the boxes that are only needed for decryption are
+    turned into free boxes, so no data moves and the file is only read and written
+    once. The fragments are decrypted in parallel.
+
+    Raises:
+        ValueError if the file is not a fragmented MP4, if no track is encrypted (there's
+            no tenc box), or if there's no key for a track.
+    """
+    if not max_workers:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    with open(path, "r+b") as f:
+        boxes = list(iter_file_boxes(f))
+        if not any(box.type == b"moov" for box in boxes):
+            raise ValueError("Tried to decrypt a file that is not an MP4, no moov box was found.")
+
+        tracks: dict[int, CencTrack] = {}
+        default_sample_sizes: dict[int, int] = {}
+        with ThreadPoolExecutor(max_workers) as executor:
+            pending: deque[tuple[int, Future[bytearray]]] = deque()
+
+            def write_pending(limit: int) -> None:
+                while len(pending) > limit:
+                    offset, fragment = pending.popleft()
+                    f.seek(offset)
+                    f.write(fragment.result())
+
+            for i, box in enumerate(boxes):
+                if box.type == b"moov":
+                    moov = read_box(f, box)
+                    tracks.update(parse_init(moov, keys))
+                    default_sample_sizes.update(get_default_sample_sizes(moov))
+                    if not tracks:
+                        raise ValueError("Tried to decrypt a file with no encrypted tracks, no tenc box was found.")
+                    if not any(x.type == b"moof" for x in boxes):
+                        raise ValueError("Only fragmented MP4 files can be decrypted without Shaka Packager.")
+                    f.seek(box.offset)
+                    f.write(moov)
+                elif box.type == b"pssh":
+                    f.seek(box.offset + 4)
+                    f.write(b"free")
+                elif box.type == b"moof" and tracks:
+                    # the fragment's samples are in the mdat box that follows it
+                    end = box.end
+                    for next_box in itertools.islice(boxes, i + 1, None):
+                        if next_box.type == b"moof":
+                            break
+                        if next_box.type == b"mdat":
+                            end = next_box.end
+                            break
+                    f.seek(box.offset)
+                    fragment = bytearray(f.read(end - box.offset))
+                    pending.append((box.offset, executor.submit(
+                        decrypt_fragment, fragment, box.offset, tracks, default_sample_sizes
+                    )))
+                    write_pending(max_workers * 2)
+
+            write_pending(0)
+
+
+def read_box(f: BinaryIO, box: BoxHeader) -> bytearray:
+    """Read a whole box from a file, the offsets within it are relative to the box."""
+    f.seek(box.offset)
+    return bytearray(f.read(box.end - box.offset))
+
+
+def parse_init(moov: bytearray, keys: dict[UUID, str]) -> dict[int, CencTrack]:
+    """
+    Get how each encrypted track is encrypted, by track ID, from a moov box.
+
+    The moov box is changed to describe the decrypted tracks. Encrypted sample entries
+    (e.g., encv) get their original type back, and the sinf and pssh boxes are freed.
+    """
+    moov_box = next(iter_boxes(moov))
+
+    tracks: dict[int, CencTrack] = {}
+    for box in iter_boxes(moov, moov_box.payload, moov_box.end):
+        if box.type == b"pssh":
+            free_box(moov, box)
+        if box.type != b"trak":
+            continue
+
+        tkhd = find_box(moov, [b"tkhd"], box.payload, box.end)
+        stsd = find_box(moov, [b"mdia", b"minf", b"stbl", b"stsd"], box.payload, box.end)
+        if not tkhd or not stsd:
+            continue
+        track_id = struct.unpack_from(">I", moov, tkhd.payload + (20 if moov[tkhd.payload] == 1 else 12))[0]
+
+        for entry in iter_boxes(moov, stsd.payload + 8, stsd.end):
+            children = get_sample_entry_children(moov, entry)
+            if children is None:
+                continue
+
+            sinf = find_box(moov, [b"sinf"], children, entry.end)
+            frma = sinf and find_box(moov, [b"frma"], sinf.payload, sinf.end)
+            schm = sinf and find_box(moov, [b"schm"], sinf.payload, sinf.end)
+            tenc = sinf and find_box(moov, [b"schi", b"tenc"], sinf.payload, sinf.end)
+            if not sinf or not frma or not tenc:
+                continue
+
+            scheme = bytes(moov[schm.payload + 4:schm.payload + 8]) if schm else b"cenc"
+            if scheme not in (b"cenc", b"cens", b"cbc1", b"cbcs"):
+                raise ValueError(f"Unsupported protection scheme {scheme.decode(errors='replace')!r}")
+
+            version = moov[tenc.payload]
+            pattern, is_protected, iv_size = struct.unpack_from(">xBBB", moov, tenc.payload + 4)
+            kid = UUID(bytes=bytes(moov[tenc.payload + 8:tenc.payload + 24]))
+            constant_iv = b""
+            if is_protected and iv_size == 0:
+                constant_iv_size = moov[tenc.payload + 24]
+                constant_iv = bytes(moov[tenc.payload + 25:tenc.payload + 25 + constant_iv_size])
+
+            moov[entry.offset + 4:entry.offset + 8] = moov[frma.payload:frma.payload + 4]
+            free_box(moov, sinf)
+
+            if not is_protected or track_id in tracks:
+                # only the first sample description is used for the whole track
+                continue
+
+            tracks[track_id] = CencTrack(
+                scheme=scheme,
+                key=get_key(keys, kid),
+                iv_size=iv_size,
+                constant_iv=constant_iv,
+                crypt_byte_block=pattern >> 4 if version else 0,
+                skip_byte_block=pattern & 0xF if version else 0
+            )
+
+    return tracks
+
+
+def get_default_sample_sizes(moov: bytearray) -> dict[int, int]:
+    """Get the default sample size of each track's fragments, by track ID, from a moov box's trex boxes."""
+    moov_box = next(iter_boxes(moov))
+    default_sample_sizes: dict[int, int] = {}
+    mvex = find_box(moov, [b"mvex"], moov_box.payload, moov_box.end)
+    if mvex:
+        for trex in find_boxes(moov, b"trex", mvex.payload, mvex.end):
+            track_id, default_sample_size = struct.unpack_from(">I8xI", moov, trex.payload + 4)
+            default_sample_sizes[track_id] = default_sample_size
+    return default_sample_sizes
+
+
+def get_key(keys: dict[UUID, str], kid: UUID) -> bytes:
+    """Get the content key for a KID, the first key is used for a blank KID as some services use one."""
+    if kid in keys:
+        return bytes.fromhex(keys[kid])
+    if kid.int == 0 and keys:
+        return bytes.fromhex(next(iter(keys.values())))
+    raise ValueError(f"No Content Key for KID {kid.hex} was provided, cannot decrypt the track.")
+
+
+def free_box(data: bytearray, box: BoxHeader) -> None:
+    """Turn a box into a free box, which is skipped by players, without moving any data."""
+    data[box.offset + 4:box.offset + 8] = b"free"
+
+
+def decrypt_fragment(
+    data: bytearray,
+    offset: int,
+    tracks: dict[int, CencTrack],
+    default_sample_sizes: dict[int, int]
+) -> bytearray:
+    """
+    Decrypt the samples of a fragment, a moof box and the mdat box that follows it.
+
+    The offset is where the fragment is within the file, for absolute base data offsets.
+    The samples of unencrypted tracks are located too, as the base data offset of a
+    track fragment may follow on from the track fragment before it. The moof box is
+    changed to describe the decrypted samples.
+    """
+    moof = next(iter_boxes(data))
+    data_end = moof.offset
+    for box in iter_boxes(data, moof.payload, moof.end):
+        if box.type == b"pssh":
+            free_box(data, box)
+        if box.type != b"traf":
+            continue
+
+        tfhd = find_box(data, [b"tfhd"], box.payload, box.end)
+        if not tfhd:
+            continue
+        flags, track_id = struct.unpack_from(">II", data, tfhd.payload)
+        flags &= 0xFFFFFF
+
+        # the base data offset, see ISO/IEC 14496-12, 8.8.7
+        pos = tfhd.payload + 8
+        if flags & 0x1:  # base-data-offset-present
+            base = struct.unpack_from(">Q", data, pos)[0] - offset
+            pos += 8
+        elif flags & 0x20000:  # default-base-is-moof
+            base = moof.offset
+        else:
+            # the moof for the first track fragment, otherwise the end of the data of
+            # the track fragment before it
+            base = data_end
+        pos += 4 * bool(flags & 0x2) + 4 * bool(flags & 0x8)
+        if flags & 0x10:
+            default_sample_size = struct.unpack_from(">I", data, pos)[0]
+        else:
+            default_sample_size = default_sample_sizes.get(track_id, 0)
+
+        samples = list(get_samples(data, box, base, default_sample_size))
+        data_end = sum(samples[-1]) if samples else base
+
+        track = tracks.get(track_id)
+        if not track:
+            continue
+
+        sample_infos = list(get_sample_infos(data, box, base, track))
+        if len(sample_infos) < len(samples):
+            raise ValueError(f"Missing encryption info for {len(samples) - len(sample_infos)} samples")
+
+        for (start, size), sample_info in zip(samples, sample_infos):
+            if start < 0 or start + size > len(data):
+                raise ValueError("A sample is outside of the fragment's mdat box")
+            decrypt_sample(data, start, size, sample_info, track)
+
+    return data
+
+
+def get_samples(data: bytearray, traf: BoxHeader, base: int, default_sample_size: int) -> Iterator[tuple[int, int]]:
+    """Get the start and size of each sample of a track fragment, per its trun boxes."""
+    data_end = base
+    for trun in find_boxes(data, b"trun", traf.payload, traf.end):
+        flags, sample_count = struct.unpack_from(">II", data, trun.payload)
+        flags &= 0xFFFFFF
+        pos = trun.payload + 8
+        start = data_end
+        if flags & 0x1:
+            start = base + struct.unpack_from(">i", data, pos)[0]
+            pos += 4
+        if flags & 0x4:
+            pos += 4  # first sample flags
+        fields = [bool(flags & x) for x in (0x100, 0x200, 0x400, 0x800)]
+        stride = 4 * sum(fields)
+        for _ in range(sample_count):
+            size = default_sample_size
+            if fields[1]:
+                size = struct.unpack_from(">I", data, pos + 4 * fields[0])[0]
+            yield start, size
+            start += size
+            pos += stride
+        data_end = start
+
+
+def get_sample_infos(data: bytearray, traf: BoxHeader, base: int, track: CencTrack) -> Iterator[SampleInfo]:
+    """
+    Get the IV and subsamples of each sample of a track fragment.
+
+    They're read from the senc box, or the PIFF equivalent, otherwise from wherever the
+    saiz and saio boxes point to. The boxes are freed once read.
+    """
+    iv_size = track.iv_size
+    senc: Optional[BoxHeader] = None
+    saiz: Optional[BoxHeader] = None
+    saio: Optional[BoxHeader] = None
+    for box in iter_boxes(data, traf.payload, traf.end):
+        if box.type == b"senc" or (box.type == b"uuid" and data[box.payload:box.payload + 16] == PIFF_SENC_UUID):
+            senc = box
+        elif box.type == b"saiz":
+            saiz = box
+        elif box.type == b"saio":
+            saio = box
+
+    if senc:
+        pos = senc.payload + (16 if senc.type == b"uuid" else 0)
+        flags, = struct.unpack_from(">I", data, pos)
+        pos += 4
+        if flags & 0x1:
+            # PIFF overrides the track's encryption parameters
+            iv_size = data[pos + 3]
+            pos += 20
+        sample_count, = struct.unpack_from(">I", data, pos)
+        pos += 4
+        infos = []
+        for _ in range(sample_count):
+            pos, info = read_sample_info(data, pos, iv_size, bool(flags & 0x2), track)
+            infos.append(info)
+    elif saiz and saio:
+        pos = saiz.payload + 4 + 8 * (data[saiz.payload + 3] & 0x1)
+        default_size, sample_count = struct.unpack_from(">BI", data, pos)
+        sizes = data[pos + 5:pos + 5 + sample_count] if not default_size else [default_size] * sample_count
+        pos = saio.payload + 4 + 8 * (data[saio.payload + 3] & 0x1)
+        pos = base + struct.unpack_from(">Q" if data[saio.payload] else ">I", data, pos + 4)[0]
+        infos = []
+        for size in sizes:
+            _, info = read_sample_info(data, pos, iv_size, size > iv_size, track)
+            infos.append(info)
+            pos += size
+    else:
+        infos = []
+
+    for info_box in (senc, saiz, saio):
+        if info_box:
+            free_box(data, info_box)
+
+    return iter(infos)
+
+
+def read_sample_info(
+    data: bytearray,
+    pos: int,
+    iv_size: int,
+    has_subsamples: bool,
+    track: CencTrack
+) -> tuple[int, SampleInfo]:
+    """Read the encryption info of a sample, returning the position after it and the info."""
+    iv = bytes(data[pos:pos + iv_size]) if iv_size else track.constant_iv
+    pos += iv_size
+    subsamples = []
+    if has_subsamples:
+        subsample_count, = struct.unpack_from(">H", data, pos)
+        pos += 2
+        subsamples = [
+            struct.unpack_from(">HI", data, pos + 6 * i)
+            for i in range(subsample_count)
+        ]
+        pos += 6 * subsample_count
+    return pos, SampleInfo(iv, subsamples)
+
+
+def decrypt_sample(data: bytearray, start: int, size: int, sample_info: SampleInfo, track: CencTrack) -> None:
+    """Decrypt a sample in place, per the track's protection scheme."""
+    if sample_info.subsamples:
+        protected = []
+        pos = start
+        for clear_size, protected_size in sample_info.subsamples:
+            pos += clear_size
+            protected.append((pos, protected_size))
+            pos += protected_size
+    else:
+        protected = [(start, size)]
+
+    view = memoryview(data)
+    iv = sample_info.iv.ljust(16, b"\x00")
+    if track.scheme == b"cbcs":
+        # every subsample starts over with the same IV
+        for range_start, range_size in protected:
+            decrypt_range(view, AES.new(track.key, AES.MODE_CBC, iv=iv), range_start, range_size, track)
+    else:
+        # the cipher carries on from one subsample to the next
+        cipher: Union[CbcMode, CtrMode]
+        if track.scheme == b"cbc1":
+            cipher = AES.new(track.key, AES.MODE_CBC, iv=iv)
+        else:
+            cipher = AES.new(track.key, AES.MODE_CTR, nonce=b"", initial_value=iv)
+        for range_start, range_size in protected:
+            decrypt_range(view, cipher, range_start, range_size, track)
+
+
+def decrypt_range(view: memoryview, cipher: Union[CbcMode, CtrMode], start: int, size: int, track: CencTrack) -> None:
+    """
+    Decrypt the protected range of a sample in place, per the track's pattern.
+
+    With a pattern, only the first `crypt` of every `crypt + skip` blocks is encrypted,
+    and a trailing partial block is left in the clear. CBC always leaves a trailing
+    partial block in the clear.
+    """
+    is_cbc = track.scheme in (b"cbc1", b"cbcs")
+    crypt_size = track.crypt_byte_block * 16
+    skip_size = track.skip_byte_block * 16
+
+    if not skip_size:
+        end = start + size - (size % 16 if is_cbc else 0)
+        if end > start:
+            cipher.decrypt(view[start:end], output=view[start:end])
+        return
+    if not crypt_size:
+        return
+
+    count, remaining = divmod(size, crypt_size + skip_size)
+    if count:
+        # (un)pack every encrypted and clear block at once instead of one by one
+        end = start + count * (crypt_size + skip_size)
+        blocks = list(get_pattern(count, crypt_size, skip_size).unpack_from(view, start))
+        decrypted = cipher.decrypt(b"".join(blocks[0::2]))
+        blocks[0::2] = get_pattern(count, crypt_size, 0).unpack(decrypted)
+        view[start:end] = b"".join(blocks)
+        start = end
+
+    end = start + min(crypt_size, remaining - remaining % 16)
+    if end > start:
+        cipher.decrypt(view[start:end], output=view[start:end])
+
+
+@lru_cache(maxsize=256)
+def get_pattern(count: int, crypt_size: int, skip_size: int) -> struct.Struct:
+    """Get a struct to split data into the encrypted and clear blocks of a repeated pattern."""
+    if not skip_size:
+        return struct.Struct(f"{crypt_size}s" * count)
+    return struct.Struct(f"{crypt_size}s{skip_size}s" * count)
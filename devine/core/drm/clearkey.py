@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import base64
-import shutil
+import os
+import threading
 from pathlib import Path
 from typing import Optional, Union
 from urllib.parse import urljoin
@@ -11,6 +12,10 @@ from Cryptodome.Util.Padding import unpad
 from m3u8.model import Key
 from requests import Session
 
+_decrypt_buffer = threading.local()
+# the largest buffer kept for re-use by each thread, bigger files get one of their own
+MAX_DECRYPT_BUFFER_SIZE = 32 * 1024 * 1024
+
 
 class ClearKey:
     """AES Clear Key DRM System."""
@@ -37,25 +42,41 @@ class ClearKey:
         self.iv: bytes = iv
 
     def decrypt(self, path: Path) -> None:
-        """Decrypt a Track with AES Clear Key DRM."""
+        """
+        Decrypt a Track with AES Clear Key DRM, in place.
+
+        The file is decrypted within a re-usable (per-thread) buffer and written back
+        once, so it's safe and cheap to decrypt many segments at once from a thread pool.
+        The buffer is freed with its thread, and files bigger than MAX_DECRYPT_BUFFER_SIZE
+        don't replace it.
+        """
         if not path or not path.exists():
             raise ValueError("Tried to decrypt a file that does not exist.")
 
-        decrypted = AES. \
-            new(self.key, AES.MODE_CBC, self.iv). \
-            decrypt(path.read_bytes())
-
-        try:
-            decrypted = unpad(decrypted, AES.block_size)
-        except ValueError:
-            # the decrypted data is likely already in the block size boundary
-            pass
-
-        decrypted_path = path.with_suffix(f".decrypted{path.suffix}")
-        decrypted_path.write_bytes(decrypted)
-
-        path.unlink()
-        shutil.move(decrypted_path, path)
+        with open(path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            buffer = getattr(_decrypt_buffer, "buffer", None)
+            if buffer is None or len(buffer) < size:
+                buffer = bytearray(size)
+                if size <= MAX_DECRYPT_BUFFER_SIZE:
+                    _decrypt_buffer.buffer = buffer
+            data = memoryview(buffer)[:size]
+            f.readinto(data)
+
+            AES. \
+                new(self.key, AES.MODE_CBC, self.iv). \
+                decrypt(data, output=data)
+
+            if size >= AES.block_size:
+                try:
+                    size -= AES.block_size - len(unpad(data[-AES.block_size:], AES.block_size))
+                except ValueError:
+                    # the decrypted data is likely already in the block size boundary
+                    pass
+
+            f.seek(0)
+            f.write(data[:size])
+            f.truncate()
 
     @classmethod
     def from_m3u_key(cls, m3u_key: Key, session: Optional[Session] = None) -> ClearKey:
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import base64
+import os
 import shutil
 import subprocess
 import textwrap
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Callable, Optional, Union
+from typing import Any, BinaryIO, Callable, Iterator, Optional, Union
 from uuid import UUID
 
 import m3u8
@@ -20,8 +23,9 @@ from devine.core import binaries
 from devine.core.config import config
 from devine.core.console import console
 from devine.core.constants import AnyTrack
-from devine.core.utilities import get_boxes
-from devine.core.utils.subprocess import ffprobe
+from devine.core.drm import cenc
+from devine.core.utilities import open_named_pipe
+from devine.core.utils.init_segment import InitSegment
 
 
 class Widevine:
@@ -57,7 +61,7 @@ class Widevine:
         """
         Get PSSH and KID from within the Initiation Segment of the Track Data.
         It also tries to get PSSH and KID from other track data like M3U8 data
-        as well as through ffprobe.
+        as well as from WebM data, with ffprobe as a last resort.
 
         Create a Widevine DRM System object from a track's information.
         This should only be used if a PSSH could not be provided directly.
@@ -76,7 +80,7 @@ class Widevine:
 
         kid: Optional[UUID] = None
         pssh_boxes: list[Container] = []
-        tenc_boxes: list[Container] = []
+        tenc_key_ids: list[UUID] = []
 
         if track.descriptor == track.Descriptor.HLS:
             m3u_url = track.url
@@ -87,17 +91,10 @@ class Widevine:
                 if x and x.keyformat and x.keyformat.lower() == WidevineCdm.urn
             )
 
-        init_data = track.get_init_segment(session=session)
-        if init_data:
-            # try get via ffprobe, needed for non mp4 data e.g. WEBM from Google Play
-            probe = ffprobe(init_data)
-            if probe:
-                for stream in probe.get("streams") or []:
-                    enc_key_id = stream.get("tags", {}).get("enc_key_id")
-                    if enc_key_id:
-                        kid = UUID(bytes=base64.b64decode(enc_key_id))
-            pssh_boxes.extend(list(get_boxes(init_data, b"pssh")))
-            tenc_boxes.extend(list(get_boxes(init_data, b"tenc")))
+        init_segment = track.parse_init_segment(session=session)
+        kid = init_segment.enc_key_id
+        pssh_boxes.extend(init_segment.pssh_boxes)
+        tenc_key_ids.extend(init_segment.tenc_key_ids)
 
         pssh_boxes.sort(key=lambda b: {
             PSSH.SystemId.Widevine: 0,
@@ -108,40 +105,37 @@ class Widevine:
         if not pssh:
             raise Widevine.Exceptions.PSSHNotFound("PSSH was not found in track data.")
 
-        tenc = next(iter(tenc_boxes), None)
-        if not kid and tenc and tenc.key_ID.int != 0:
-            kid = tenc.key_ID
+        tenc_key_id = next(iter(tenc_key_ids), None)
+        if not kid and tenc_key_id and tenc_key_id.int != 0:
+            kid = tenc_key_id
 
         return cls(pssh=PSSH(pssh), kid=kid)
 
     @classmethod
-    def from_init_data(cls, init_data: bytes) -> Widevine:
+    def from_init_data(cls, init_data: Union[bytes, InitSegment]) -> Widevine:
         """
         Get PSSH and KID from within Initialization Segment Data.
 
         This should only be used if a PSSH could not be provided directly.
         It is *rare* to need to use this.
 
+        Pass the track's InitSegment, from Track.parse_init_segment(), to reuse
+        what was already found in it, e.g., when probing for the track's Key ID.
+
         Raises:
             PSSHNotFound - If the PSSH was not found within the data.
             KIDNotFound - If the KID was not found within the data or PSSH.
         """
         if not init_data:
             raise ValueError("Init data should be provided.")
-        if not isinstance(init_data, bytes):
-            raise TypeError(f"Expected init data to be bytes, not {init_data!r}")
-
-        kid: Optional[UUID] = None
-        pssh_boxes: list[Container] = list(get_boxes(init_data, b"pssh"))
-        tenc_boxes: list[Container] = list(get_boxes(init_data, b"tenc"))
+        if not isinstance(init_data, (bytes, InitSegment)):
+            raise TypeError(f"Expected init data to be bytes or an {InitSegment}, not {init_data!r}")
+        if isinstance(init_data, bytes):
+            init_data = InitSegment(init_data)
 
-        # try get via ffprobe, needed for non mp4 data e.g. WEBM from Google Play
-        probe = ffprobe(init_data)
-        if probe:
-            for stream in probe.get("streams") or []:
-                enc_key_id = stream.get("tags", {}).get("enc_key_id")
-                if enc_key_id:
-                    kid = UUID(bytes=base64.b64decode(enc_key_id))
+        pssh_boxes: list[Container] = list(init_data.pssh_boxes)
+        tenc_key_ids: list[UUID] = init_data.tenc_key_ids
+        kid: Optional[UUID] = init_data.enc_key_id
 
         pssh_boxes.sort(key=lambda b: {
             PSSH.SystemId.Widevine: 0,
@@ -152,9 +146,9 @@ class Widevine:
         if not pssh:
             raise Widevine.Exceptions.PSSHNotFound("PSSH was not found in track data.")
 
-        tenc = next(iter(tenc_boxes), None)
-        if not kid and tenc and tenc.key_ID.int != 0:
-            kid = tenc.key_ID
+        tenc_key_id = next(iter(tenc_key_ids), None)
+        if not kid and tenc_key_id and tenc_key_id.int != 0:
+            kid = tenc_key_id
 
         return cls(pssh=PSSH(pssh), kid=kid)
 
@@ -215,81 +209,31 @@ class Widevine:
     def decrypt(self, path: Path) -> None:
         """
         Decrypt a Track with Widevine DRM.
+
+        It's decrypted with Shaka Packager, or in place with the native CENC decryptor,
+        per the decryption engine, see Widevine.get_engine().
         Raises:
             EnvironmentError if the Shaka Packager executable could not be found.
-            ValueError if the track has not yet been downloaded.
+            ValueError if the track has not yet been downloaded, or could not be
+                decrypted by the native decryptor.
             SubprocessError if Shaka Packager returned a non-zero exit code.
         """
         if not self.content_keys:
             raise ValueError("Cannot decrypt a Track without any Content Keys...")
 
-        if not binaries.ShakaPackager:
-            raise EnvironmentError("Shaka Packager executable not found but is required.")
         if not path or not path.exists():
             raise ValueError("Tried to decrypt a file that does not exist.")
+        if self.get_engine() == "native":
+            cenc.decrypt(path, self.content_keys)
+            return
+        if not binaries.ShakaPackager:
+            raise EnvironmentError("Shaka Packager executable not found but is required.")
 
         output_path = path.with_stem(f"{path.stem}_decrypted")
         config.directories.temp.mkdir(parents=True, exist_ok=True)
 
         try:
-            arguments = [
-                f"input={path},stream=0,output={output_path},output_format=MP4",
-                "--enable_raw_key_decryption", "--keys",
-                ",".join([
-                    *[
-                        "label={}:key_id={}:key={}".format(i, kid.hex, key.lower())
-                        for i, (kid, key) in enumerate(self.content_keys.items())
-                    ],
-                    *[
-                        # some services use a blank KID on the file, but real KID for license server
-                        "label={}:key_id={}:key={}".format(i, "00" * 16, key.lower())
-                        for i, (kid, key) in enumerate(self.content_keys.items(), len(self.content_keys))
-                    ]
-                ]),
-                "--temp_dir", config.directories.temp
-            ]
-
-            p = subprocess.Popen(
-                [binaries.ShakaPackager, *arguments],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-
-            stream_skipped = False
-            had_error = False
-
-            shaka_log_buffer = ""
-            for line in iter(p.stderr.readline, ""):
-                line = line.strip()
-                if not line:
-                    continue
-                if "Skip stream" in line:
-                    # file/segment was so small that it didn't have any actual data, ignore
-                    stream_skipped = True
-                if ":INFO:" in line:
-                    continue
-                if ":ERROR:" in line:
-                    had_error = True
-                if "Insufficient bits in bitstream for given AVC profile" in line:
-                    # this is a warning and is something we don't have to worry about
-                    continue
-                shaka_log_buffer += f"{line.strip()}\n"
-
-            if shaka_log_buffer:
-                # wrap to console width - padding - '[Widevine]: '
-                shaka_log_buffer = "\n            ".join(textwrap.wrap(
-                    shaka_log_buffer.rstrip(),
-                    width=console.width - 22,
-                    initial_indent=""
-                ))
-                console.log(Text.from_ansi("\n[Widevine]: " + shaka_log_buffer))
-
-            p.wait()
-
-            if p.returncode != 0 or had_error:
-                raise subprocess.CalledProcessError(p.returncode, arguments)
-
+            stream_skipped = self._wait_packager(*self._start_packager(path, output_path))
             path.unlink()
             if not stream_skipped:
                 shutil.move(output_path, path)
@@ -298,6 +242,162 @@ class Widevine:
                 raise KeyboardInterrupt()
             raise
 
+    @contextmanager
+    def decrypt_stream(self, path: Path) -> Iterator[BinaryIO]:
+        """
+        Decrypt a Track with Widevine DRM while it's being downloaded.
+
+        Yields a file object to write the encrypted track to, in order. Shaka Packager
+        reads it from a named pipe and writes the decrypted track to the path, so the
+        encrypted track never has to be written to, and read back from, the disk.
+
+        Named pipes are not available on Windows, see Widevine.can_decrypt_stream().
+        Raises:
+            EnvironmentError if the Shaka Packager executable could not be found.
+            ValueError if Shaka Packager skipped the track as it had no actual data.
+            SubprocessError if Shaka Packager returned a non-zero exit code.
+        """
+        if not self.content_keys:
+            raise ValueError("Cannot decrypt a Track without any Content Keys...")
+
+        if not binaries.ShakaPackager:
+            raise EnvironmentError("Shaka Packager executable not found but is required.")
+
+        input_path = path.with_name(f"{path.name}.fifo")
+        input_path.unlink(missing_ok=True)
+        os.mkfifo(input_path)
+        config.directories.temp.mkdir(parents=True, exist_ok=True)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        f: Optional[BinaryIO] = None
+        try:
+            p, arguments = self._start_packager(input_path, path)
+            # its log must be read while we write to it, or it could block writing to the log
+            packager: Future[bool] = executor.submit(self._wait_packager, p, arguments)
+
+            try:
+                f = open_named_pipe(input_path, lambda: not packager.done())
+            except BrokenPipeError:
+                packager.result()  # raises the error it failed with
+                raise ValueError("Shaka Packager ended without reading the track")
+
+            try:
+                yield f
+                f.close()
+            except BrokenPipeError:
+                # it stopped reading, it most likely failed
+                packager.result()
+                raise
+            except BaseException:
+                # the track is incomplete, there's no need to let it finish
+                p.kill()
+                raise
+
+            if packager.result():
+                raise ValueError("Shaka Packager skipped the track, there's no data to decrypt")
+        except subprocess.CalledProcessError as e:
+            if e.returncode == 0xC000013A:  # STATUS_CONTROL_C_EXIT
+                raise KeyboardInterrupt()
+            raise
+        finally:
+            if f and not f.closed:
+                try:
+                    f.close()  # lets it finish reading so it can exit
+                except BrokenPipeError:
+                    pass
+            executor.shutdown(wait=True)
+            input_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def can_decrypt_stream() -> bool:
+        """Check if a Track can be decrypted while it's being downloaded, see decrypt_stream()."""
+        return hasattr(os, "mkfifo") and bool(binaries.ShakaPackager) and Widevine.get_engine() == "packager"
+
+    @staticmethod
+    def get_engine() -> str:
+        """
+        Get the engine to decrypt with, "packager" (Shaka Packager) or "native".
+
+        It's set by the config, and otherwise is Shaka Packager if it's installed.
+        """
+        engine = config.decryption.get("engine") or ("packager" if binaries.ShakaPackager else "native")
+        if engine not in ("packager", "native"):
+            raise ValueError(f"Unknown decryption engine {engine!r}, expected \"packager\" or \"native\"")
+        return engine
+
+    def _start_packager(self, input_path: Path, output_path: Path) -> tuple[subprocess.Popen, list[str]]:
+        """Start decrypting a file with Shaka Packager, returning the process and its arguments."""
+        arguments = [
+            f"input={input_path},stream=0,output={output_path},output_format=MP4",
+            "--enable_raw_key_decryption", "--keys",
+            ",".join([
+                *[
+                    "label={}:key_id={}:key={}".format(i, kid.hex, key.lower())
+                    for i, (kid, key) in enumerate(self.content_keys.items())
+                ],
+                *[
+                    # some services use a blank KID on the file, but real KID for license server
+                    "label={}:key_id={}:key={}".format(i, "00" * 16, key.lower())
+                    for i, (kid, key) in enumerate(self.content_keys.items(), len(self.content_keys))
+                ]
+            ]),
+            "--temp_dir", config.directories.temp
+        ]
+
+        p = subprocess.Popen(
+            [binaries.ShakaPackager, *arguments],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+
+        return p, arguments
+
+    @staticmethod
+    def _wait_packager(p: subprocess.Popen, arguments: list[str]) -> bool:
+        """
+        Wait for Shaka Packager to finish decrypting, logging any problems it reported.
+
+        Returns True if the stream was skipped as it had no actual data to decrypt,
+        in which case nothing was written to the output path.
+        Raises SubprocessError if Shaka Packager returned a non-zero exit code.
+        """
+        stream_skipped = False
+        had_error = False
+
+        shaka_log_buffer = ""
+        for line in iter(p.stderr.readline, ""):
+            line = line.strip()
+            if not line:
+                continue
+            if "Skip stream" in line:
+                # file/segment was so small that it didn't have any actual data, ignore
+                stream_skipped = True
+            if ":INFO:" in line:
+                continue
+            if ":ERROR:" in line:
+                had_error = True
+            if "Insufficient bits in bitstream for given AVC profile" in line:
+                # this is a warning and is something we don't have to worry about
+                continue
+            shaka_log_buffer += f"{line.strip()}\n"
+
+        if shaka_log_buffer:
+            # wrap to console width - padding - '[Widevine]: '
+            shaka_log_buffer = "\n            ".join(textwrap.wrap(
+                shaka_log_buffer.rstrip(),
+                width=console.width - 22,
+                initial_indent=""
+            ))
+            console.log(Text.from_ansi("\n[Widevine]: " + shaka_log_buffer))
+
+        p.wait()
+
+        if p.returncode != 0 or had_error:
+            raise subprocess.CalledProcessError(p.returncode, arguments)
+
+        return stream_skipped
+
     class Exceptions:
         class PSSHNotFound(Exception):
             """PSSH (Protection System Specific Header) was not found."""
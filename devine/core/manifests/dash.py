@@ -5,32 +5,64 @@ import html
 import logging
 import math
 import re
+import shutil
 import sys
+import time
+from concurrent.futures import Future
 from copy import copy
 from functools import partial
 from pathlib import Path
-from typing import Any, Callable, Optional, Union
+from typing import Any, Callable, NamedTuple, Optional, Union
 from urllib.parse import urljoin, urlparse
 from uuid import UUID
 from zlib import crc32
 
 import requests
 from langcodes import Language, tag_is_valid
-from lxml.etree import Element, ElementTree
+from lxml import etree
+from lxml.etree import Element
 from pywidevine.cdm import Cdm as WidevineCdm
 from pywidevine.pssh import PSSH
 from requests import Session
 
-from devine.core.constants import DOWNLOAD_CANCELLED, DOWNLOAD_LICENCE_ONLY, AnyTrack
+from devine.core.config import config
+from devine.core.constants import DOWNLOAD_LICENCE_ONLY, AnyTrack
 from devine.core.downloaders import requests as requests_downloader
 from devine.core.drm import Widevine
 from devine.core.events import events
+from devine.core.scheduler import scheduler
 from devine.core.tracks import Audio, Subtitle, Tracks, Video
-from devine.core.utilities import is_close_match, try_ensure_utf8
+from devine.core.utilities import (append_file, is_close_match, license_in_background, try_ensure_utf8,
+                                   wait_for_license)
+from devine.core.utils.collections import LazySequence
+from devine.core.utils.control_file import ControlFile, get_segments_key
+from devine.core.utils.init_segment import InitSegment
+from devine.core.utils.segments import Segments
 from devine.core.utils.xml import load_xml
 
 
 class DASH:
+    class RepresentationInfo(NamedTuple):
+        """
+        What's needed to download a Representation, without the rest of the MPD.
+
+        The elements are copies, so the MPD can be freed once the tracks have been
+        selected, see DASH.release_manifest().
+        """
+        id: Optional[str]
+        bandwidth: Optional[str]
+        base_urls: tuple[Optional[str], Optional[str], Optional[str]]  # of the MPD, Period, and Representation
+        period_duration: Optional[str]
+        segment_template: Optional[Element]
+        segment_list: Optional[Element]
+        segment_base: Optional[Element]
+        content_protection: list[Element]
+
+    # compiled once, as they're evaluated for every Representation of every AdaptationSet
+    _xpath_supplemental_props = etree.XPath("SupplementalProperty")
+    _xpath_essential_props = etree.XPath("EssentialProperty")
+    _xpath_channels = etree.XPath("AudioChannelConfiguration/@value")
+
     def __init__(self, manifest, url: str):
         if manifest is None:
             raise ValueError("DASH manifest must be provided.")
@@ -111,9 +143,19 @@ class DASH:
                     # we don't want trick mode streams (they are only used for fast-forward/rewind)
                     continue
 
+                # everything that's only on the AdaptationSet is resolved once, not per Representation
+                adaptation_set_attrib = dict(adaptation_set.attrib)
+                adaptation_set_supplemental_props = self._xpath_supplemental_props(adaptation_set)
+                adaptation_set_essential_props = self._xpath_essential_props(adaptation_set)
+                adaptation_set_channels = self._xpath_channels(adaptation_set)
+                descriptive = self.is_descriptive(adaptation_set)
+                closed_caption = self.is_closed_caption(adaptation_set)
+                sdh = self.is_sdh(adaptation_set)
+                forced = self.is_forced(adaptation_set)
+
                 for rep in adaptation_set.findall("Representation"):
-                    get = partial(self._get, adaptation_set=adaptation_set, representation=rep)
-                    findall = partial(self._findall, adaptation_set=adaptation_set, representation=rep, both=True)
+                    # Representation attributes take precedence over the AdaptationSet's
+                    get = {**adaptation_set_attrib, **rep.attrib}.get
                     segment_base = rep.find("SegmentBase")
 
                     codecs = get("codecs")
@@ -149,8 +191,8 @@ class DASH:
                         track_args = dict(
                             range_=self.get_video_range(
                                 codecs,
-                                findall("SupplementalProperty"),
-                                findall("EssentialProperty")
+                                self._xpath_supplemental_props(rep) + adaptation_set_supplemental_props,
+                                self._xpath_essential_props(rep) + adaptation_set_essential_props
                             ),
                             bitrate=get("bandwidth") or None,
                             width=get("width") or 0,
@@ -162,20 +204,17 @@ class DASH:
                         track_codec = Audio.Codec.from_codecs(codecs)
                         track_args = dict(
                             bitrate=get("bandwidth") or None,
-                            channels=next(iter(
-                                rep.xpath("AudioChannelConfiguration/@value")
-                                or adaptation_set.xpath("AudioChannelConfiguration/@value")
-                            ), None),
+                            channels=next(iter(self._xpath_channels(rep) or adaptation_set_channels), None),
                             joc=self.get_ddp_complexity_index(adaptation_set, rep),
-                            descriptive=self.is_descriptive(adaptation_set)
+                            descriptive=descriptive
                         )
                     elif content_type == "text":
                         track_type = Subtitle
                         track_codec = Subtitle.Codec.from_codecs(codecs or "vtt")
                         track_args = dict(
-                            cc=self.is_closed_caption(adaptation_set),
-                            sdh=self.is_sdh(adaptation_set),
-                            forced=self.is_forced(adaptation_set)
+                            cc=closed_caption,
+                            sdh=sdh,
+                            forced=forced
                         )
                     elif content_type == "image":
                         # we don't want what's likely thumbnails for the seekbar
@@ -251,42 +290,30 @@ class DASH:
 
         log = logging.getLogger("DASH")
 
-        manifest: ElementTree = track.data["dash"]["manifest"]
-        period: Element = track.data["dash"]["period"]
-        adaptation_set: Element = track.data["dash"]["adaptation_set"]
-        representation: Element = track.data["dash"]["representation"]
+        rep_info = DASH.get_track_representation_info(track)
 
-        track.drm = DASH.get_drm(
-            representation.findall("ContentProtection") +
-            adaptation_set.findall("ContentProtection")
-        )
+        track.drm = DASH.get_drm(rep_info.content_protection)
 
-        manifest_base_url = manifest.findtext("BaseURL")
+        manifest_base_url, period_base_url, rep_base_url = rep_info.base_urls
         if not manifest_base_url:
             manifest_base_url = track.url
         elif not re.match("^https?://", manifest_base_url, re.IGNORECASE):
             manifest_base_url = urljoin(track.url, f"./{manifest_base_url}")
-        period_base_url = urljoin(manifest_base_url, period.findtext("BaseURL"))
-        rep_base_url = urljoin(period_base_url, representation.findtext("BaseURL"))
+        period_base_url = urljoin(manifest_base_url, period_base_url)
+        rep_base_url = urljoin(period_base_url, rep_base_url)
 
-        period_duration = period.get("duration") or manifest.get("mediaPresentationDuration")
+        period_duration = rep_info.period_duration
         init_data: Optional[bytes] = None
+        init_segment: Optional[InitSegment] = None
 
-        segment_template = representation.find("SegmentTemplate")
-        if segment_template is None:
-            segment_template = adaptation_set.find("SegmentTemplate")
-
-        segment_list = representation.find("SegmentList")
-        if segment_list is None:
-            segment_list = adaptation_set.find("SegmentList")
-
-        segment_base = representation.find("SegmentBase")
-        if segment_base is None:
-            segment_base = adaptation_set.find("SegmentBase")
+        segment_template = rep_info.segment_template
+        segment_list = rep_info.segment_list
+        segment_base = rep_info.segment_base
 
-        segments: list[tuple[str, Optional[str]]] = []
+        # a LazySequence for SegmentTemplate, as there may be many thousands of segments
+        segments: Union[list[tuple[str, Optional[str]]], LazySequence] = []
         segment_timescale: float = 0
-        segment_durations: list[int] = []
+        segment_info = Segments()
         track_kid: Optional[UUID] = None
 
         if segment_template is not None:
@@ -312,37 +339,39 @@ class DASH:
 
             init_url = segment_template.get("initialization")
             if init_url:
-                res = session.get(DASH.replace_fields(
+                init_url = DASH.replace_fields(
                     init_url,
-                    Bandwidth=representation.get("bandwidth"),
-                    RepresentationID=representation.get("id")
-                ))
+                    Bandwidth=rep_info.bandwidth,
+                    RepresentationID=rep_info.id
+                )
+                res = session.get(init_url)
                 res.raise_for_status()
                 init_data = res.content
-                track_kid = track.get_key_id(init_data)
+                init_segment = track.parse_init_segment(init_data, url=init_url)
+                track_kid = track.get_key_id(init_segment)
+
+            # the segment URLs are made as they're needed, as there may be many thousands
+            media_url = DASH.compile_template(
+                segment_template.get("media"),
+                Bandwidth=rep_info.bandwidth,
+                RepresentationID=rep_info.id
+            )
 
             if segment_timeline is not None:
-                current_time = 0
-                for s in segment_timeline.findall("S"):
-                    if s.get("t"):
-                        current_time = int(s.get("t"))
-                    for _ in range(1 + (int(s.get("r") or 0))):
-                        segment_durations.append(current_time)
-                        current_time += int(s.get("d"))
+                for s in segment_timeline.iterfind("S"):
+                    segment_info.extend(
+                        duration=int(s.get("d")),
+                        count=1 + int(s.get("r") or 0),
+                        start=int(s.get("t")) if s.get("t") else None
+                    )
 
                 if not end_number:
-                    end_number = len(segment_durations)
-
-                for t, n in zip(segment_durations, range(start_number, end_number + 1)):
-                    segments.append((
-                        DASH.replace_fields(
-                            segment_template.get("media"),
-                            Bandwidth=representation.get("bandwidth"),
-                            Number=n,
-                            RepresentationID=representation.get("id"),
-                            Time=t
-                        ), None
-                    ))
+                    end_number = len(segment_info)
+
+                segments = LazySequence(
+                    min(len(segment_info), end_number - start_number + 1),
+                    lambda i: (media_url(Number=start_number + i, Time=segment_info.start[i]), None)
+                )
             else:
                 if not period_duration:
                     raise ValueError("Duration of the Period was unable to be determined.")
@@ -352,22 +381,17 @@ class DASH:
                 if not end_number:
                     end_number = math.ceil(period_duration / (segment_duration / segment_timescale))
 
-                for s in range(start_number, end_number + 1):
-                    segments.append((
-                        DASH.replace_fields(
-                            segment_template.get("media"),
-                            Bandwidth=representation.get("bandwidth"),
-                            Number=s,
-                            RepresentationID=representation.get("id"),
-                            Time=s
-                        ), None
-                    ))
-                    # TODO: Should we floor/ceil/round, or is int() ok?
-                    segment_durations.append(int(segment_duration))
+                segments = LazySequence(
+                    range(start_number, end_number + 1),
+                    lambda n: (media_url(Number=n, Time=n), None)
+                )
+                # TODO: Should we floor/ceil/round, or is int() ok?
+                segment_info.extend(int(segment_duration), len(segments))
         elif segment_list is not None:
             segment_timescale = float(segment_list.get("timescale") or 1)
 
             init_data = None
+            init_segment = None
             initialization = segment_list.find("Initialization")
             if initialization is not None:
                 source_url = initialization.get("sourceURL")
@@ -384,7 +408,12 @@ class DASH:
                 res = session.get(url=source_url, headers=init_range_header)
                 res.raise_for_status()
                 init_data = res.content
-                track_kid = track.get_key_id(init_data)
+                init_segment = track.parse_init_segment(
+                    init_data,
+                    url=source_url,
+                    byte_range=initialization.get("range")
+                )
+                track_kid = track.get_key_id(init_segment)
 
             segment_urls = segment_list.findall("SegmentURL")
             for segment_url in segment_urls:
@@ -398,10 +427,14 @@ class DASH:
                     media_url,
                     segment_url.get("mediaRange")
                 ))
-                segment_durations.append(int(segment_url.get("duration") or 1))
+                segment_info.append(
+                    duration=int(segment_url.get("duration") or 1),
+                    byte_range=segment_url.get("mediaRange")
+                )
         elif segment_base is not None:
             media_range = None
             init_data = None
+            init_segment = None
             initialization = segment_base.find("Initialization")
             if initialization is not None:
                 if initialization.get("range"):
@@ -412,7 +445,12 @@ class DASH:
                 res = session.get(url=rep_base_url, headers=init_range_header)
                 res.raise_for_status()
                 init_data = res.content
-                track_kid = track.get_key_id(init_data)
+                init_segment = track.parse_init_segment(
+                    init_data,
+                    url=rep_base_url,
+                    byte_range=initialization.get("range")
+                )
+                track_kid = track.get_key_id(init_segment)
                 total_size = res.headers.get("Content-Range", "").split("/")[-1]
                 if total_size:
                     media_range = f"{len(init_data)}-{total_size}"
@@ -432,37 +470,37 @@ class DASH:
             sys.exit(1)
 
         # TODO: Should we floor/ceil/round, or is int() ok?
-        track.data["dash"]["timescale"] = int(segment_timescale)
-        track.data["dash"]["segment_durations"] = segment_durations
+        segment_info.timescale = int(segment_timescale)
+        track.data["dash"]["segments"] = segment_info
 
         if not track.drm and isinstance(track, (Video, Audio)):
             try:
-                track.drm = [Widevine.from_init_data(init_data)]
+                track.drm = [Widevine.from_init_data(init_segment)]
             except Widevine.Exceptions.PSSHNotFound:
                 # it might not have Widevine DRM, or might not have found the PSSH
                 log.warning("No Widevine PSSH was found for this track, is it DRM free?")
 
+        licensing: Optional[Future] = None
         if track.drm:
-            # last chance to find the KID, assumes first segment will hold the init data
-            track_kid = track_kid or track.get_key_id(url=segments[0][0], session=session)
             # TODO: What if we don't want to use the first DRM system?
             drm = track.drm[0]
             if isinstance(drm, Widevine):
-                # license and grab content keys
-                try:
+                def license_drm() -> None:
+                    """License and grab content keys."""
                     if not license_widevine:
                         raise ValueError("license_widevine func must be supplied to use Widevine DRM")
-                    progress(downloaded="LICENSING")
-                    license_widevine(drm, track_kid=track_kid)
-                    progress(downloaded="[yellow]LICENSED")
-                except Exception:  # noqa
-                    DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                    progress(downloaded="[red]FAILED")
-                    raise
+                    # last chance to find the KID, assumes first segment will hold the init data
+                    kid = track_kid or track.get_key_id(url=segments[0][0], session=session)
+                    license_widevine(drm, track_kid=kid)
+
+                # the keys are only needed to decrypt, so the segments download meanwhile
+                licensing = license_in_background(license_drm)
         else:
             drm = None
 
         if DOWNLOAD_LICENCE_ONLY.is_set():
+            if licensing:
+                wait_for_license(licensing, progress)
             progress(downloaded="[yellow]SKIPPED")
             return
 
@@ -474,69 +512,206 @@ class DASH:
             downloader = requests_downloader
             log.warning("Falling back to the requests downloader as aria2(c) doesn't support the Range header")
 
-        for status_update in downloader(
-            urls=[
-                {
-                    "url": url,
-                    "headers": {
-                        "Range": f"bytes={bytes_range}"
-                    } if bytes_range else {}
-                }
-                for url, bytes_range in segments
-            ],
-            output_dir=save_dir,
-            filename="{i:0%d}.mp4" % (len(str(len(segments)))),
-            headers=session.headers,
-            cookies=session.cookies,
-            proxy=proxy,
-            max_workers=max_workers
+        # segments are handed to us in order, straight from memory, instead of as files
+        in_memory = downloader is requests_downloader and config.requests.get("in_memory")
+
+        # the merge progress is saved to the track's control file, so that an interrupted
+        # download continues from the first segment that was not yet merged
+        track_control_file = ControlFile(save_path)
+        segments_key = get_segments_key(segments)
+        state = track_control_file.load()
+        if not (
+            state and state.get("segments") == len(segments) and state.get("key") == segments_key and
+            all(isinstance(state.get(k), int) for k in ("offset", "merged", "size")) and
+            0 <= state["offset"] <= state["merged"] < len(segments) and
+            save_path.exists() and save_path.stat().st_size >= state["size"]
         ):
-            file_downloaded = status_update.get("file_downloaded")
-            if file_downloaded:
-                events.emit(events.Types.SEGMENT_DOWNLOADED, track=track, segment=file_downloaded)
-            else:
-                downloaded = status_update.get("downloaded")
-                if downloaded and downloaded.endswith("/s"):
-                    status_update["downloaded"] = f"DASH {downloaded}"
-                progress(**status_update)
-
-        # see https://github.com/devine-dl/devine/issues/71
-        for control_file in save_dir.glob("*.aria2__temp"):
-            control_file.unlink()
-
-        segments_to_merge = [
-            x
-            for x in sorted(save_dir.iterdir())
-            if x.is_file()
-        ]
-        with open(save_path, "wb") as f:
-            if init_data:
+            state = None
+            if save_dir.exists():
+                shutil.rmtree(save_dir)
+        offset = state["merged"] if state else 0
+
+        if in_memory and save_dir.exists():
+            # the remaining segments are all downloaded to memory again, so any segment
+            # files left by an interrupted download to files must not be merged after them
+            shutil.rmtree(save_dir)
+        elif state and save_dir.exists():
+            # keep segments that were downloaded but not merged, along with any control
+            # files, and rename them to their index in the remaining segments
+            name_len = len(str(len(segments) - offset))
+            for segment_file in sorted(
+                (x for x in save_dir.iterdir() if x.stem.isdigit()),
+                key=lambda x: int(x.stem)
+            ):
+                i = state["offset"] + int(segment_file.stem) - offset
+                for file in (segment_file, *(
+                    segment_file.with_name(f"{segment_file.name}{suffix}")
+                    for suffix in (".!dev", ".aria2")
+                )):
+                    if not file.exists():
+                        continue
+                    if i < 0:
+                        file.unlink()  # already merged
+                    else:
+                        file.rename(file.with_name(f"{i:0{name_len}}{file.name[len(segment_file.stem):]}"))
+
+        # segments are appended to the output file as soon as they are next in sequence,
+        # so merging overlaps the download and each segment only hits the disk once more
+        merge_buffer: dict[int, Path] = {}
+        next_segment = 0
+        merged = offset
+        last_state_save = time.time()
+
+        # decrypt the track as it's merged, instead of after, as then it's only written
+        # once, but the merge progress cannot be saved as Shaka Packager cannot resume
+        # TODO: document decryption.streaming once tested with a real Shaka Packager reading the pipe
+        stream_decrypt = (
+            isinstance(drm, Widevine) and not state and
+            config.decryption.get("streaming", False) and drm.can_decrypt_stream()
+        )
+
+        # TODO: fix encoding after decryption?
+        fix_text = (
+            not drm and isinstance(track, Subtitle) and
+            track.codec not in (Subtitle.Codec.fVTT, Subtitle.Codec.fTTML)
+        )
+
+        if stream_decrypt:
+            # Shaka Packager must be given the keys before any of the track
+            wait_for_license(licensing, progress)
+
+        with (drm.decrypt_stream(save_path) if stream_decrypt else open(save_path, "r+b" if state else "wb")) as f:
+            if state:
+                f.truncate(state["size"])
+                f.seek(state["size"])
+            elif init_data:
                 f.write(init_data)
-            if len(segments_to_merge) > 1:
-                progress(downloaded="Merging", completed=0, total=len(segments_to_merge))
-            for segment_file in segments_to_merge:
-                segment_data = segment_file.read_bytes()
-                # TODO: fix encoding after decryption?
-                if (
-                    not drm and isinstance(track, Subtitle) and
-                    track.codec not in (Subtitle.Codec.fVTT, Subtitle.Codec.fTTML)
-                ):
-                    segment_data = try_ensure_utf8(segment_data)
+
+            def save_state() -> None:
+                """Save how many segments have been merged into the output file."""
+                if stream_decrypt:
+                    return
+                f.flush()
+                track_control_file.save(dict(
+                    segments=len(segments),
+                    key=segments_key,
+                    offset=offset,
+                    merged=merged,
+                    size=f.tell()
+                ))
+
+            save_state()
+
+            def write(segment_data: bytes) -> None:
+                """Append a segment's data to the output file."""
+                if fix_text:
+                    segment_data = try_ensure_utf8(bytes(segment_data))
                     segment_data = segment_data.decode("utf8"). \
                         replace("&lrm;", html.unescape("&lrm;")). \
                         replace("&rlm;", html.unescape("&rlm;")). \
                         encode("utf8")
                 f.write(segment_data)
-                f.flush()
+                segment_merged()
+
+            def merge(segment_file: Path) -> None:
+                """Append a segment file to the output file and delete it."""
+                if fix_text:
+                    write(segment_file.read_bytes())
+                else:
+                    append_file(segment_file, f)
+                    segment_merged()
                 segment_file.unlink()
-                progress(advance=1)
+
+            def segment_merged() -> None:
+                """Count a merged segment, saving the merge progress at most every second."""
+                nonlocal merged, last_state_save
+                merged += 1
+                now = time.time()
+                if now - last_state_save > 1:
+                    save_state()
+                    last_state_save = now
+
+            def merge_ready() -> None:
+                """Merge all buffered segments that are next in sequence."""
+                nonlocal next_segment
+                while next_segment in merge_buffer:
+                    merge(merge_buffer.pop(next_segment))
+                    next_segment += 1
+
+            try:
+                downloader_args = {}
+                if downloader.__name__ != "aria2c":
+                    # aria2c runs its own process, it is not limited by the download scheduler
+                    downloader_args["priority"] = scheduler.get_priority(track.__class__.__name__)
+                if in_memory:
+                    downloader_args["on_segment"] = lambda _, segment_data: write(segment_data)
+
+                def get_segment_request(i: int) -> dict[str, Any]:
+                    url, bytes_range = segments[i]
+                    return {
+                        "url": url,
+                        "headers": {
+                            "Range": f"bytes={bytes_range}"
+                        } if bytes_range else {}
+                    }
+
+                for status_update in downloader(
+                    urls=LazySequence(range(offset, len(segments)), get_segment_request),
+                    output_dir=save_dir,
+                    filename="{i:0%d}.mp4" % (len(str(len(segments) - offset))),
+                    headers=session.headers,
+                    cookies=session.cookies,
+                    proxy=proxy,
+                    max_workers=max_workers,
+                    **downloader_args
+                ):
+                    file_downloaded = status_update.get("file_downloaded")
+                    if file_downloaded:
+                        events.emit(events.Types.SEGMENT_DOWNLOADED, track=track, segment=file_downloaded)
+                        merge_buffer[int(file_downloaded.stem)] = file_downloaded
+                        merge_ready()
+                    else:
+                        downloaded = status_update.get("downloaded")
+                        if downloaded and downloaded.endswith("/s"):
+                            status_update["downloaded"] = f"DASH {downloaded}"
+                        progress(**status_update)
+
+                if save_dir.exists():
+                    # see https://github.com/devine-dl/devine/issues/71
+                    for control_file in save_dir.glob("*.aria2__temp"):
+                        control_file.unlink()
+
+                    # some downloaders (e.g., aria2c) do not report each finished segment
+                    for segment_file in save_dir.iterdir():
+                        if segment_file.is_file() and segment_file.stem.isdigit():
+                            merge_buffer.setdefault(int(segment_file.stem), segment_file)
+
+                if len(merge_buffer) > 1:
+                    progress(downloaded="Merging", completed=0, total=len(merge_buffer))
+                for i in sorted(merge_buffer):
+                    merge(merge_buffer.pop(i))
+                    progress(advance=1)
+            except BaseException:
+                save_state()
+                error = licensing.exception() if licensing and licensing.done() and not licensing.cancelled() else None
+                if error:
+                    # the download was cancelled as licensing failed
+                    progress(downloaded="[red]FAILED")
+                    raise error
+                raise
+
+        track_control_file.delete()
 
         track.path = save_path
         events.emit(events.Types.TRACK_DOWNLOADED, track=track)
 
+        if licensing and not stream_decrypt:
+            wait_for_license(licensing, progress)
+
         if drm:
             progress(downloaded="Decrypting", completed=0, total=100)
-            drm.decrypt(save_path)
+            if not stream_decrypt:
+                drm.decrypt(save_path)
             track.drm = None
             events.emit(
                 events.Types.TRACK_DECRYPTED,
@@ -546,10 +721,77 @@ class DASH:
             )
             progress(downloaded="Decrypting", advance=100)
 
-        save_dir.rmdir()
+        if save_dir.exists():
+            save_dir.rmdir()
 
         progress(downloaded="Downloaded")
 
+    @staticmethod
+    def get_representation_info(
+        manifest: Element,
+        period: Element,
+        adaptation_set: Element,
+        representation: Element
+    ) -> DASH.RepresentationInfo:
+        """
+        Get what's needed to download a Representation, without the rest of the MPD.
+
+        The elements it needs are copied, so they don't reference the MPD. The copies
+        are made only when this is called, which is usually once a track is selected,
+        as for a large MPD with hundreds of Representations they can add up.
+        """
+        def find(tag: str) -> Optional[Element]:
+            element = representation.find(tag)
+            if element is None:
+                element = adaptation_set.find(tag)
+            return None if element is None else copy(element)
+
+        return DASH.RepresentationInfo(
+            id=representation.get("id"),
+            bandwidth=representation.get("bandwidth"),
+            base_urls=(
+                manifest.findtext("BaseURL"),
+                period.findtext("BaseURL"),
+                representation.findtext("BaseURL")
+            ),
+            period_duration=period.get("duration") or manifest.get("mediaPresentationDuration"),
+            segment_template=find("SegmentTemplate"),
+            segment_list=find("SegmentList"),
+            segment_base=find("SegmentBase"),
+            content_protection=[
+                copy(x)
+                for x in representation.findall("ContentProtection") + adaptation_set.findall("ContentProtection")
+            ]
+        )
+
+    @staticmethod
+    def get_track_representation_info(track: AnyTrack) -> DASH.RepresentationInfo:
+        """Get the RepresentationInfo of a DASH track, from the MPD if it was not yet made."""
+        data = track.data["dash"]
+        if "representation_info" not in data:
+            data["representation_info"] = DASH.get_representation_info(
+                data["manifest"],
+                data["period"],
+                data["adaptation_set"],
+                data["representation"]
+            )
+        return data["representation_info"]
+
+    @staticmethod
+    def release_manifest(track: AnyTrack) -> None:
+        """
+        Remove a DASH track's references to the MPD, keeping only its RepresentationInfo.
+
+        Once no track references the MPD, e.g., when it's done for every selected track,
+        it can be freed. Does nothing for other tracks.
+        """
+        data = track.data.get("dash")
+        if not data or "manifest" not in data:
+            return
+        DASH.get_track_representation_info(track)
+        for key in ("manifest", "period", "adaptation_set", "representation"):
+            data.pop(key, None)
+
     @staticmethod
     def _get(
         item: str,
@@ -765,6 +1007,22 @@ class DASH:
             for x in m
         )
 
+    @staticmethod
+    def compile_template(url: str, **kwargs: Any) -> Callable[..., str]:
+        """
+        Compile a SegmentTemplate URL to a function that fills in its Number and Time.
+
+        The fields given here, e.g., Bandwidth, are filled in once with replace_fields().
+        The returned function fills in the Number and Time fields by keyword, with their
+        format tags, and is much faster than calling replace_fields() for each segment.
+        """
+        url = DASH.replace_fields(url, **kwargs)
+        return re.sub(
+            r"\$(Number|Time)(?:%([a-zA-Z0-9]+))?\$",
+            lambda m: "{%s%s}" % (m.group(1), f":{m.group(2)}" if m.group(2) else ""),
+            url.replace("{", "{{").replace("}", "}}")
+        ).format
+
     @staticmethod
     def replace_fields(url: str, **kwargs: Any) -> str:
         for field, value in kwargs.items():
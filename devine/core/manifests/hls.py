@@ -5,6 +5,7 @@ import logging
 import shutil
 import subprocess
 import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
 from typing import Any, Callable, Optional, Union
@@ -24,8 +25,12 @@ from devine.core.constants import DOWNLOAD_CANCELLED, DOWNLOAD_LICENCE_ONLY, Any
 from devine.core.downloaders import requests as requests_downloader
 from devine.core.drm import DRM_T, ClearKey, Widevine
 from devine.core.events import events
+from devine.core.scheduler import scheduler
 from devine.core.tracks import Audio, Subtitle, Tracks, Video
-from devine.core.utilities import get_extension, is_close_match, try_ensure_utf8
+from devine.core.utilities import (append_file, get_extension, is_close_match, license_in_background, try_ensure_utf8,
+                                   wait_for_license)
+from devine.core.utils.control_file import ControlFile, get_segments_key
+from devine.core.utils.segments import Segments
 
 
 class HLS:
@@ -227,56 +232,57 @@ class HLS:
             log.error("Track's HLS playlist has no segments, expecting an invariant M3U8 playlist.")
             sys.exit(1)
 
+        licensing: Optional[Future] = None
         if track.drm:
             # TODO: What if we don't want to use the first DRM system?
             session_drm = track.drm[0]
             if isinstance(session_drm, Widevine):
-                # license and grab content keys
-                try:
+                def license_drm() -> None:
+                    """License and grab content keys."""
                     if not license_widevine:
                         raise ValueError("license_widevine func must be supplied to use Widevine DRM")
-                    progress(downloaded="LICENSING")
                     license_widevine(session_drm)
-                    progress(downloaded="[yellow]LICENSED")
-                except Exception:  # noqa
-                    DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                    progress(downloaded="[red]FAILED")
-                    raise
+
+                # the keys are only needed to decrypt, so the segments download meanwhile
+                licensing = license_in_background(license_drm)
+                if DOWNLOAD_LICENCE_ONLY.is_set():
+                    wait_for_license(licensing, progress)
         else:
             session_drm = None
 
-        unwanted_segments = [
-            segment for segment in master.segments
-            if callable(track.OnSegmentFilter) and track.OnSegmentFilter(segment)
+        # whether each segment is wanted, by index, as comparing segments is expensive
+        wanted = [
+            not (callable(track.OnSegmentFilter) and track.OnSegmentFilter(segment))
+            for segment in master.segments
         ]
 
-        total_segments = len(master.segments) - len(unwanted_segments)
+        total_segments = sum(wanted)
         progress(total=total_segments)
 
         downloader = track.downloader
         if (
             downloader.__name__ == "aria2c" and
-            any(x.byterange for x in master.segments if x not in unwanted_segments)
+            any(x.byterange for x, is_wanted in zip(master.segments, wanted) if is_wanted)
         ):
             downloader = requests_downloader
             log.warning("Falling back to the requests downloader as aria2(c) doesn't support the Range header")
 
         urls: list[dict[str, Any]] = []
-        segment_durations: list[int] = []
+        segment_info = Segments(timescale=1000)
 
         range_offset = 0
-        for segment in master.segments:
-            if segment in unwanted_segments:
+        for segment, is_wanted in zip(master.segments, wanted):
+            if not is_wanted:
                 continue
 
-            segment_durations.append(int(segment.duration))
-
             if segment.byterange:
                 byte_range = HLS.calculate_byte_range(segment.byterange, range_offset)
                 range_offset = byte_range.split("-")[0]
             else:
                 byte_range = None
 
+            segment_info.append(round(segment.duration * 1000), byte_range=byte_range)
+
             urls.append({
                 "url": urljoin(segment.base_uri, segment.uri),
                 "headers": {
@@ -284,32 +290,69 @@ class HLS:
                 } if byte_range else {}
             })
 
-        track.data["hls"]["segment_durations"] = segment_durations
+        track.data["hls"]["segments"] = segment_info
 
         segment_save_dir = save_dir / "segments"
+        segment_filename = "{i:0%d}{ext}" % len(str(len(urls)))
+        segment_files = [
+            segment_save_dir / segment_filename.format(i=i, ext=get_extension(url["url"]))
+            for i, url in enumerate(urls)
+        ]
 
-        for status_update in downloader(
-            urls=urls,
-            output_dir=segment_save_dir,
-            filename="{i:0%d}{ext}" % len(str(len(urls))),
-            headers=session.headers,
-            cookies=session.cookies,
-            proxy=proxy,
-            max_workers=max_workers
-        ):
-            file_downloaded = status_update.get("file_downloaded")
-            if file_downloaded:
-                events.emit(events.Types.SEGMENT_DOWNLOADED, track=track, segment=file_downloaded)
-            else:
-                downloaded = status_update.get("downloaded")
-                if downloaded and downloaded.endswith("/s"):
-                    status_update["downloaded"] = f"HLS {downloaded}"
-                progress(**status_update)
+        # segments that finished downloading are kept if the download is interrupted, as
+        # the downloaders skip existing files the next download only gets what's missing
+        track_control_file = ControlFile(save_path)
+        track_state = dict(
+            segments=len(urls),
+            key=get_segments_key((url["url"], url.get("headers", {}).get("Range")) for url in urls)
+        )
+        if track_control_file.load() != track_state and save_dir.exists():
+            shutil.rmtree(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        track_control_file.save(track_state)
+
+        downloader_args = {}
+        if downloader.__name__ != "aria2c":
+            # aria2c runs its own process, it is not limited by the download scheduler
+            downloader_args["priority"] = scheduler.get_priority(track.__class__.__name__)
+
+        try:
+            for status_update in downloader(
+                urls=urls,
+                output_dir=segment_save_dir,
+                filename=segment_filename,
+                headers=session.headers,
+                cookies=session.cookies,
+                proxy=proxy,
+                max_workers=max_workers,
+                **downloader_args
+            ):
+                file_downloaded = status_update.get("file_downloaded")
+                if file_downloaded:
+                    events.emit(events.Types.SEGMENT_DOWNLOADED, track=track, segment=file_downloaded)
+                else:
+                    downloaded = status_update.get("downloaded")
+                    if downloaded and downloaded.endswith("/s"):
+                        status_update["downloaded"] = f"HLS {downloaded}"
+                    progress(**status_update)
+        except BaseException:
+            error = licensing.exception() if licensing and licensing.done() and not licensing.cancelled() else None
+            if error:
+                # the download was cancelled as licensing failed
+                progress(downloaded="[red]FAILED")
+                raise error
+            raise
 
         # see https://github.com/devine-dl/devine/issues/71
         for control_file in segment_save_dir.glob("*.aria2__temp"):
             control_file.unlink()
 
+        if licensing:
+            wait_for_license(licensing, progress)
+
+        # merging and decrypting can't be resumed, start over if it gets interrupted
+        track_control_file.delete()
+
         progress(total=total_segments, completed=0, downloaded="Merging")
 
         name_len = len(str(total_segments))
@@ -321,219 +364,242 @@ class HLS:
         else:
             encryption_data: Optional[tuple[Optional[m3u8.Key], DRM_T]] = None
 
-        i = -1
-        for real_i, segment in enumerate(master.segments):
-            if segment not in unwanted_segments:
-                i += 1
-
-            is_last_segment = (real_i + 1) == len(master.segments)
-
-            def merge(to: Path, via: list[Path], delete: bool = False, include_map_data: bool = False):
-                """
-                Merge all files to a given path, optionally including map data.
-
-                Parameters:
-                    to: The output file with all merged data.
-                    via: List of files to merge, in sequence.
-                    delete: Delete the file once it's been merged.
-                    include_map_data: Whether to include the init map data.
-                """
-                with open(to, "wb") as x:
-                    if include_map_data and map_data and map_data[1]:
-                        x.write(map_data[1])
-                    for file in via:
-                        x.write(file.read_bytes())
-                        x.flush()
-                        if delete:
-                            file.unlink()
+        # the files are tracked as they're merged instead of scanning the segment folder,
+        # so the cost of each key change or discontinuity doesn't grow with the playlist
+        encrypted_files: list[Path] = []  # segments of the current key, yet to be decrypted
+        discontinuity_files: list[Path] = []  # ready to be merged into the current discontinuity
+        merged_files: list[Path] = []  # one per discontinuity, to be merged into the track
+
+        # the segments of each key are decrypted at once, on one pool for the whole track,
+        # its threads are only started once there's something to decrypt
+        decrypt_pool = ThreadPoolExecutor()
+
+        # MPEG-TS discontinuities are streamed into FFmpeg as they're merged, rather than
+        # each merged to a file first, fMP4 ones each have their own init data so they're
+        # still merged to files and concatenated with merge_segments()
+        wanted_segments = [segment for segment, is_wanted in zip(master.segments, wanted) if is_wanted]
+        concat_stream: Optional[subprocess.Popen] = None
+        if (
+            isinstance(track, (Video, Audio)) and
+            binaries.FFMPEG and
+            not DOWNLOAD_LICENCE_ONLY.is_set() and
+            any(segment.discontinuity for segment in wanted_segments[1:]) and
+            not any(segment.init_section for segment in wanted_segments)
+        ):
+            concat_stream = HLS.concat_stream(save_path)
+
+        try:
+            i = -1
+            for real_i, (segment, is_wanted) in enumerate(zip(master.segments, wanted)):
+                if is_wanted:
+                    i += 1
+
+                is_last_segment = (real_i + 1) == len(master.segments)
+
+                def merge(to: Path, via: list[Path], delete: bool = False, include_map_data: bool = False):
+                    """
+                    Merge all files to a given path, optionally including map data.
+
+                    Parameters:
+                        to: The output file with all merged data.
+                        via: List of files to merge, in sequence.
+                        delete: Delete the file once it's been merged.
+                        include_map_data: Whether to include the init map data.
+                    """
+                    with open(to, "wb") as x:
+                        if include_map_data and map_data and map_data[1]:
+                            x.write(map_data[1])
+                        for file in via:
+                            append_file(file, x)
+                            if delete:
+                                file.unlink()
+
+                def decrypt() -> Path:
+                    """
+                    Decrypt all segments that uses the currently set DRM.
+
+                    All segments that will be decrypted with this DRM will be merged together
+                    in sequence, prefixed with the init data (if any), and then deleted. Once
+                    merged they will be decrypted. The merged and decrypted file names state
+                    the range of segments that were used.
+
+                    The segments are those downloaded since the DRM was set, which includes
+                    the current segment only if it has already been added.
+
+                    Returns the decrypted path.
+                    """
+                    drm = encryption_data[1]
+                    files = encrypted_files.copy()
+                    encrypted_files.clear()
+                    if not files:
+                        raise ValueError("There are no segment files to decrypt...")
+
+                    segment_range = f"{files[0].stem}-{files[-1].stem}"
+                    missing = [file for file in files if not file.exists()]
+                    if missing:
+                        raise ValueError(f"Missing {len(missing)} segment files for {segment_range}...")
+
+                    merged_path = segment_save_dir / f"{segment_range}{files[-1].suffix}"
+                    decrypted_path = segment_save_dir / f"{merged_path.stem}_decrypted{merged_path.suffix}"
 
-            def decrypt(include_this_segment: bool) -> Path:
-                """
-                Decrypt all segments that uses the currently set DRM.
-
-                All segments that will be decrypted with this DRM will be merged together
-                in sequence, prefixed with the init data (if any), and then deleted. Once
-                merged they will be decrypted. The merged and decrypted file names state
-                the range of segments that were used.
-
-                Parameters:
-                    include_this_segment: Whether to include the current segment in the
-                        list of segments to merge and decrypt. This should be False if
-                        decrypting on EXT-X-KEY changes, or True when decrypting on the
-                        last segment.
-
-                Returns the decrypted path.
-                """
-                drm = encryption_data[1]
-                first_segment_i = next(
-                    int(file.stem)
-                    for file in sorted(segment_save_dir.iterdir())
-                    if file.stem.isdigit()
-                )
-                last_segment_i = max(0, i - int(not include_this_segment))
-                range_len = (last_segment_i - first_segment_i) + 1
-
-                segment_range = f"{str(first_segment_i).zfill(name_len)}-{str(last_segment_i).zfill(name_len)}"
-                merged_path = segment_save_dir / f"{segment_range}{get_extension(master.segments[last_segment_i].uri)}"
-                decrypted_path = segment_save_dir / f"{merged_path.stem}_decrypted{merged_path.suffix}"
-
-                files = [
-                    file
-                    for file in sorted(segment_save_dir.iterdir())
-                    if file.stem.isdigit() and first_segment_i <= int(file.stem) <= last_segment_i
-                ]
-                if not files:
-                    raise ValueError(f"None of the segment files for {segment_range} exist...")
-                elif len(files) != range_len:
-                    raise ValueError(f"Missing {range_len - len(files)} segment files for {segment_range}...")
-
-                if isinstance(drm, Widevine):
-                    # with widevine we can merge all segments and decrypt once
-                    merge(
-                        to=merged_path,
-                        via=files,
-                        delete=True,
-                        include_map_data=True
-                    )
-                    drm.decrypt(merged_path)
-                    merged_path.rename(decrypted_path)
-                else:
-                    # with other drm we must decrypt separately and then merge them
-                    # for aes this is because each segment likely has 16-byte padding
-                    for file in files:
-                        drm.decrypt(file)
-                    merge(
-                        to=merged_path,
-                        via=files,
-                        delete=True,
-                        include_map_data=True
-                    )
+                    if isinstance(drm, Widevine):
+                        # with widevine we can merge all segments and decrypt once
+                        merge(
+                            to=merged_path,
+                            via=files,
+                            delete=True,
+                            include_map_data=True
+                        )
+                        drm.decrypt(merged_path)
+                        merged_path.rename(decrypted_path)
+                    else:
+                        # with other drm we must decrypt separately and then merge them
+                        # for aes this is because each segment likely has 16-byte padding
+                        # the segments are decrypted at once, cryptodome releases the GIL
+                        for _ in decrypt_pool.map(drm.decrypt, files):
+                            pass
+                        merge(
+                            to=decrypted_path,
+                            via=files,
+                            delete=True,
+                            include_map_data=True
+                        )
 
-                events.emit(
-                    events.Types.TRACK_DECRYPTED,
-                    track=track,
-                    drm=drm,
-                    segment=decrypted_path
-                )
+                    discontinuity_files.append(decrypted_path)
 
-                return decrypted_path
-
-            def merge_discontinuity(include_this_segment: bool, include_map_data: bool = True):
-                """
-                Merge all segments of the discontinuity.
-
-                All segment files for this discontinuity must already be downloaded and
-                already decrypted (if it needs to be decrypted).
-
-                Parameters:
-                    include_this_segment: Whether to include the current segment in the
-                        list of segments to merge and decrypt. This should be False if
-                        decrypting on EXT-X-KEY changes, or True when decrypting on the
-                        last segment.
-                    include_map_data: Whether to prepend the init map data before the
-                        segment files when merging.
-                """
-                last_segment_i = max(0, i - int(not include_this_segment))
-
-                files = [
-                    file
-                    for file in sorted(segment_save_dir.iterdir())
-                    if int(file.stem.replace("_decrypted", "").split("-")[-1]) <= last_segment_i
-                ]
-                if files:
-                    to_dir = segment_save_dir.parent
-                    to_path = to_dir / f"{str(discon_i).zfill(name_len)}{files[-1].suffix}"
-                    merge(
-                        to=to_path,
-                        via=files,
-                        delete=True,
-                        include_map_data=include_map_data
+                    events.emit(
+                        events.Types.TRACK_DECRYPTED,
+                        track=track,
+                        drm=drm,
+                        segment=decrypted_path
                     )
 
-            if segment not in unwanted_segments:
-                if isinstance(track, Subtitle):
-                    segment_file_ext = get_extension(segment.uri)
-                    segment_file_path = segment_save_dir / f"{str(i).zfill(name_len)}{segment_file_ext}"
-                    segment_data = try_ensure_utf8(segment_file_path.read_bytes())
-                    if track.codec not in (Subtitle.Codec.fVTT, Subtitle.Codec.fTTML):
-                        segment_data = segment_data.decode("utf8"). \
-                            replace("&lrm;", html.unescape("&lrm;")). \
-                            replace("&rlm;", html.unescape("&rlm;")). \
-                            encode("utf8")
-                    segment_file_path.write_bytes(segment_data)
-
-                if segment.discontinuity and i != 0:
-                    if encryption_data:
-                        decrypt(include_this_segment=False)
-                    merge_discontinuity(
-                        include_this_segment=False,
-                        include_map_data=not encryption_data or not encryption_data[1]
-                    )
+                    return decrypted_path
 
-                    discon_i += 1
-                    range_offset = 0  # TODO: Should this be reset or not?
-                    map_data = None
-                    if encryption_data:
-                        encryption_data = (encryption_data[0], encryption_data[1])
+                def merge_discontinuity(include_map_data: bool = True):
+                    """
+                    Merge all segments of the discontinuity.
+
+                    All segment files for this discontinuity must already be downloaded and
+                    already decrypted (if it needs to be decrypted).
 
-                if segment.init_section and (not map_data or segment.init_section != map_data[0]):
-                    if segment.init_section.byterange:
-                        init_byte_range = HLS.calculate_byte_range(
-                            segment.init_section.byterange,
-                            range_offset
+                    Parameters:
+                        include_map_data: Whether to prepend the init map data before the
+                            segment files when merging.
+                    """
+                    if discontinuity_files and concat_stream:
+                        for file in discontinuity_files:
+                            append_file(file, concat_stream.stdin)
+                            file.unlink()
+                        discontinuity_files.clear()
+                    elif discontinuity_files:
+                        to_dir = segment_save_dir.parent
+                        to_path = to_dir / f"{str(discon_i).zfill(name_len)}{discontinuity_files[-1].suffix}"
+                        merge(
+                            to=to_path,
+                            via=discontinuity_files,
+                            delete=True,
+                            include_map_data=include_map_data
+                        )
+                        discontinuity_files.clear()
+                        merged_files.append(to_path)
+
+                if is_wanted:
+                    if isinstance(track, Subtitle):
+                        segment_file_path = segment_files[i]
+                        segment_data = try_ensure_utf8(segment_file_path.read_bytes())
+                        if track.codec not in (Subtitle.Codec.fVTT, Subtitle.Codec.fTTML):
+                            segment_data = segment_data.decode("utf8"). \
+                                replace("&lrm;", html.unescape("&lrm;")). \
+                                replace("&rlm;", html.unescape("&rlm;")). \
+                                encode("utf8")
+                        segment_file_path.write_bytes(segment_data)
+
+                    if segment.discontinuity and i != 0:
+                        if encryption_data and encrypted_files:
+                            decrypt()
+                        merge_discontinuity(
+                            include_map_data=not encryption_data or not encryption_data[1]
+                        )
+
+                        discon_i += 1
+                        range_offset = 0  # TODO: Should this be reset or not?
+                        map_data = None
+                        if encryption_data:
+                            encryption_data = (encryption_data[0], encryption_data[1])
+
+                    if segment.init_section and (not map_data or segment.init_section != map_data[0]):
+                        if segment.init_section.byterange:
+                            init_byte_range = HLS.calculate_byte_range(
+                                segment.init_section.byterange,
+                                range_offset
+                            )
+                            range_offset = init_byte_range.split("-")[0]
+                            init_range_header = {
+                                "Range": f"bytes={init_byte_range}"
+                            }
+                        else:
+                            init_range_header = {}
+
+                        res = session.get(
+                            url=urljoin(segment.init_section.base_uri, segment.init_section.uri),
+                            headers=init_range_header
                         )
-                        range_offset = init_byte_range.split("-")[0]
-                        init_range_header = {
-                            "Range": f"bytes={init_byte_range}"
-                        }
+                        res.raise_for_status()
+                        map_data = (segment.init_section, res.content)
+
+                if segment.keys:
+                    key = HLS.get_supported_key(segment.keys)
+                    if encryption_data and encryption_data[0] != key and encrypted_files:
+                        # the segments so far must be decrypted with the key they were encrypted with
+                        decrypt()
+
+                    if key is None:
+                        encryption_data = None
+                    elif not encryption_data or encryption_data[0] != key:
+                        drm = HLS.get_drm(key, session)
+                        if isinstance(drm, Widevine):
+                            try:
+                                if map_data:
+                                    track_kid = track.get_key_id(map_data[1])
+                                else:
+                                    track_kid = None
+                                progress(downloaded="LICENSING")
+                                license_widevine(drm, track_kid=track_kid)
+                                progress(downloaded="[yellow]LICENSED")
+                            except Exception:  # noqa
+                                DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+                                progress(downloaded="[red]FAILED")
+                                raise
+                        encryption_data = (key, drm)
+
+                if is_wanted:
+                    if encryption_data:
+                        encrypted_files.append(segment_files[i])
                     else:
-                        init_range_header = {}
+                        discontinuity_files.append(segment_files[i])
 
-                    res = session.get(
-                        url=urljoin(segment.init_section.base_uri, segment.init_section.uri),
-                        headers=init_range_header
-                    )
-                    res.raise_for_status()
-                    map_data = (segment.init_section, res.content)
-
-            if segment.keys:
-                key = HLS.get_supported_key(segment.keys)
-                if encryption_data and encryption_data[0] != key and i != 0 and segment not in unwanted_segments:
-                    decrypt(include_this_segment=False)
-
-                if key is None:
-                    encryption_data = None
-                elif not encryption_data or encryption_data[0] != key:
-                    drm = HLS.get_drm(key, session)
-                    if isinstance(drm, Widevine):
-                        try:
-                            if map_data:
-                                track_kid = track.get_key_id(map_data[1])
-                            else:
-                                track_kid = None
-                            progress(downloaded="LICENSING")
-                            license_widevine(drm, track_kid=track_kid)
-                            progress(downloaded="[yellow]LICENSED")
-                        except Exception:  # noqa
-                            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
-                            progress(downloaded="[red]FAILED")
-                            raise
-                    encryption_data = (key, drm)
-
-            # TODO: This wont work as we already downloaded
-            if DOWNLOAD_LICENCE_ONLY.is_set():
-                continue
+                # TODO: This wont work as we already downloaded
+                if DOWNLOAD_LICENCE_ONLY.is_set():
+                    continue
 
-            if is_last_segment:
-                # required as it won't end with EXT-X-DISCONTINUITY nor a new key
-                if encryption_data:
-                    decrypt(include_this_segment=True)
-                merge_discontinuity(
-                    include_this_segment=True,
-                    include_map_data=not encryption_data or not encryption_data[1]
-                )
+                if is_last_segment:
+                    # required as it won't end with EXT-X-DISCONTINUITY nor a new key
+                    if encryption_data and encrypted_files:
+                        decrypt()
+                    merge_discontinuity(
+                        include_map_data=not encryption_data or not encryption_data[1]
+                    )
 
-            progress(advance=1)
+                progress(advance=1)
+        except BaseException:
+            if concat_stream:
+                concat_stream.kill()
+                concat_stream.wait()
+                save_path.unlink(missing_ok=True)
+            raise
+        finally:
+            decrypt_pool.shutdown(cancel_futures=True)
 
         # TODO: Again still wont work, we've already downloaded
         if DOWNLOAD_LICENCE_ONLY.is_set():
@@ -542,26 +608,25 @@ class HLS:
         segment_save_dir.rmdir()
 
         # finally merge all the discontinuity save files together to the final path
-        segments_to_merge = [
-            x
-            for x in sorted(save_dir.iterdir())
-            if x.is_file()
-        ]
-        if len(segments_to_merge) == 1:
-            shutil.move(segments_to_merge[0], save_path)
+        if concat_stream:
+            progress(downloaded="Merging")
+            concat_stream.stdin.close()
+            if concat_stream.wait():
+                save_path.unlink(missing_ok=True)
+                raise subprocess.CalledProcessError(concat_stream.returncode, concat_stream.args)
+        elif len(merged_files) == 1:
+            shutil.move(merged_files[0], save_path)
         else:
             progress(downloaded="Merging")
             if isinstance(track, (Video, Audio)):
                 HLS.merge_segments(
-                    segments=segments_to_merge,
+                    segments=merged_files,
                     save_path=save_path
                 )
             else:
                 with open(save_path, "wb") as f:
-                    for discontinuity_file in segments_to_merge:
-                        discontinuity_data = discontinuity_file.read_bytes()
-                        f.write(discontinuity_data)
-                        f.flush()
+                    for discontinuity_file in merged_files:
+                        append_file(discontinuity_file, f)
                         discontinuity_file.unlink()
 
         save_dir.rmdir()
@@ -571,6 +636,33 @@ class HLS:
         track.path = save_path
         events.emit(events.Types.TRACK_DOWNLOADED, track=track)
 
+    @staticmethod
+    def concat_stream(save_path: Path) -> subprocess.Popen:
+        """
+        Start FFmpeg remuxing MPEG-TS data written to its stdin, to a path.
+
+        MPEG-TS can be joined byte for byte, so each discontinuity can be written to it
+        as it's merged, with no file of its own. Where the timestamps jump by more than
+        200ms at a discontinuity, FFmpeg continues them on from the last, the same as
+        the concat demuxer of merge_segments() does.
+
+        Close stdin once everything has been written, then wait for it to finish.
+        """
+        if not binaries.FFMPEG:
+            raise EnvironmentError("FFmpeg executable was not found but is required to merge HLS segments.")
+
+        return subprocess.Popen([
+            binaries.FFMPEG, "-hide_banner",
+            "-loglevel", "panic",
+            "-dts_delta_threshold", "0.2",
+            "-f", "mpegts",
+            "-i", "pipe:0",
+            "-map", "0",
+            "-c", "copy",
+            "-y",
+            save_path
+        ], stdin=subprocess.PIPE)
+
     @staticmethod
     def merge_segments(segments: list[Path], save_path: Path) -> int:
         """
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator, NamedTuple
+from urllib.parse import urlparse
+
+from devine.core.config import config
+from devine.core.constants import DOWNLOAD_CANCELLED
+
+
+class Scheduler:
+    """
+    Process-wide scheduler of download connections.
+
+    Every file or segment downloaded by the requests, curl_impersonate and curl_async
+    downloaders, across all tracks being downloaded, must hold a slot from this
+    scheduler while it downloads. There is a limit to how many slots can be held at
+    once in total, and for each host, so running multiple track downloads at once does
+    not multiply the amount of connections made to a CDN.
+
+    A freed slot is given to the waiting download with the highest priority, e.g.,
+    video before audio. Between downloads of equal priority it's given to the one
+    whose owner (usually a track) holds the fewest slots, so a track may use any idle
+    capacity without starving the other tracks.
+    """
+
+    class Ticket(NamedTuple):
+        priority: int
+        order: int
+        host: str
+        owner: Any
+        grant: Callable[[], Any]
+
+    def __init__(self, max_connections: int = 64, max_host_connections: int = 32):
+        if max_connections < 1:
+            raise ValueError(f"The max connections must be at least 1, not {max_connections}")
+        if max_host_connections < 1:
+            raise ValueError(f"The max connections per host must be at least 1, not {max_host_connections}")
+
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+
+        self.__lock = threading.Lock()
+        self.__order = itertools.count()
+        self.__waiting: list[Scheduler.Ticket] = []
+        self.__active = 0
+        self.__host_active: Counter[str] = Counter()
+        self.__owner_active: Counter[Any] = Counter()
+
+    @contextmanager
+    def slot(self, url: str, owner: Any = None, priority: int = 0) -> Iterator[None]:
+        """
+        Hold a download slot for a URL's host while within the context.
+
+        Blocks until a slot is given to this download. Raises KeyboardInterrupt if
+        downloads are cancelled while waiting.
+
+        Parameters:
+            url: The URL that will be downloaded, only its host is used.
+            owner: Any hashable object to share slots fairly with, e.g., one per track.
+            priority: Downloads with a higher priority are given a slot first.
+        """
+        granted = threading.Event()
+        ticket = self.__queue(url, owner, priority, granted.set)
+
+        while not granted.wait(timeout=1):
+            if DOWNLOAD_CANCELLED.is_set() and self.__unqueue(ticket):
+                raise KeyboardInterrupt()
+
+        try:
+            yield
+        finally:
+            self.__release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, url: str, owner: Any = None, priority: int = 0) -> AsyncIterator[None]:
+        """
+        Hold a download slot for a URL's host while within the context, with asyncio.
+
+        Waits until a slot is given to this download, without blocking the event loop.
+        Raises asyncio.CancelledError if downloads are cancelled while waiting.
+
+        See slot() for the parameters.
+        """
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        # slots may be given from any thread, but asyncio events are not thread-safe
+        ticket = self.__queue(url, owner, priority, lambda: loop.call_soon_threadsafe(granted.set))
+
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(granted.wait(), timeout=1)
+                    break
+                except asyncio.TimeoutError:
+                    if DOWNLOAD_CANCELLED.is_set() and self.__unqueue(ticket):
+                        raise asyncio.CancelledError()
+        except asyncio.CancelledError:
+            if not self.__unqueue(ticket):
+                # it was given a slot just before it was cancelled
+                self.__release(ticket)
+            raise
+
+        try:
+            yield
+        finally:
+            self.__release(ticket)
+
+    def __queue(self, url: str, owner: Any, priority: int, grant: Callable[[], Any]) -> Scheduler.Ticket:
+        """Queue a download for a slot, `grant` is called once it has been given one."""
+        ticket = Scheduler.Ticket(
+            priority=priority,
+            order=next(self.__order),
+            host=urlparse(url).netloc,
+            owner=owner,
+            grant=grant
+        )
+        with self.__lock:
+            self.__waiting.append(ticket)
+            self.__dispatch()
+        return ticket
+
+    def __unqueue(self, ticket: Scheduler.Ticket) -> bool:
+        """Stop waiting for a slot. Returns False if it was already given one."""
+        with self.__lock:
+            if ticket not in self.__waiting:
+                return False
+            self.__waiting.remove(ticket)
+            return True
+
+    def __release(self, ticket: Scheduler.Ticket) -> None:
+        """Free the slot given to a download and give it to the next waiting download."""
+        with self.__lock:
+            self.__active -= 1
+            self.__host_active[ticket.host] -= 1
+            self.__owner_active[ticket.owner] -= 1
+            if not self.__owner_active[ticket.owner]:
+                del self.__owner_active[ticket.owner]
+            self.__dispatch()
+
+    def __dispatch(self) -> None:
+        """Give free slots to the waiting downloads that should go first. Must hold the lock."""
+        while self.__waiting and self.__active < self.max_connections:
+            candidates = [
+                ticket
+                for ticket in self.__waiting
+                if self.__host_active[ticket.host] < self.max_host_connections
+            ]
+            if not candidates:
+                break
+
+            ticket = min(candidates, key=lambda x: (-x.priority, self.__owner_active[x.owner], x.order))
+            self.__waiting.remove(ticket)
+
+            self.__active += 1
+            self.__host_active[ticket.host] += 1
+            self.__owner_active[ticket.owner] += 1
+            ticket.grant()
+
+    @staticmethod
+    def get_priority(track_type: str) -> int:
+        """Get the download priority of a type of track, e.g., "Video", per the config."""
+        order = config.scheduler.get("priority") or ["Video", "Audio", "Subtitle"]
+        if track_type not in order:
+            return 0
+        return len(order) - order.index(track_type)
+
+
+scheduler = Scheduler(
+    max_connections=config.scheduler.get("max_connections") or 64,
+    max_host_connections=config.scheduler.get("max_host_connections") or 32
+)
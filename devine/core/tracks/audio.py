@@ -124,6 +124,8 @@ class Audio(Track):
         self.joc = joc
         self.descriptive = bool(descriptive)
 
+        self.id = self.id  # fix the ID to the values given, see Track.id
+
     def __str__(self) -> str:
         return " | ".join(filter(bool, [
             "AUD",
@@ -138,6 +140,11 @@ class Audio(Track):
             self.edition
         ]))
 
+    def get_identity_key(self) -> tuple[Any, ...]:
+        return super().get_identity_key() + (
+            self.codec, self.bitrate, self.channels, self.joc, self.descriptive
+        )
+
     @staticmethod
     def parse_channels(channels: Union[str, int, float]) -> float:
         """
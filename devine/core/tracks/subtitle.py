@@ -170,6 +170,8 @@ class Subtitle(Track):
         # Called after Track has been converted to another format
         self.OnConverted: Optional[Callable[[Subtitle.Codec], None]] = None
 
+        self.id = self.id  # fix the ID to the values given, see Track.id
+
     def __str__(self) -> str:
         return " | ".join(filter(bool, [
             "SUB",
@@ -178,6 +180,9 @@ class Subtitle(Track):
             self.get_track_name()
         ]))
 
+    def get_identity_key(self) -> tuple[Any, ...]:
+        return super().get_identity_key() + (self.codec, self.cc, self.sdh, self.forced)
+
     def get_track_name(self) -> Optional[str]:
         """Return the base Track Name."""
         track_name = super().get_track_name() or ""
@@ -206,19 +211,11 @@ class Subtitle(Track):
         elif self.codec == Subtitle.Codec.WebVTT:
             text = self.path.read_text("utf8")
             if self.descriptor == Track.Descriptor.DASH:
-                if len(self.data["dash"]["segment_durations"]) > 1:
-                    text = merge_segmented_webvtt(
-                        text,
-                        segment_durations=self.data["dash"]["segment_durations"],
-                        timescale=self.data["dash"]["timescale"]
-                    )
+                if len(self.data["dash"]["segments"]) > 1:
+                    text = merge_segmented_webvtt(text, segments=self.data["dash"]["segments"])
             elif self.descriptor == Track.Descriptor.HLS:
-                if len(self.data["hls"]["segment_durations"]) > 1:
-                    text = merge_segmented_webvtt(
-                        text,
-                        segment_durations=self.data["hls"]["segment_durations"],
-                        timescale=1  # ?
-                    )
+                if len(self.data["hls"]["segments"]) > 1:
+                    text = merge_segmented_webvtt(text, segments=self.data["hls"]["segments"])
             caption_set = pycaption.WebVTTReader().read(text)
             Subtitle.merge_same_cues(caption_set)
             subtitle_text = pycaption.WebVTTWriter().write(caption_set)
@@ -1,13 +1,11 @@
-import base64
 import html
 import logging
 import re
 import shutil
 import subprocess
 from collections import defaultdict
-from copy import copy
 from enum import Enum
-from functools import partial
+from functools import cached_property, partial
 from pathlib import Path
 from typing import Any, Callable, Iterable, Optional, Union
 from uuid import UUID
@@ -19,11 +17,14 @@ from requests import Session
 from devine.core import binaries
 from devine.core.config import config
 from devine.core.constants import DOWNLOAD_CANCELLED, DOWNLOAD_LICENCE_ONLY
-from devine.core.downloaders import aria2c, curl_impersonate, requests
+from devine.core.downloaders import aria2c, curl_async, curl_impersonate, requests
 from devine.core.drm import DRM_T, Widevine
 from devine.core.events import events
-from devine.core.utilities import get_boxes, try_ensure_utf8
-from devine.core.utils.subprocess import ffprobe
+from devine.core.scheduler import scheduler
+from devine.core.utilities import try_ensure_utf8
+from devine.core.utils.control_file import ControlFile
+from devine.core.utils.init_segment import InitSegment
+from devine.core.utils.language import get_script_and_territory_names
 
 
 class Track:
@@ -80,6 +81,7 @@ class Track:
         if downloader is None:
             downloader = {
                 "aria2c": aria2c,
+                "curl_async": curl_async,
                 "curl_impersonate": curl_impersonate,
                 "requests": requests
             }[config.downloader]
@@ -96,31 +98,14 @@ class Track:
         self.downloader = downloader
         self._data: defaultdict[Any, Any] = defaultdict(dict)
         self.data = data or {}
+        self._init_segments: dict[tuple[str, int, int], bytes] = {}  # by url and byte range
+        self._parsed_init_segments: dict[tuple[str, int, int], InitSegment] = {}  # by url and byte range
 
         if self.name is None:
-            lang = Language.get(self.language)
-            if (lang.language or "").lower() == (lang.territory or "").lower():
-                lang.territory = None  # e.g. en-en, de-DE
-            reduced = lang.simplify_script()
-            extra_parts = []
-            if reduced.script is not None:
-                script = reduced.script_name(max_distance=25)
-                if script and script != "Zzzz":
-                    extra_parts.append(script)
-            if reduced.territory is not None:
-                territory = reduced.territory_name(max_distance=25)
-                if territory and territory != "ZZ":
-                    territory = territory.removesuffix(" SAR China")
-                    extra_parts.append(territory)
-            self.name = ", ".join(extra_parts) or None
-
-        if not id_:
-            this = copy(self)
-            this.url = self.url.rsplit("?", maxsplit=1)[0]
-            checksum = crc32(repr(this).encode("utf8"))
-            id_ = hex(checksum)[2:]
-
-        self.id = id_
+            self.name = get_script_and_territory_names(str(self.language))
+
+        if id_:
+            self.id = id_  # otherwise, it's derived from the identity key once constructed
 
         # TODO: Currently using OnFoo event naming, change to just segment_filter
         self.OnSegmentFilter: Optional[Callable] = None
@@ -128,12 +113,41 @@ class Track:
     def __repr__(self) -> str:
         return "{name}({items})".format(
             name=self.__class__.__name__,
-            items=", ".join([f"{k}={repr(v)}" for k, v in self.__dict__.items()])
+            items=", ".join([
+                f"{k}={repr(v)}"
+                for k, v in self.__dict__.items()
+                if k not in ("_init_segments", "_parsed_init_segments")  # caches, and may be large
+            ])
         )
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, Track) and self.id == other.id
 
+    @cached_property
+    def id(self) -> str:
+        """
+        A unique ID for the track, that stays the same no matter when the same content is requested.
+
+        If one wasn't provided, it's a checksum of the identity key, see get_identity_key().
+        Subclasses derive it at the end of their constructor, so it's of the values the
+        track was made with, and it's kept from then on even if those values change.
+        """
+        return hex(crc32(repr(self.get_identity_key()).encode("utf8")))[2:]
+
+    def get_identity_key(self) -> tuple[Any, ...]:
+        """
+        Get the values that identify the track's content, without any query in the URL.
+
+        Only the values that make it unique are used, not the data dictionary or DRM,
+        which can be large and may have reprs that change from run to run. Subclasses
+        extend it with their own values like the codec, bitrate, or resolution.
+        """
+        if isinstance(self.url, str):
+            url = self.url.rsplit("?", maxsplit=1)[0]
+        else:
+            url = tuple(x.rsplit("?", maxsplit=1)[0] for x in self.url)
+        return self.__class__.__name__, url, str(self.language), self.descriptor.name, self.edition
+
     @property
     def data(self) -> defaultdict[Any, Any]:
         """
@@ -147,14 +161,15 @@ class Track:
         - "hls" used by the HLS class.
           - playlist: m3u8.model.Playlist - The primary track information.
           - media: m3u8.model.Media - The audio/subtitle track information.
-          - segment_durations: list[int] - A list of each segment's duration.
+          - segments: Segments - The timing and byte ranges of the track's segments.
         - "dash" used by the DASH class.
           - manifest: lxml.ElementTree - DASH MPD manifest.
           - period: lxml.Element - The period of this track.
           - adaptation_set: lxml.Element - The adaptation set of this track.
           - representation: lxml.Element - The representation of this track.
-          - timescale: int - The timescale of the track's segments.
-          - segment_durations: list[int] - A list of each segment's duration.
+          - representation_info: DASH.RepresentationInfo - What's needed to download
+            the track. Once it's selected, only this is kept and the above are removed.
+          - segments: Segments - The timing and byte ranges of the track's segments.
 
         You should not add, change, or remove any data within reserved keys.
         You may use their data but do note that the values of them may change
@@ -209,6 +224,15 @@ class Track:
             save_path.with_suffix(f"{save_path.suffix}.aria2__temp").unlink(missing_ok=True)
             if save_dir.exists() and save_dir.name.endswith("_segments"):
                 shutil.rmtree(save_dir)
+            # devine control file (e.g., "foo.mp4.!dev")
+            ControlFile(save_path).delete()
+
+        def can_resume() -> bool:
+            # control files are only kept by interrupted downloads that can be resumed
+            return (
+                ControlFile(save_path).exists() or
+                save_path.with_suffix(f"{save_path.suffix}.aria2").exists()
+            )
 
         if not DOWNLOAD_LICENCE_ONLY.is_set():
             if config.directories.temp.is_file():
@@ -216,11 +240,11 @@ class Track:
 
             config.directories.temp.mkdir(parents=True, exist_ok=True)
 
-            # Delete any pre-existing temp files matching this track.
-            # We can't re-use or continue downloading these tracks as they do not use a
-            # lock file. Or at least the majority don't. Even if they did I've encountered
-            # corruptions caused by sudden interruptions to the lock file.
-            cleanup()
+            # Delete any pre-existing temp files matching this track, unless a previous
+            # download of it was interrupted and left a control file to resume from.
+            # Without a control file we can't know if the files are complete.
+            if not can_resume():
+                cleanup()
 
         try:
             if self.descriptor == self.Descriptor.HLS:
@@ -272,6 +296,11 @@ class Track:
                     if DOWNLOAD_LICENCE_ONLY.is_set():
                         progress(downloaded="[yellow]SKIPPED")
                     else:
+                        downloader_args = {}
+                        if self.downloader.__name__ != "aria2c":
+                            # aria2c runs its own process, it is not limited by the download scheduler
+                            downloader_args["priority"] = scheduler.get_priority(track_type)
+
                         for status_update in self.downloader(
                             urls=self.url,
                             output_dir=save_path.parent,
@@ -279,7 +308,8 @@ class Track:
                             headers=session.headers,
                             cookies=session.cookies,
                             proxy=proxy,
-                            max_workers=max_workers
+                            max_workers=max_workers,
+                            **downloader_args
                         ):
                             file_downloaded = status_update.get("file_downloaded")
                             if not file_downloaded:
@@ -322,7 +352,7 @@ class Track:
                     progress(downloaded="[red]FAILED")
                     raise
         except (Exception, KeyboardInterrupt):
-            if not DOWNLOAD_LICENCE_ONLY.is_set():
+            if not DOWNLOAD_LICENCE_ONLY.is_set() and not can_resume():
                 cleanup()
             raise
 
@@ -376,47 +406,83 @@ class Track:
         """Get the Track Name."""
         return self.name
 
-    def get_key_id(self, init_data: Optional[bytes] = None, *args, **kwargs) -> Optional[UUID]:
+    def get_key_id(
+        self,
+        init_data: Optional[Union[bytes, InitSegment]] = None,
+        maximum_size: int = 20000,
+        url: Optional[str] = None,
+        byte_range: Optional[str] = None,
+        session: Optional[Session] = None
+    ) -> Optional[UUID]:
         """
         Probe the DRM encryption Key ID (KID) for this specific track.
 
-        It currently supports finding the Key ID by probing the track's stream
-        with ffprobe for `enc_key_id` data, as well as for mp4 `tenc` (Track
-        Encryption) boxes.
+        It currently supports finding the Key ID in WebM `ContentEncKeyID` data
+        (what ffprobe calls `enc_key_id`), as well as in mp4 `tenc` (Track
+        Encryption) boxes. ffprobe is only used for data that is neither.
 
         It explicitly ignores PSSH information like the `PSSH` box, as the box
         is likely to contain multiple Key IDs that may or may not be for this
         specific track.
 
-        To retrieve the initialization segment, this method calls :meth:`get_init_segment`
-        with the positional and keyword arguments. The return value of `get_init_segment`
-        is then used to determine the Key ID.
+        To retrieve the initialization segment, this method calls :meth:`parse_init_segment`
+        with the init data (if any) and the other arguments. An already parsed InitSegment
+        may be given instead.
 
         Returns:
             The Key ID as a UUID object, or None if the Key ID could not be determined.
         """
-        if not init_data:
-            init_data = self.get_init_segment(*args, **kwargs)
-        if not isinstance(init_data, bytes):
-            raise TypeError(f"Expected init_data to be bytes, not {init_data!r}")
+        if isinstance(init_data, InitSegment):
+            init_segment = init_data
+        else:
+            init_segment = self.parse_init_segment(init_data, maximum_size, url, byte_range, session)
 
-        probe = ffprobe(init_data)
-        if probe:
-            for stream in probe.get("streams") or []:
-                enc_key_id = stream.get("tags", {}).get("enc_key_id")
-                if enc_key_id:
-                    return UUID(bytes=base64.b64decode(enc_key_id))
+        if init_segment.enc_key_id:
+            return init_segment.enc_key_id
 
-        for tenc in get_boxes(init_data, b"tenc"):
-            if tenc.key_ID.int != 0:
-                return tenc.key_ID
+        for key_id in init_segment.tenc_key_ids:
+            if key_id.int != 0:
+                return key_id
 
-        for uuid_box in get_boxes(init_data, b"uuid"):
+        for uuid_box in init_segment.uuid_boxes:
             if uuid_box.extended_type == UUID("8974dbce-7be7-4c51-84f9-7148f9882554"):  # tenc
                 tenc = uuid_box.data
                 if tenc.key_ID.int != 0:
                     return tenc.key_ID
 
+    def parse_init_segment(
+        self,
+        init_data: Optional[bytes] = None,
+        maximum_size: int = 20000,
+        url: Optional[str] = None,
+        byte_range: Optional[str] = None,
+        session: Optional[Session] = None
+    ) -> InitSegment:
+        """
+        Get an init segment of the track, to find what's in it like the Key ID or PSSH.
+
+        The init segment is found by the other arguments, the same as :meth:`get_init_segment`.
+        The same InitSegment is returned for the same URL and byte range for as long as the
+        track is kept, so what's been found in it doesn't need to be found again, e.g., by
+        get_key_id() and then Widevine.from_init_data().
+
+        If the init data was already downloaded, pass it with the URL and byte range it's
+        from so it isn't requested again. Data given without them is parsed, but not kept,
+        as there's nothing to know it by.
+        """
+        if init_data is not None and not isinstance(init_data, bytes):
+            raise TypeError(f"Expected init_data to be bytes, not {init_data!r}")
+        if init_data and url is None and byte_range is None:
+            return InitSegment(init_data)
+
+        key = self._get_init_segment_key(maximum_size, url, byte_range)
+        init_segment = self._parsed_init_segments.get(key)
+        if not init_segment:
+            if not init_data:
+                init_data = self.get_init_segment(maximum_size, url, byte_range, session)
+            init_segment = self._parsed_init_segments[key] = InitSegment(init_data)
+        return init_segment
+
     def get_init_segment(
         self,
         maximum_size: int = 20000,
@@ -430,80 +496,92 @@ class Track:
         HLS and DASH tracks must explicitly provide a URL to the init segment or file.
         Providing the byte-range for the init segment is recommended where possible.
 
-        If `byte_range` is not set, it will make a HEAD request and check the size of
-        the file. If the size could not be determined, it will download up to the first
-        20KB only, which should contain the entirety of the init segment. You may
-        override this by changing the `maximum_size`.
+        If `byte_range` is not set, only the first 20KB is requested, which should contain
+        the entirety of the init segment. You may override this by changing the `maximum_size`.
+
+        It's a single ranged GET request. If the server doesn't support ranges and responds
+        with the whole file, only the requested range is read before the connection is closed.
+        The data is kept for each URL and range, so probing the same track again, e.g., for
+        the Key ID and then the PSSH, doesn't make another request.
 
         The default maximum_size of 20000 (20KB) is a tried-and-tested value that
         seems to work well across the board.
 
         Parameters:
-            maximum_size: Size to assume as the content length if byte-range is not
-                used, the content size could not be determined, or the content size
-                is larger than it. A value of 20000 (20KB) or higher is recommended.
+            maximum_size: Size to download from the start of the file if byte-range is
+                not used. A value of 20000 (20KB) or higher is recommended.
             url: Explicit init map or file URL to probe from.
             byte_range: Range of bytes to download from the explicit or implicit URL.
             session: Session context, e.g., authorization and headers.
         """
+        if not isinstance(session, (Session, type(None))):
+            raise TypeError(f"Expected session to be a {Session}, not {type(session)}")
+
+        url, start, end = self._get_init_segment_key(maximum_size, url, byte_range)
+
+        init_data = self._init_segments.get((url, start, end))
+        if init_data:
+            return init_data
+
+        if not session:
+            session = Session()
+
+        with session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True) as res:
+            res.raise_for_status()
+            # it's the whole file if the server doesn't support ranges, so skip to the start
+            skip = start if res.status_code != 206 else 0
+            size = end - start + 1
+            buffer = bytearray()
+            for chunk in res.iter_content(min(skip + size, 1024 * 1024)):
+                buffer += chunk
+                if len(buffer) >= skip + size:
+                    break
+            init_data = bytes(buffer[skip:skip + size])
+
+        if not init_data:
+            raise ValueError(f"Failed to read {size} bytes from the track URI.")
+
+        self._init_segments[(url, start, end)] = init_data
+
+        return init_data
+
+    def _get_init_segment_key(
+        self,
+        maximum_size: int = 20000,
+        url: Optional[str] = None,
+        byte_range: Optional[str] = None,
+        session: Optional[Session] = None
+    ) -> tuple[str, int, int]:
+        """
+        Get the URL and byte range of an init segment, as given to :meth:`get_init_segment`.
+
+        The session isn't used, it's only taken so the same arguments can be given.
+        """
         if not isinstance(maximum_size, int):
             raise TypeError(f"Expected maximum_size to be an {int}, not {type(maximum_size)}")
         if not isinstance(url, (str, type(None))):
             raise TypeError(f"Expected url to be a {str}, not {type(url)}")
         if not isinstance(byte_range, (str, type(None))):
             raise TypeError(f"Expected byte_range to be a {str}, not {type(byte_range)}")
-        if not isinstance(session, (Session, type(None))):
-            raise TypeError(f"Expected session to be a {Session}, not {type(session)}")
 
         if not url:
             if self.descriptor != self.Descriptor.URL:
                 raise ValueError(f"An explicit URL must be provided for {self.descriptor.name} tracks")
             if not self.url:
                 raise ValueError("An explicit URL must be provided as the track has no URL")
-            url = self.url
-
-        if not session:
-            session = Session()
-
-        content_length = maximum_size
+            # the init segment is at the start of the first file of a track split in many
+            url = self.url if isinstance(self.url, str) else self.url[0]
 
         if byte_range:
-            if not isinstance(byte_range, str):
-                raise TypeError(f"Expected byte_range to be a str, not {byte_range!r}")
             if not re.match(r"^\d+-\d+$", byte_range):
                 raise ValueError(f"The value of byte_range is unrecognized: '{byte_range}'")
-            start, end = byte_range.split("-")
+            start, end = map(int, byte_range.split("-"))
             if start > end:
                 raise ValueError(f"The start range cannot be greater than the end range: {start}>{end}")
         else:
-            size_test = session.head(url)
-            if "Content-Length" in size_test.headers:
-                content_length_header = int(size_test.headers["Content-Length"])
-                if content_length_header > 0:
-                    content_length = min(content_length_header, maximum_size)
-            range_test = session.head(url, headers={"Range": "bytes=0-1"})
-            if range_test.status_code == 206:
-                byte_range = f"0-{content_length-1}"
+            start, end = 0, maximum_size - 1
 
-        if byte_range:
-            res = session.get(
-                url=url,
-                headers={
-                    "Range": f"bytes={byte_range}"
-                }
-            )
-            res.raise_for_status()
-            init_data = res.content
-        else:
-            init_data = None
-            with session.get(url, stream=True) as s:
-                for chunk in s.iter_content(content_length):
-                    init_data = chunk
-                    break
-            if not init_data:
-                raise ValueError(f"Failed to read {content_length} bytes from the track URI.")
-
-        return init_data
+        return url, start, end
 
     def repackage(self) -> None:
         if not self.path or not self.path.exists():
@@ -6,7 +6,7 @@ from functools import partial
 from pathlib import Path
 from typing import Callable, Iterator, Optional, Sequence, Union
 
-from langcodes import Language, closest_supported_match
+from langcodes import Language
 from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn, TimeRemainingColumn
 from rich.table import Table
 from rich.tree import Tree
@@ -23,6 +23,7 @@ from devine.core.tracks.track import Track
 from devine.core.tracks.video import Video
 from devine.core.utilities import is_close_match, sanitize_filename
 from devine.core.utils.collections import as_list, flatten
+from devine.core.utils.language import closest_supported_match
 
 
 class Tracks:
@@ -312,7 +313,7 @@ class Tracks:
             selected.extend([
                 x
                 for x in tracks
-                if closest_supported_match(x.language, [language], LANGUAGE_MAX_DISTANCE)
+                if closest_supported_match(str(x.language), (str(language),), LANGUAGE_MAX_DISTANCE)
             ][:per_language or None])
         return selected
 
@@ -5,6 +5,7 @@ import math
 import re
 import subprocess
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Optional, Union
 
@@ -86,10 +87,14 @@ class Video(Track):
         DV = "DV"          # https://en.wikipedia.org/wiki/Dolby_Vision
 
         @staticmethod
+        @lru_cache(maxsize=64)
         def from_cicp(primaries: int, transfer: int, matrix: int) -> Video.Range:
             """
             ISO/IEC 23001-8 Coding-independent code points to Video Range.
 
+            Results are cached as the code point enums are rebuilt on every call,
+            and a manifest typically repeats the same few combinations many times.
+
             Sources:
             https://www.itu.int/rec/T-REC-H.Sup19-202104-I
             """
@@ -228,6 +233,8 @@ class Video(Track):
                 str(e)
             )
 
+        self.id = self.id  # fix the ID to the values given, see Track.id
+
     def __str__(self) -> str:
         return " | ".join(filter(bool, [
             "VID",
@@ -246,6 +253,11 @@ class Video(Track):
             self.edition
         ]))
 
+    def get_identity_key(self) -> tuple[Any, ...]:
+        return super().get_identity_key() + (
+            self.codec, self.range, self.bitrate, self.width, self.height, self.fps
+        )
+
     def change_color_range(self, range_: int) -> None:
         """Change the Video's Color Range to Limited (0) or Full (1)."""
         if not self.path or not self.path.exists():
@@ -1,28 +1,36 @@
 import ast
 import contextlib
+import errno
 import importlib.util
 import os
 import re
 import socket
 import sys
+import threading
 import time
 import unicodedata
 from collections import defaultdict
+from concurrent.futures import Future
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 from types import ModuleType
-from typing import Optional, Sequence, Union
+from typing import Any, BinaryIO, Callable, Optional, Sequence, Union
 from urllib.parse import ParseResult, urlparse
 
 import chardet
 import requests
 from construct import ValidationError
-from langcodes import Language, closest_match
+from langcodes import Language
 from pymp4.parser import Box
 from unidecode import unidecode
 
 from devine.core.config import config
-from devine.core.constants import LANGUAGE_MAX_DISTANCE
+from devine.core.constants import DOWNLOAD_CANCELLED, LANGUAGE_MAX_DISTANCE
+from devine.core.utils.language import closest_match
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+_copy_buffer = threading.local()
 
 
 def rotate_log_file(log_path: Path, keep: int = 20) -> Path:
@@ -113,7 +121,7 @@ def is_close_match(language: Union[str, Language], languages: Sequence[Union[str
     languages = [x for x in languages if x]
     if not languages:
         return False
-    return closest_match(language, list(map(str, languages)))[1] <= LANGUAGE_MAX_DISTANCE
+    return closest_match(str(language), tuple(map(str, languages)))[1] <= LANGUAGE_MAX_DISTANCE
 
 
 def get_boxes(data: bytes, box_type: bytes, as_bytes: bool = False) -> Box:
@@ -236,6 +244,141 @@ def try_ensure_utf8(data: bytes) -> bytes:
                 return data
 
 
+def append_file(path: Path, to: BinaryIO) -> int:
+    """
+    Append the contents of a file to the end of an open binary file object.
+
+    The data is copied by the kernel with copy_file_range(2) or sendfile(2) where
+    supported, so it never passes through Python. Otherwise, it is copied through a
+    large re-usable (per-thread) buffer. The file object is flushed before copying
+    but not after, so it is cheap to call for every segment of a track.
+
+    Returns the amount of bytes copied.
+    """
+    to.flush()
+    out_fd = to.fileno()
+
+    with open(path, "rb") as f:
+        in_fd = f.fileno()
+        size = os.fstat(in_fd).st_size
+        copied = 0
+
+        kernel_copies = []
+        if hasattr(os, "copy_file_range"):
+            kernel_copies.append(lambda count: os.copy_file_range(in_fd, out_fd, count))
+        if hasattr(os, "sendfile"):
+            kernel_copies.append(lambda count: os.sendfile(out_fd, in_fd, copied, count))
+
+        for kernel_copy in kernel_copies:
+            try:
+                while copied < size:
+                    n = kernel_copy(size - copied)
+                    if not n:
+                        break
+                    copied += n
+            except OSError as e:
+                if copied or e.errno not in (
+                    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+                    errno.ENOTSOCK, errno.EOPNOTSUPP, errno.ENOTSUP
+                ):
+                    raise
+                # not supported for these files or on this system, try the next method
+                continue
+            if to.seekable():
+                # the buffered writer caches its position, make it re-query it
+                to.tell()
+            if copied >= size:
+                return copied
+            f.seek(copied)
+            break
+
+        buffer = getattr(_copy_buffer, "buffer", None)
+        if buffer is None:
+            buffer = _copy_buffer.buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            to.write(buffer[:n])
+            copied += n
+
+    return copied
+
+
+def open_named_pipe(path: Path, is_reading: Callable[[], bool]) -> BinaryIO:
+    """
+    Open a named pipe to write to, once a process has opened it to read.
+
+    Opening a named pipe blocks until it's opened for reading, which it may never be
+    if the process reading it fails, so it's tried without blocking for as long as
+    `is_reading` returns True.
+
+    Raises BrokenPipeError if `is_reading` returned False before it was opened.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+        if not is_reading():
+            raise BrokenPipeError(errno.EPIPE, "The named pipe was not opened for reading", str(path))
+        time.sleep(0.01)
+
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, "wb")
+
+
+def license_in_background(license_drm: Callable[[], Any]) -> Future:
+    """
+    License DRM in a background thread, so a track's segments can download meanwhile.
+
+    The returned Future is resolved once it has been licensed, which must be waited
+    for before decrypting, see wait_for_license(). If licensing fails, pending track
+    downloads are cancelled, but only after the Future has been given the error, so a
+    download that failed from being cancelled can raise the licensing error instead.
+
+    Nothing is reported from the background thread, the status of the licensing is
+    only ever given through the Future.
+    """
+    licensing: Future = Future()
+
+    def run() -> None:
+        try:
+            license_drm()
+        except Exception as e:
+            licensing.set_exception(e)
+            DOWNLOAD_CANCELLED.set()  # skip pending track downloads
+        else:
+            licensing.set_result(None)
+        finally:
+            if not licensing.done():
+                # e.g., SystemExit, don't leave the track waiting on it forever
+                licensing.cancel()
+                DOWNLOAD_CANCELLED.set()
+
+    threading.Thread(target=run, name="licensing", daemon=True).start()
+    return licensing
+
+
+def wait_for_license(licensing: Future, progress: partial) -> None:
+    """
+    Wait for DRM that's licensing in the background to be licensed, see license_in_background().
+
+    The licensing status is reported to the track's progress callback. Raises the
+    licensing error if it failed.
+    """
+    if not licensing.done():
+        progress(downloaded="LICENSING")
+    try:
+        licensing.result()
+    except Exception:
+        progress(downloaded="[red]FAILED")
+        raise
+    progress(downloaded="[yellow]LICENSED")
+
+
 def get_free_port() -> int:
     """
     Get an available port to use between a-b (inclusive).
@@ -1,5 +1,5 @@
 import itertools
-from typing import Any, Iterable, Iterator, Sequence, Tuple, Type, Union
+from typing import Any, Callable, Iterable, Iterator, Sequence, Tuple, Type, Union
 
 
 def as_lists(*args: Any) -> Iterator[Any]:
@@ -49,3 +49,35 @@ def merge_dict(source: dict, destination: dict) -> None:
             merge_dict(value, node)
         else:
             destination[key] = value
+
+
+class LazySequence(Sequence):
+    """
+    A read-only sequence whose items are made from their index when accessed.
+
+    It's used for long sequences of items that are cheap to make but costly to keep,
+    e.g., the URLs of a track's segments. Slicing returns another lazy sequence.
+
+    Example:
+        >>> squares = LazySequence(5, lambda i: i * i)
+        >>> list(squares[1:])
+        [1, 4, 9, 16]
+    """
+
+    def __init__(self, length: Union[int, range], get: Callable[[int], Any]):
+        self._indexes = length if isinstance(length, range) else range(length)
+        self._get = get
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return LazySequence(self._indexes[index], self._get)
+        return self._get(self._indexes[index])
+
+    def __iter__(self) -> Iterator[Any]:
+        return map(self._get, self._indexes)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)})"
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+
+class ControlFile:
+    """
+    The control file of a download, e.g., "foo.mp4.!dev" for "foo.mp4".
+
+    While the control file exists, the download is not finished. It may be empty,
+    in which case the partial download cannot be resumed and should be discarded,
+    or hold a JSON object describing how far the download got so that it can be
+    resumed instead of starting over.
+    """
+
+    def __init__(self, save_path: Path):
+        self.path = save_path.with_name(f"{save_path.name}.!dev")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def create(self) -> None:
+        """Create an empty control file, marking a download that cannot be resumed."""
+        self.path.write_bytes(b"")
+
+    def load(self) -> Optional[dict[str, Any]]:
+        """Load the saved download state, or None if there is none or it's unreadable."""
+        try:
+            state = json.loads(self.path.read_bytes() or b"null")
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict):
+            return None
+        return state
+
+    def save(self, state: dict[str, Any]) -> None:
+        """
+        Save the download state.
+
+        The state is written to a temporary file which then replaces the control file,
+        so an interruption while saving cannot leave a half-written control file.
+        """
+        temp_path = self.path.with_name(f"{self.path.name}.tmp")
+        temp_path.write_text(json.dumps(state, separators=(",", ":")), encoding="utf8")
+        os.replace(temp_path, self.path)
+
+    def delete(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.path.with_name(f"{self.path.name}.tmp").unlink(missing_ok=True)
+
+
+def get_resume_state(url: str, res: Any) -> Optional[dict[str, Any]]:
+    """
+    Get the state needed to resume downloading a full (200) response with Range requests.
+
+    The response may be from Python Requests or Curl Impersonate. Returns None if the
+    download could not be resumed, e.g., the size is unknown, or the content is encoded
+    in which case byte ranges would not line up with the decoded data on disk.
+    """
+    if res.status_code != 200 or res.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None
+
+    try:
+        size = int(res.headers.get("Content-Length", "0"))
+    except ValueError:
+        return None
+    if size <= 0:
+        return None
+
+    etag = res.headers.get("ETag")
+    if etag and etag.startswith("W/"):
+        # weak validators cannot be used with If-Range
+        etag = None
+
+    return dict(
+        url=url,
+        size=size,
+        validator=etag or res.headers.get("Last-Modified"),
+        missing=[[0, size - 1]]
+    )
+
+
+def can_resume(state: Optional[dict[str, Any]], url: str) -> bool:
+    """Check that a loaded download state is for the URL and is one we can resume from."""
+    if not state or state.get("url") != url:
+        return False
+    size = state.get("size")
+    missing = state.get("missing")
+    return (
+        isinstance(size, int) and
+        isinstance(missing, list) and
+        len(missing) > 0 and
+        all(
+            isinstance(part, list) and len(part) == 2 and
+            all(isinstance(x, int) for x in part) and
+            0 <= part[0] <= part[1] < size
+            for part in missing
+        )
+    )
+
+
+def get_resume_headers(state: dict[str, Any], start: int, end: int) -> dict[str, str]:
+    """Get the headers to request a missing byte range of a download."""
+    headers = {"Range": f"bytes={start}-{end}"}
+    if state.get("validator"):
+        # the server sends the full file instead if it has changed since
+        headers["If-Range"] = state["validator"]
+    return headers
+
+
+def is_resumed(res: Any, state: dict[str, Any], start: int) -> bool:
+    """Check that a response is the requested byte range of the same file as before."""
+    content_range = res.headers.get("Content-Range", "")
+    return (
+        res.status_code == 206 and
+        content_range.startswith(f"bytes {start}-") and
+        content_range.endswith(f"/{state['size']}")
+    )
+
+
+def get_missing_size(state: dict[str, Any]) -> int:
+    """Get the amount of bytes that are still missing from a download."""
+    return sum(end - start + 1 for start, end in state["missing"] if start <= end)
+
+
+def get_segments_key(segments: Iterable[tuple[str, Optional[str]]]) -> str:
+    """
+    Get a key of a track's segment URLs and byte ranges, to tell if a saved state is theirs.
+
+    Query strings are ignored as they often hold tokens that change each time the
+    manifest is got, while the segments they point to stay the same.
+    """
+    digest = hashlib.sha1()
+    for url, byte_range in segments:
+        digest.update(f"{url.split('?', 1)[0]} {byte_range or ''}\n".encode("utf8"))
+    return digest.hexdigest()
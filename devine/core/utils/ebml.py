@@ -0,0 +1,104 @@
+from typing import Iterator, NamedTuple, Optional, Sequence, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+CONTENT_ENCODINGS = 0x6D80
+CONTENT_ENCODING = 0x6240
+CONTENT_ENCRYPTION = 0x5035
+CONTENT_ENC_KEY_ID = 0x47E2
+
+
+class ElementHeader(NamedTuple):
+    """The location of an EBML element, as absolute offsets into the data it's from."""
+    id: int  # with the length marker, as IDs are written in the Matroska specification
+    offset: int  # start of the element
+    payload: int  # start of the element's data, after its header
+    end: int  # end of the element, or of the data if it's cut off or of an unknown size
+
+
+def read_vint(data: Buffer, offset: int) -> Optional[tuple[int, int]]:
+    """
+    Read a variable-length integer, returning its value with the length marker, and its length.
+
+    Returns None if it's invalid or cut off.
+    """
+    if offset >= len(data) or not data[offset]:
+        return None
+    length = 9 - data[offset].bit_length()
+    if offset + length > len(data):
+        return None
+    return int.from_bytes(data[offset:offset + length], "big"), length
+
+
+def iter_elements(data: Buffer, start: int = 0, end: Optional[int] = None) -> Iterator[ElementHeader]:
+    """
+    Iterate the elements within a range of EBML data (e.g., WebM), without parsing them.
+
+    Only the elements at that level are yielded, use the payload range of an element
+    to iterate its children. An element that is cut off is still yielded, ending where
+    the data ends, as an init segment is often only the start of a file.
+    """
+    if end is None:
+        end = len(data)
+
+    offset = start
+    while offset < end:
+        element_id = read_vint(data, offset)
+        if not element_id:
+            break
+        size = read_vint(data, offset + element_id[1])
+        if not size:
+            break
+        payload = offset + element_id[1] + size[1]
+        value_bits = 7 * size[1]
+        size_value = size[0] & ((1 << value_bits) - 1)  # without the length marker
+        if size_value == (1 << value_bits) - 1:
+            # all ones is an unknown size, e.g., a live Segment, so it extends to the end
+            element_end = end
+        else:
+            element_end = min(payload + size_value, end)
+        yield ElementHeader(element_id[0], offset, payload, element_end)
+        offset = element_end
+
+
+def find_element(
+    data: Buffer,
+    path: Sequence[int],
+    start: int = 0,
+    end: Optional[int] = None
+) -> Optional[ElementHeader]:
+    """Get the first element at a path of element IDs within a range of EBML data."""
+    element = None
+    for element_id in path:
+        element = next((x for x in iter_elements(data, start, end) if x.id == element_id), None)
+        if not element:
+            return None
+        start, end = element.payload, element.end
+    return element
+
+
+def find_content_enc_key_ids(data: Buffer) -> list[bytes]:
+    """Get the ContentEncKeyID of each encrypted track of WebM data, in the order of the tracks."""
+    segment = find_element(data, [SEGMENT])
+    tracks = segment and find_element(data, [TRACKS], segment.payload, segment.end)
+    if not tracks:
+        return []
+
+    key_ids = []
+    for track_entry in iter_elements(data, tracks.payload, tracks.end):
+        if track_entry.id != TRACK_ENTRY:
+            continue
+        key_id = find_element(
+            data,
+            [CONTENT_ENCODINGS, CONTENT_ENCODING, CONTENT_ENCRYPTION, CONTENT_ENC_KEY_ID],
+            track_entry.payload,
+            track_entry.end
+        )
+        if key_id and key_id.end - key_id.payload:
+            key_ids.append(bytes(data[key_id.payload:key_id.end]))
+
+    return key_ids
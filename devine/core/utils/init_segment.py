@@ -0,0 +1,100 @@
+import base64
+from functools import cached_property
+from typing import Optional
+from uuid import UUID
+
+from construct import Container
+from pymp4.parser import Box
+
+from devine.core.utilities import get_boxes
+from devine.core.utils import ebml, mp4
+from devine.core.utils.subprocess import ffprobe
+
+# boxes that an MP4 init segment or the first segment of a track may start with
+MP4_FIRST_BOXES = (b"ftyp", b"styp", b"moov", b"moof", b"sidx", b"free", b"skip", b"uuid", b"emsg", b"mdat")
+
+
+class InitSegment:
+    """
+    An init segment's data, and what's been found in it.
+
+    Each value is only parsed or probed the first time it's needed, and kept from
+    then on. Get it from Track.parse_init_segment() so that finding the Key ID, the
+    PSSH, and the DRM of a track share the same results.
+
+    MP4 and WebM data is read in-process. ffprobe is only ran as a last resort, for
+    data that is neither.
+    """
+
+    def __init__(self, data: bytes):
+        if not isinstance(data, bytes):
+            raise TypeError(f"Expected data to be bytes, not {data!r}")
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self.data)} bytes)"
+
+    @property
+    def is_mp4(self) -> bool:
+        """Whether the data looks like MP4, by the type of its first box."""
+        return self.data[4:8] in MP4_FIRST_BOXES
+
+    @property
+    def is_webm(self) -> bool:
+        """Whether the data looks like WebM (or any Matroska), by its EBML header."""
+        return self.data[:4] == ebml.EBML_HEADER.to_bytes(4, "big")
+
+    @cached_property
+    def probe(self) -> dict:
+        """The stream information from ffprobe."""
+        return ffprobe(self.data)
+
+    @cached_property
+    def enc_key_id(self) -> Optional[UUID]:
+        """
+        The Key ID of the first encrypted WebM track, i.e., its ContentEncKeyID.
+
+        It's what ffprobe lists as `enc_key_id`, which MP4 data doesn't have. If the
+        data is neither WebM nor MP4, ffprobe is used to find it.
+        """
+        if self.is_webm:
+            return next((UUID(bytes=x) for x in ebml.find_content_enc_key_ids(self.data) if len(x) == 16), None)
+        if self.is_mp4:
+            return None
+        for stream in self.probe.get("streams") or []:
+            enc_key_id = stream.get("tags", {}).get("enc_key_id")
+            if enc_key_id:
+                return UUID(bytes=base64.b64decode(enc_key_id))
+        return None
+
+    @cached_property
+    def pssh_boxes(self) -> list[Container]:
+        """All pssh (Protection System Specific Header) boxes."""
+        if self.is_mp4:
+            boxes = [
+                Box.parse(self.data[box.offset:box.end])
+                for box in mp4.find_pssh_boxes(self.data)
+            ]
+            if boxes:
+                return boxes
+        # e.g., the moov box is cut off, so scan for them instead
+        return list(get_boxes(self.data, b"pssh"))
+
+    @cached_property
+    def tenc_key_ids(self) -> list[UUID]:
+        """The default Key ID of each tenc (Track Encryption) box."""
+        if self.is_mp4:
+            key_ids = [
+                UUID(bytes=self.data[box.payload + 8:box.payload + 24])
+                for box in mp4.find_tenc_boxes(self.data)
+                if box.end - box.payload >= 24
+            ]
+            if key_ids:
+                return key_ids
+        # e.g., the moov box is cut off, so scan for them instead
+        return [box.key_ID for box in get_boxes(self.data, b"tenc")]
+
+    @cached_property
+    def uuid_boxes(self) -> list[Container]:
+        """All uuid (user extension) boxes, e.g., PIFF tenc boxes."""
+        return list(get_boxes(self.data, b"uuid"))
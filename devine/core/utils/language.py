@@ -0,0 +1,51 @@
+"""
+Cached wrappers of the langcodes functions used when building and selecting tracks.
+
+The same few languages get matched and named over and over, e.g., every track
+against every wanted language, so the results are kept in bounded LRU caches.
+Languages are passed as strings so they can be used as cache keys.
+"""
+
+from functools import lru_cache
+from typing import Optional
+
+import langcodes
+from langcodes import Language
+
+
+@lru_cache(maxsize=4096)
+def closest_match(language: str, languages: tuple[str, ...], max_distance: int = 25) -> tuple[str, int]:
+    """Get the closest match of a language and its distance, see langcodes.closest_match()."""
+    return langcodes.closest_match(language, languages, max_distance)
+
+
+def closest_supported_match(language: str, languages: tuple[str, ...], max_distance: int = 25) -> Optional[str]:
+    """Get the closest match of a language, if any, see langcodes.closest_supported_match()."""
+    match, distance = closest_match(language, languages, max_distance)
+    if distance == 1000:
+        return None
+    return match
+
+
+@lru_cache(maxsize=1024)
+def get_script_and_territory_names(language: str) -> Optional[str]:
+    """
+    Get the names of a language's script and territory, where they aren't implied by the language.
+
+    For example, "Traditional, Hong Kong" for zh-Hant-HK, or None for en.
+    """
+    lang = Language.get(language)
+    if (lang.language or "").lower() == (lang.territory or "").lower():
+        lang = lang.update_dict({"territory": None})  # e.g. en-en, de-DE
+    reduced = lang.simplify_script()
+    extra_parts = []
+    if reduced.script is not None:
+        script = reduced.script_name(max_distance=25)
+        if script and script != "Zzzz":
+            extra_parts.append(script)
+    if reduced.territory is not None:
+        territory = reduced.territory_name(max_distance=25)
+        if territory and territory != "ZZ":
+            territory = territory.removesuffix(" SAR China")
+            extra_parts.append(territory)
+    return ", ".join(extra_parts) or None
@@ -0,0 +1,136 @@
+import struct
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Sequence, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class BoxHeader(NamedTuple):
+    """The location of an MP4 box, as absolute offsets into the data or file it's from."""
+    type: bytes
+    offset: int  # start of the box
+    payload: int  # start of the box's data, after its header
+    end: int  # end of the box
+
+
+def iter_boxes(data: Buffer, start: int = 0, end: Optional[int] = None) -> Iterator[BoxHeader]:
+    """
+    Iterate the boxes within a range of MP4 data, without parsing them.
+
+    Only the boxes at that level are yielded, use the payload range of a box
+    to iterate its children. Stops at the first box that is cut off.
+    """
+    if end is None:
+        end = len(data)
+
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        payload = offset + 8
+        if size == 1:
+            if payload + 8 > end:
+                break
+            size = struct.unpack_from(">Q", data, payload)[0]
+            payload += 8
+        elif size == 0:
+            # the box extends to the end of the data
+            size = end - offset
+        if size < payload - offset or offset + size > end:
+            break
+        yield BoxHeader(box_type, offset, payload, offset + size)
+        offset += size
+
+
+def iter_file_boxes(f: BinaryIO) -> Iterator[BoxHeader]:
+    """
+    Iterate the top-level boxes of an MP4 file, without reading them.
+
+    The file position is left unspecified. Stops at the first box that is cut off.
+    """
+    f.seek(0, 2)
+    file_size = f.tell()
+
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        payload = offset + 8
+        if size == 1:
+            if len(header) < 16:
+                break
+            size = struct.unpack_from(">Q", header, 8)[0]
+            payload += 8
+        elif size == 0:
+            size = file_size - offset
+        if size < payload - offset or offset + size > file_size:
+            break
+        yield BoxHeader(box_type, offset, payload, offset + size)
+        offset += size
+
+
+def find_boxes(data: Buffer, box_type: bytes, start: int = 0, end: Optional[int] = None) -> list[BoxHeader]:
+    """Get all boxes of a type within a range of MP4 data, at that level only."""
+    return [box for box in iter_boxes(data, start, end) if box.type == box_type]
+
+
+def find_box(data: Buffer, path: Sequence[bytes], start: int = 0, end: Optional[int] = None) -> Optional[BoxHeader]:
+    """
+    Get the first box at a path of box types within a range of MP4 data.
+
+    For example, `[b"mdia", b"minf", b"stbl"]` within a trak box's payload.
+    """
+    box = None
+    for box_type in path:
+        box = next((x for x in iter_boxes(data, start, end) if x.type == box_type), None)
+        if not box:
+            return None
+        start, end = box.payload, box.end
+    return box
+
+
+def get_sample_entry_children(data: Buffer, entry: BoxHeader) -> Optional[int]:
+    """
+    Get where the child boxes of an encrypted sample entry (encv or enca) start, e.g., its sinf.
+
+    Returns None for any other type of sample entry.
+    """
+    if entry.type == b"encv":
+        return entry.payload + 78  # SampleEntry and VisualSampleEntry fields
+    if entry.type == b"enca":
+        # SampleEntry and AudioSampleEntry fields, which differ by version
+        return entry.payload + {1: 44, 2: 64}.get(struct.unpack_from(">H", data, entry.payload + 8)[0], 28)
+    return None
+
+
+def find_pssh_boxes(data: Buffer) -> list[BoxHeader]:
+    """Get the pssh boxes of MP4 data, from within its moov and moof boxes."""
+    return [
+        box
+        for parent in iter_boxes(data)
+        if parent.type in (b"moov", b"moof")
+        for box in find_boxes(data, b"pssh", parent.payload, parent.end)
+    ]
+
+
+def find_tenc_boxes(data: Buffer) -> list[BoxHeader]:
+    """
+    Get the tenc boxes of MP4 data, from the encrypted sample entries of each track.
+
+    i.e., moov/trak/mdia/minf/stbl/stsd/encv|enca/sinf/schi/tenc.
+    """
+    moov = next((box for box in iter_boxes(data) if box.type == b"moov"), None)
+    if not moov:
+        return []
+
+    tenc_boxes = []
+    for trak in find_boxes(data, b"trak", moov.payload, moov.end):
+        stsd = find_box(data, [b"mdia", b"minf", b"stbl", b"stsd"], trak.payload, trak.end)
+        if not stsd:
+            continue
+        for entry in iter_boxes(data, stsd.payload + 8, stsd.end):
+            children = get_sample_entry_children(data, entry)
+            tenc = children and find_box(data, [b"sinf", b"schi", b"tenc"], children, entry.end)
+            if tenc:
+                tenc_boxes.append(tenc)
+
+    return tenc_boxes
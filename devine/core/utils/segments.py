@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from array import array
+from typing import Optional
+
+
+class Segments:
+    """
+    The timing and byte ranges of a track's segments.
+
+    It's kept in a track's data for the life of the track, and a track may have many
+    thousands of segments, so each value is stored in a compact array instead of as
+    a list of Python ints. The byte range arrays are only made once a segment has one.
+
+    Times and durations are in units of the timescale, e.g., 1000 for milliseconds.
+    """
+
+    def __init__(self, timescale: int = 1):
+        self.timescale = timescale
+        self.start = array("q")
+        self.duration = array("q")
+        self.range_start: Optional[array] = None  # -1 if a segment has no byte range
+        self.range_end: Optional[array] = None  # -1 if the byte range has no end
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)}, timescale={self.timescale})"
+
+    def append(self, duration: int, start: Optional[int] = None, byte_range: Optional[str] = None) -> None:
+        """
+        Add a segment, starting where the last segment ended unless a start time is given.
+
+        The byte range is in the format of a Range header or mediaRange, e.g., "0-499".
+        """
+        self.extend(duration, 1, start)
+        if byte_range:
+            if self.range_start is None or self.range_end is None:
+                self.range_start = array("q", [-1]) * len(self)
+                self.range_end = array("q", [-1]) * len(self)
+            range_start, range_end = byte_range.split("-")
+            self.range_start[-1] = int(range_start)
+            self.range_end[-1] = int(range_end) if range_end else -1
+
+    def extend(self, duration: int, count: int, start: Optional[int] = None) -> None:
+        """
+        Add segments of the same duration, without byte ranges, e.g., a SegmentTimeline entry.
+
+        They start where the last segment ended unless a start time is given.
+        """
+        if start is None:
+            start = self.start[-1] + self.duration[-1] if self else 0
+        self.start.extend(range(start, start + duration * count, duration) if duration else [start] * count)
+        self.duration.extend(array("q", [duration]) * count)
+        if self.range_start is not None and self.range_end is not None:
+            self.range_start.extend(array("q", [-1]) * count)
+            self.range_end.extend(array("q", [-1]) * count)
+
+    def get_byte_range(self, index: int) -> Optional[str]:
+        """Get the byte range of a segment, in the format it was added in, if it has one."""
+        if self.range_start is None or self.range_end is None or self.range_start[index] < 0:
+            return None
+        range_end = self.range_end[index]
+        return f"{self.range_start[index]}-{range_end if range_end >= 0 else ''}"
@@ -5,6 +5,8 @@ from typing import Optional
 
 from pycaption import Caption, CaptionList, CaptionNode, CaptionReadError, WebVTTReader, WebVTTWriter
 
+from devine.core.utils.segments import Segments
+
 
 class CaptionListExt(CaptionList):
     @typing.no_type_check
@@ -121,7 +123,7 @@ class WebVTTReaderExt(WebVTTReader):
         return (milliseconds / 1000) + seconds + (minutes * 60) + (hours * 3600)
 
 
-def merge_segmented_webvtt(vtt_raw: str, segment_durations: Optional[list[int]] = None, timescale: int = 1) -> str:
+def merge_segmented_webvtt(vtt_raw: str, segments: Optional[Segments] = None) -> str:
     """
     Merge Segmented WebVTT data.
 
@@ -129,9 +131,8 @@ def merge_segmented_webvtt(vtt_raw: str, segment_durations: Optional[list[int]]
         vtt_raw: The concatenated WebVTT files to merge. All WebVTT headers must be
             appropriately spaced apart, or it may produce unwanted effects like
             considering headers as captions, timestamp lines, etc.
-        segment_durations: A list of each segment's duration. If not provided it will try
-            to get it from the X-TIMESTAMP-MAP headers, specifically the MPEGTS number.
-        timescale: The number of time units per second.
+        segments: The timing of each segment. If not provided it will try to get it
+            from the X-TIMESTAMP-MAP headers, specifically the MPEGTS number.
 
     This parses the X-TIMESTAMP-MAP data to compute new absolute timestamps, replacing
     the old start and end timestamp values. All X-TIMESTAMP-MAP header information will
@@ -151,16 +152,16 @@ def merge_segmented_webvtt(vtt_raw: str, segment_durations: Optional[list[int]]
         if captions[0].segment_index == 0:
             first_segment_mpegts = captions[0].mpegts
         else:
-            first_segment_mpegts = segment_durations[0] if segment_durations else captions.first_segment_mpegts
+            first_segment_mpegts = segments.start[0] if segments else captions.first_segment_mpegts
 
         caption: CaptionExt
         for i, caption in enumerate(captions):
             # DASH WebVTT doesn't have MPEGTS timestamp like HLS. Instead,
             # calculate the timestamp from SegmentTemplate/SegmentList duration.
             likely_dash = first_segment_mpegts == 0 and caption.mpegts == 0
-            if likely_dash and segment_durations:
-                duration = segment_durations[caption.segment_index]
-                caption.mpegts = MPEG_TIMESCALE * (duration / timescale)
+            if likely_dash and segments:
+                start = segments.start[caption.segment_index]
+                caption.mpegts = MPEG_TIMESCALE * (start / segments.timescale)
 
             if caption.mpegts == 0:
                 continue
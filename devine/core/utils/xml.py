@@ -9,16 +9,12 @@ def load_xml(xml: Union[str, bytes]) -> ElementTree:
     if not isinstance(xml, bytes):
         xml = xml.encode("utf8")
     root = etree.fromstring(xml)
-    for elem in root.getiterator():
-        if not hasattr(elem.tag, "find"):
-            # e.g. comment elements
-            continue
-        elem.tag = etree.QName(elem).localname
-        for name, value in elem.attrib.items():
-            local_name = etree.QName(name).localname
-            if local_name == name:
-                continue
-            del elem.attrib[name]
-            elem.attrib[local_name] = value
+    for elem in root.iter(etree.Element):  # i.e., skipping comments and processing instructions
+        tag = elem.tag
+        if tag[0] == "{":
+            elem.tag = tag.split("}", 1)[1]
+        attrib = elem.attrib
+        for name in [x for x in attrib.keys() if x[0] == "{"]:
+            attrib[name.split("}", 1)[1]] = attrib.pop(name)
     etree.cleanup_namespaces(root)
     return root